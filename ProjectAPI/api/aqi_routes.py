@@ -1,32 +1,49 @@
-from fastapi import APIRouter, HTTPException, Depends, Header
-from pydantic import BaseModel
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from influxdb_client import Point
 from sqlalchemy.orm import Session
 import pytz
 import os
 from dotenv import load_dotenv
-from typing import Optional
+from typing import Optional, List
 import logging
-from datetime import datetime
+import json
+import csv
+import codecs
+from datetime import datetime, timedelta
 
 # from models import *
 # from database import *
 
 from api.models import *
 from api.database import *
+from api.influx_writer import BufferedInfluxWriter, WriteBufferFull
+from api.node_registry import node_registry
+from api.heartbeat import heartbeats
+from api.latest_readings import latest_readings, LATEST_FIELDS
+from api.result_cache import period_cache, is_period_closed
+from api.months_catalog import months_catalog, month_of
+from api.flux_decode import iter_rows, pivot_rows, clean_reading_value
+from api.influx_client import influx_clients, AsyncWriteApi
+from api.downsample import downsample, DOWNSAMPLE_METHODS
+from api.export_stream import EXPORT_FORMATS, iter_csv_chunks, iter_ndjson_chunks, gzip_chunks, content_disposition
 
 load_dotenv()
 
-INFLUXDB_URL = os.getenv("INFLUXDB_URL")
-INFLUXDB_TOKEN = os.getenv("INFLUXDB_TOKEN")
-INFLUXDB_ORG = os.getenv("INFLUXDB_ORG")
-INFLUXDB_BUCKET = os.getenv("INFLUXDB_BUCKET")
+INFLUXDB_ORG = influx_clients.org
+INFLUXDB_BUCKET = influx_clients.bucket
 
+MAX_BATCH_READINGS = int(os.getenv("AQI_MAX_BATCH_READINGS", "1000"))
+MAX_FUTURE_SKEW = timedelta(minutes=5)
+BANGKOK_TZ = pytz.timezone("Asia/Bangkok")
 
-write_client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-write_api = write_client.write_api(write_options=SYNCHRONOUS)
-query_api = write_client.query_api()
+SUMMARY_FIELDS = ["AQI", "PM1", "PM2_5", "PM4", "PM10", "CO2", "temperature", "humidity"]
+LATEST_FIELDS_FILTER = " or ".join(f'r["_field"] == "{field}"' for field in LATEST_FIELDS)
+
+influx_writer = BufferedInfluxWriter(AsyncWriteApi(influx_clients), INFLUXDB_BUCKET, INFLUXDB_ORG)
 
 logger = logging.getLogger(__name__)
 
@@ -41,12 +58,42 @@ class AirQualityData(BaseModel):
     temperature: float
     humidity: float
 
+class AirQualityReading(AirQualityData):
+    timestamp: datetime
+
+class AirQualityBatch(BaseModel):
+    readings: List[AirQualityReading] = Field(..., min_length=1, max_length=MAX_BATCH_READINGS)
+
+def build_air_quality_point(node_name: str, data: AirQualityData, timestamp: Optional[datetime] = None) -> Point:
+    """สร้าง Point ของ measurement air_quality จากค่าที่วัดได้ 1 ครั้ง"""
+    point = (
+        Point("air_quality")
+        .tag("node_name", node_name)
+        .field("PM1", float(data.PM1))
+        .field("PM2_5", float(data.PM2_5))
+        .field("PM4", float(data.PM4))
+        .field("PM10", float(data.PM10))
+        .field("CO2", float(data.CO2))
+        .field("temperature", float(data.temperature))
+        .field("humidity", float(data.humidity))
+    )
+    if timestamp is not None:
+        point = point.time(timestamp)
+    return point
+
+def normalize_reading_time(timestamp: datetime) -> datetime:
+    """แปลงเวลาให้เป็น UTC (เวลาที่ไม่มี timezone ถือเป็นเวลาไทย)"""
+    if timestamp.tzinfo is None:
+        timestamp = BANGKOK_TZ.localize(timestamp)
+    return timestamp.astimezone(pytz.UTC)
+
 async def verify_node_token(
     node_name: Optional[str] = None,
     node_token: Optional[str] = Header(None, alias="X-Node-Token"),
     db: Session = Depends(get_db)
 ):
-    """ตรวจสอบ node token (โดยจะค้นหาจาก node_name หรือจาก token อย่างเดียวก็ได้)"""
+    """ตรวจสอบ node token (โดยจะค้นหาจาก node_name หรือจาก token อย่างเดียวก็ได้)
+    ใช้ node_registry ใน memory ก่อน แล้วค่อยถาม PostgreSQL เมื่อไม่พบ"""
     if not node_token:
         raise HTTPException(
             status_code=401,
@@ -54,10 +101,18 @@ async def verify_node_token(
         )
 
     try:
+        # โหลดใหม่ใน background ระหว่างนี้ใช้ข้อมูลเดิม (node ที่ไม่พบจะถาม PostgreSQL ด้านล่าง)
+        node_registry.refresh_in_background()
+
+        entry = node_registry.get(node_token)
+        if entry and (not node_name or entry.node_name == node_name):
+            return entry
+
         if node_name:
-            node = db.query(Nodes).filter(Nodes.node_name == node_name).first()
+            lookup = db.query(Nodes).filter(Nodes.node_name == node_name)
         else:
-            node = db.query(Nodes).filter(Nodes.node_token == node_token).first()
+            lookup = db.query(Nodes).filter(Nodes.node_token == node_token)
+        node = await run_in_threadpool(lookup.first)
         if not node:
             raise HTTPException(
                 status_code=404,
@@ -70,24 +125,36 @@ async def verify_node_token(
                 detail={"status": 0, "message": "Invalid node token", "data": {}}
             )
         
-        return node
+        return node_registry.upsert(node)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail={"status": 0, "message": f"Token verification error: {str(e)}", "data": {}}
         )
 
+ROW_COLUMNS = ("_time", "_value", "_field", "node_name")
+
+def query_rows(query: str, columns=ROW_COLUMNS):
+    """รัน Flux query แบบ blocking แล้วคืนแถวที่ถอดรหัสแบบ streaming (ใช้นอก event loop เท่านั้น)"""
+    return influx_clients.query_rows(query, columns)
+
+async def query_rows_async(query: str, columns=ROW_COLUMNS):
+    """รัน Flux query ผ่าน client แบบ async (ไม่ block event loop) สำหรับ route handler"""
+    return await influx_clients.fetch_rows(query, columns)
+
 async def verify_node_access(
     node_name: str,
     user_id: int,
     db: Session = Depends(get_db)
 ):
     """ตรวจสอบว่าผู้ใช้มีสิทธิ์เข้าถึงข้อมูลของ node นี้"""
-    node = db.query(Nodes).filter(
+    node = await run_in_threadpool(db.query(Nodes).filter(
         Nodes.node_name == node_name,
         Nodes.user_id == user_id
-    ).first()
+    ).first)
     
     if not node:
         raise HTTPException(
@@ -100,17 +167,11 @@ async def verify_node_access(
 async def process_aggregated_query(query: str, period: str, node_name: str):
     """ฟังก์ชันสำหรับประมวลผลข้อมูล query"""
     try:
-        result = query_api.query(org=INFLUXDB_ORG, query=query)
-        data = []
-        
-        for table in result:
-            for record in table.records:
-                data_point = {
-                    "field": record.values.get("_field", ""),
-                    "value": round(float(record.values.get("_value", 0)), 2),
-                    "timestamp": record.values.get("_time", "").astimezone(pytz.timezone("Asia/Bangkok")).isoformat()
-                }
-                data.append(data_point)
+        data = [{
+            "field": row.get("_field") or "",
+            "value": round(float(row.get("_value") or 0), 2),
+            "timestamp": row["_time"].astimezone(BANGKOK_TZ).isoformat()
+        } for row in await query_rows_async(query)]
         
         if not data:
             raise HTTPException(
@@ -145,6 +206,38 @@ async def process_aggregated_query(query: str, period: str, node_name: str):
             }
         )
 
+async def write_points(points: List[Point], wait: bool):
+    """ส่ง point เข้า write buffer และแปลง error ของ writer เป็น HTTPException"""
+    try:
+        await influx_writer.enqueue(points, wait=wait)
+    except WriteBufferFull as e:
+        logger.warning(f"InfluxDB write buffer full: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail={"status": 0, "message": "Write buffer is full, please retry later", "data": {}},
+            headers={"Retry-After": "5"}
+        )
+    except Exception as e:
+        logger.error(f"InfluxDB write error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={"status": 0, "message": "Failed to write data", "data": {}}
+        )
+
+def record_data_months(node_name: str, timestamps: List[datetime], db: Session):
+    """อัปเดตดัชนีเดือนที่มีข้อมูล (ไม่ให้ความผิดพลาดของดัชนีทำให้การรับข้อมูลล้มเหลว)"""
+    try:
+        months_catalog.record(node_name, {month_of(ts) for ts in timestamps}, db)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to update data months for {node_name}: {str(e)}")
+
+def ingest_response(wait: bool, content: dict):
+    """wait=False ตอบกลับด้วย 202 Accepted เพราะข้อมูลยังอยู่ใน buffer"""
+    if wait:
+        return content
+    return JSONResponse(status_code=202, content=content)
+
 def handle_query_error(e: Exception):
     """ฟังก์ชันจัดการ error"""
     if isinstance(e, HTTPException):
@@ -161,10 +254,12 @@ def handle_query_error(e: Exception):
 @aqi_router.post("/", summary="Submit Air Quality Data (Token Only)")
 async def submit_air_quality_data(
     data: AirQualityData,
+    wait: bool = True,
     node_token: str = Header(..., alias="X-Node-Token"),
     db: Session = Depends(get_db)
 ):
-    """Submit air quality data to InfluxDB. Node name is derived from token."""
+    """Submit air quality data to InfluxDB. Node name is derived from token.
+    wait=false returns 202 Accepted as soon as the reading is buffered."""
     try:
         node = await verify_node_token(node_token=node_token, db=db)
         if not node:
@@ -175,37 +270,84 @@ async def submit_air_quality_data(
             )
         node_name = node.node_name
 
-        try:
-            point = (
-                Point("air_quality")
-                .tag("node_name", node_name)
-                .field("PM1", float(data.PM1))
-                .field("PM2_5", float(data.PM2_5))
-                .field("PM4", float(data.PM4))
-                .field("PM10", float(data.PM10))
-                .field("CO2", float(data.CO2))
-                .field("temperature", float(data.temperature))
-                .field("humidity", float(data.humidity))
-            )
-            write_api.write(bucket=INFLUXDB_BUCKET, record=point)
-            
-            logger.info(f"Data recorded for node: {node_name}")
-            return {
-                "status": 1,
-                "message": "Air quality data recorded successfully",
-                "data": {
-                    "node_name": node_name,
-                    "timestamp": datetime.now().isoformat()
-                }
+        received_at = datetime.now(pytz.UTC)
+        point = build_air_quality_point(node_name, data, received_at)
+        await write_points([point], wait)
+        latest_readings.record(node_name, received_at, data.dict())
+        heartbeats.touch(node_name, received_at)
+        await run_in_threadpool(record_data_months, node_name, [received_at], db)
+
+        logger.info(f"Data {'recorded' if wait else 'accepted'} for node: {node_name}")
+        return ingest_response(wait, {
+            "status": 1,
+            "message": "Air quality data recorded successfully" if wait else "Air quality data accepted",
+            "data": {
+                "node_name": node_name,
+                "timestamp": datetime.now().isoformat()
             }
+        })
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={"status": 0, "message": "Internal server error", "data": {}}
+        )
 
-        except Exception as e:
-            logger.error(f"InfluxDB write error: {str(e)}")
+@aqi_router.post("/batch", summary="Submit Batch of Air Quality Readings (Token Only)")
+async def submit_air_quality_batch(
+    batch: AirQualityBatch,
+    wait: bool = True,
+    node_token: str = Header(..., alias="X-Node-Token"),
+    db: Session = Depends(get_db)
+):
+    """บันทึกข้อมูลหลายชุดที่ node เก็บสะสมไว้ ด้วยการตรวจสอบ token และเขียน InfluxDB เพียงครั้งเดียว"""
+    try:
+        node = await verify_node_token(node_token=node_token, db=db)
+        node_name = node.node_name
+
+        latest_allowed = datetime.now(pytz.UTC) + MAX_FUTURE_SKEW
+        points = []
+        timestamps = []
+        invalid_indexes = []
+        for index, reading in enumerate(batch.readings):
+            timestamp = normalize_reading_time(reading.timestamp)
+            if timestamp > latest_allowed:
+                invalid_indexes.append(index)
+                continue
+            points.append(build_air_quality_point(node_name, reading, timestamp))
+            timestamps.append(timestamp)
+
+        if invalid_indexes:
             raise HTTPException(
-                status_code=500,
-                detail={"status": 0, "message": "Failed to write data", "data": {}}
+                status_code=400,
+                detail={
+                    "status": 0,
+                    "message": "Readings have timestamps in the future",
+                    "data": {"invalid_indexes": invalid_indexes}
+                }
             )
 
+        await write_points(points, wait)
+        newest_index = max(range(len(timestamps)), key=timestamps.__getitem__)
+        latest_readings.record(node_name, timestamps[newest_index], batch.readings[newest_index].dict())
+        heartbeats.touch(node_name)
+        await run_in_threadpool(record_data_months, node_name, timestamps, db)
+
+        logger.info(f"Batch of {len(points)} readings {'recorded' if wait else 'accepted'} for node: {node_name}")
+        return ingest_response(wait, {
+            "status": 1,
+            "message": "Air quality batch recorded successfully" if wait else "Air quality batch accepted",
+            "data": {
+                "node_name": node_name,
+                "count": len(points),
+                "first_timestamp": min(timestamps).astimezone(BANGKOK_TZ).isoformat(),
+                "last_timestamp": max(timestamps).astimezone(BANGKOK_TZ).isoformat()
+            }
+        })
+
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -246,37 +388,108 @@ async def get_air_quality_data(
     except Exception as e:
         raise handle_query_error(e)
 
-@aqi_router.get("/months/{node_name}", summary="Get months that have data")
-async def get_months_with_data(
+@aqi_router.get("/export/{node_name}", summary="Export raw air quality readings (CSV / NDJSON)")
+async def export_air_quality_data(
     node_name: str,
+    start: datetime,
+    stop: Optional[datetime] = None,
+    export_format: str = Query("csv", alias="format"),
+    compress: bool = Query(False, alias="gzip"),
+    user_id: int = None,
     db: Session = Depends(get_db)
 ):
     """
-    แสดงรายชื่อเดือน (yyyy-mm) ที่มีข้อมูล air_quality ของ node_name นี้ใน InfluxDB
+    ส่งออกข้อมูลดิบของ node ในช่วงเวลาที่กำหนดแบบ streaming (หน่วยความจำคงที่ไม่ว่าช่วงเวลาจะยาวแค่ไหน)
+    - format: csv หรือ ndjson
+    - gzip: true เพื่อบีบอัด (Content-Encoding: gzip)
+    - เวลาที่ไม่มี timezone ถือเป็นเวลาไทย
     """
     try:
+        if user_id:
+            await verify_node_access(node_name, user_id, db)
+
+        if export_format not in EXPORT_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail={"status": 0, "message": f"format ต้องเป็น {list(EXPORT_FORMATS)}", "data": {}}
+            )
+
+        start_utc = normalize_reading_time(start)
+        stop_utc = normalize_reading_time(stop) if stop else datetime.now(pytz.UTC)
+        if stop_utc <= start_utc:
+            raise HTTPException(
+                status_code=400,
+                detail={"status": 0, "message": "stop ต้องมากกว่า start", "data": {}}
+            )
+
+        fields = LATEST_FIELDS
         query = f'''
             from(bucket: "{INFLUXDB_BUCKET}")
-              |> range(start: -2y)
+              |> range(start: {start_utc.strftime("%Y-%m-%dT%H:%M:%SZ")}, stop: {stop_utc.strftime("%Y-%m-%dT%H:%M:%SZ")})
               |> filter(fn: (r) => r["_measurement"] == "air_quality")
               |> filter(fn: (r) => r["node_name"] == "{node_name}")
-              |> sample(n: 500)
-              |> keep(columns: ["_time"])
-              |> sort(columns: ["_time"])
+              |> filter(fn: (r) => {LATEST_FIELDS_FILTER})
+              |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+              |> keep(columns: ["_time", {", ".join(f'"{field}"' for field in fields)}])
         '''
-        
-        result = query_api.query(org=INFLUXDB_ORG, query=query)
-        months_set = set()
-        
-        for table in result:
-            for record in table.records:
-                time_value = record.get_time()
-                if time_value:
-                    month_str = time_value.strftime("%Y-%m")
-                    months_set.add(month_str)
-
-        months = sorted(list(months_set))
-        
+
+        encode = iter_csv_chunks if export_format == "csv" else iter_ndjson_chunks
+
+        def open_export():
+            # ส่ง query (HTTP แบบ blocking) และดึงก้อนแรกใน thread เดียวกัน
+            # ดึงก้อนแรกก่อนตอบกลับ เพื่อให้ error จาก InfluxDB กลายเป็น HTTP error แทนการตัดการเชื่อมต่อกลางทาง
+            response = influx_clients.query_api().query_raw(query, org=INFLUXDB_ORG)
+            try:
+                csv_rows = csv.reader(codecs.iterdecode(response, "utf-8"))
+                chunks = encode(iter_rows(csv_rows, ("_time", *fields), raw=export_format == "csv"), fields)
+                if compress:
+                    chunks = gzip_chunks(chunks)
+                return response, chunks, next(chunks, b"")
+            except Exception:
+                response.close()
+                raise
+
+        # สร้าง header ก่อนเปิด query เพื่อไม่ให้ error ตรงนี้ทำให้ connection ของ InfluxDB ค้าง
+        filename = f"{node_name}_{start_utc:%Y%m%d%H%M}_{stop_utc:%Y%m%d%H%M}.{export_format}"
+        headers = {"Content-Disposition": content_disposition(filename)}
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+
+        influx_response, chunks, first_chunk = await run_in_threadpool(open_export)
+
+        def stream():
+            try:
+                yield first_chunk
+                yield from chunks
+            finally:
+                influx_response.close()
+
+        try:
+            # background ปิด connection ของ InfluxDB ด้วยเมื่อ client ตัดการเชื่อมต่อก่อนส่งครบ
+            return StreamingResponse(
+                stream(),
+                media_type=EXPORT_FORMATS[export_format],
+                headers=headers,
+                background=BackgroundTask(influx_response.close)
+            )
+        except Exception:
+            influx_response.close()
+            raise
+
+    except Exception as e:
+        raise handle_query_error(e)
+
+@aqi_router.get("/months/{node_name}", summary="Get months that have data")
+async def get_months_with_data(
+    node_name: str,
+    db: Session = Depends(get_db)
+):
+    """
+    แสดงรายชื่อเดือน (yyyy-mm) ที่มีข้อมูล air_quality ของ node_name นี้ จากดัชนี node_data_months
+    """
+    try:
+        months = await run_in_threadpool(months_catalog.months_or_scan, node_name, db)
+
         return {
             "status": 1,
             "message": "ดึงเดือนที่มีข้อมูลสำเร็จ",
@@ -309,48 +522,25 @@ async def get_daily_summary_24h(
         else:
             end_date = datetime(year, mon + 1, 1) - timedelta(seconds=1)
 
+        cache_key = ("daily", node_name, month)
+        cached = period_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         query = f'''
             from(bucket: "{INFLUXDB_BUCKET}")
               |> range(start: {start_date.isoformat()}Z, stop: {end_date.isoformat()}Z)
               |> filter(fn: (r) => r["_measurement"] == "AirQualitySummary24h")
               |> filter(fn: (r) => r["node_name"] == "{node_name}")
         '''
-        result = query_api.query(org=INFLUXDB_ORG, query=query)
-        
-        daily_data = {}
-        for table in result:
-            for record in table.records:
-                date_str = record.get_time().strftime("%Y-%m-%d")
-                field = record.values.get("_field")
-                value = record.values.get("_value")
-                
-                if date_str not in daily_data:
-                    daily_data[date_str] = {"date": date_str}
-                
-                if value is not None and isinstance(value, (int, float)):
-                    if str(value).lower() in ['nan', 'inf', '-inf'] or value < 0:
-                        daily_data[date_str][field] = 0.0
-                    else:
-                        daily_data[date_str][field] = round(float(value), 2)
-                else:
-                    daily_data[date_str][field] = 0.0
-        
-        data = []
-        for date_str in sorted(daily_data.keys()):
-            day_record = daily_data[date_str]
-            data.append({
-                "date": day_record.get("date"),
-                "AQI": day_record.get("AQI", 0.0),
-                "PM1": day_record.get("PM1", 0.0),
-                "PM2_5": day_record.get("PM2_5", 0.0),
-                "PM4": day_record.get("PM4", 0.0),
-                "PM10": day_record.get("PM10", 0.0),
-                "CO2": day_record.get("CO2", 0.0),
-                "temperature": day_record.get("temperature", 0.0),
-                "humidity": day_record.get("humidity", 0.0),
-            })
+        daily_data = pivot_rows(await query_rows_async(query), key=lambda row: row["_time"].strftime("%Y-%m-%d"))
+
+        data = [{
+            "date": date_str,
+            **{field: daily_data[date_str].get(field, 0.0) for field in SUMMARY_FIELDS}
+        } for date_str in sorted(daily_data)]
         
-        return {
+        response = {
             "status": 1,
             "message": "ดึงข้อมูลสรุปรายวันสำเร็จ",
             "data": data,
@@ -360,6 +550,8 @@ async def get_daily_summary_24h(
                 "total_days": len(data)
             }
         }
+        period_cache.put(cache_key, response, immutable=bool(data) and is_period_closed(end_date + timedelta(seconds=1)))
+        return response
     except Exception as e:
         raise handle_query_error(e)
 
@@ -378,54 +570,26 @@ async def get_hourly_summary(
         start_date = date_obj
         end_date = date_obj + timedelta(days=1) - timedelta(seconds=1)
 
+        cache_key = ("hourly", node_name, date)
+        cached = period_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         query = f'''
             from(bucket: "{INFLUXDB_BUCKET}")
               |> range(start: {start_date.isoformat()}Z, stop: {end_date.isoformat()}Z)
               |> filter(fn: (r) => r["_measurement"] == "AirQualitySummary")
               |> filter(fn: (r) => r["node_name"] == "{node_name}")
         '''
-        result = query_api.query(org=INFLUXDB_ORG, query=query)
-        
-        hourly_data = {}
-        for table in result:
-            for record in table.records:
-                time_obj = record.get_time()
-                hour_str = time_obj.strftime("%H:%M")
-                datetime_str = time_obj.strftime("%Y-%m-%d %H:%M:%S")
-                field = record.values.get("_field")
-                value = record.values.get("_value")
-                
-                if hour_str not in hourly_data:
-                    hourly_data[hour_str] = {
-                        "time": hour_str,
-                        "datetime": datetime_str
-                    }
-                
-                if value is not None and isinstance(value, (int, float)):
-                    if str(value).lower() in ['nan', 'inf', '-inf'] or value < 0:
-                        hourly_data[hour_str][field] = 0.0
-                    else:
-                        hourly_data[hour_str][field] = round(float(value), 2)
-                else:
-                    hourly_data[hour_str][field] = 0.0
-        
-        data = []
-        for hour_str in sorted(hourly_data.keys()):
-            hour_record = hourly_data[hour_str]
-            data.append({
-                "time": hour_record.get("time"),
-                "datetime": hour_record.get("datetime"),
-                "AQI": hour_record.get("AQI", 0.0),
-                "PM1": hour_record.get("PM1", 0.0),
-                "PM2_5": hour_record.get("PM2_5", 0.0),
-                "PM4": hour_record.get("PM4", 0.0),
-                "PM10": hour_record.get("PM10", 0.0),
-                "CO2": hour_record.get("CO2", 0.0),
-                "temperature": hour_record.get("temperature", 0.0),
-                "humidity": hour_record.get("humidity", 0.0),
-            })
+        hourly_data = pivot_rows(await query_rows_async(query), key=lambda row: row["_time"].strftime("%H:%M"))
+
+        data = [{
+            "time": hour_str,
+            "datetime": hourly_data[hour_str]["_time"].strftime("%Y-%m-%d %H:%M:%S"),
+            **{field: hourly_data[hour_str].get(field, 0.0) for field in SUMMARY_FIELDS}
+        } for hour_str in sorted(hourly_data)]
         
-        return {
+        response = {
             "status": 1,
             "message": "ดึงข้อมูลสรุปรายชั่วโมงสำเร็จ",
             "data": data,
@@ -435,6 +599,8 @@ async def get_hourly_summary(
                 "total_hours": len(data)
             }
         }
+        period_cache.put(cache_key, response, immutable=bool(data) and is_period_closed(end_date + timedelta(seconds=1)))
+        return response
     except ValueError:
         raise HTTPException(
             status_code=400,
@@ -443,17 +609,71 @@ async def get_hourly_summary(
     except Exception as e:
         raise handle_query_error(e)
 
+GRAPH_WINDOWS = {
+    "24h": ("1h", "AirQualitySummary"),
+    "7d": ("1d", "AirQualitySummary24h"),
+    "30d": ("1d", "AirQualitySummary24h"),
+}
+
+GRAPH_TIME_FORMATS = {
+    "24h": ("%H:%M", "%Y-%m-%d %H:%M:%S"),
+    "7d": ("%m-%d", "%Y-%m-%d"),
+    "30d": ("%m-%d", "%Y-%m-%d"),
+}
+
+class GraphStatistics:
+    """สะสม min/max/avg ของค่าที่มากกว่า 0 แบบ streaming"""
+    __slots__ = ("min", "max", "total", "count")
+
+    def __init__(self):
+        self.min = None
+        self.max = None
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value: float):
+        if value <= 0:
+            return
+        if self.count == 0 or value < self.min:
+            self.min = value
+        if self.count == 0 or value > self.max:
+            self.max = value
+        self.total += value
+        self.count += 1
+
+    def as_dict(self) -> dict:
+        if not self.count:
+            return {"min": 0, "max": 0, "avg": 0, "count": 0}
+        return {
+            "min": round(self.min, 2),
+            "max": round(self.max, 2),
+            "avg": round(self.total / self.count, 2),
+            "count": self.count
+        }
+
+def graph_statistics(values) -> dict:
+    stats = GraphStatistics()
+    for value in values:
+        stats.add(value)
+    return stats.as_dict()
+
 @aqi_router.get("/graph/{node_name}/{time_range}", summary="Get graph data by time range")
 async def get_graph_data(
     node_name: str,
     time_range: str,
     data_type: str = "AQI",
+    resolution: str = "summary",
+    max_points: Optional[int] = None,
+    downsample_method: str = Query("lttb", alias="downsample"),
     db: Session = Depends(get_db)
 ):
     """
     ดึงข้อมูลสำหรับแสดงกราฟตาม time range ที่กำหนด
     - time_range: "24h" (24 ชั่วโมง), "7d" (7 วัน), "30d" (30 วัน)
     - data_type: ประเภทข้อมูลที่ต้องการ (AQI, PM1, PM2_5, PM4, PM10, CO2, temperature, humidity)
+    - resolution: "summary" (ค่าเฉลี่ยรายชั่วโมง/รายวัน) หรือ "raw" (ข้อมูลดิบจาก air_quality, ไม่มี AQI)
+    - max_points: จำนวนจุดสูงสุดที่ต้องการ ลดจุดฝั่ง server ด้วย downsample ("lttb" หรือ "minmax")
+      โดย statistics ยังคำนวณจากข้อมูลทั้งหมด
     """
     try:
         valid_time_ranges = ["24h", "7d", "30d"]
@@ -470,67 +690,67 @@ async def get_graph_data(
                 detail={"status": 0, "message": f"data_type ต้องเป็น {valid_data_types}", "data": {}}
             )
 
-        if time_range == "24h":
-            window = "1h"
-            measurement = "AirQualitySummary"
-        elif time_range == "7d":
-            window = "1d"
-            measurement = "AirQualitySummary24h"
+        if resolution not in ("summary", "raw"):
+            raise HTTPException(
+                status_code=400,
+                detail={"status": 0, "message": "resolution ต้องเป็น summary หรือ raw", "data": {}}
+            )
+
+        if resolution == "raw" and data_type not in LATEST_FIELDS:
+            raise HTTPException(
+                status_code=400,
+                detail={"status": 0, "message": f"resolution=raw รองรับเฉพาะ {LATEST_FIELDS}", "data": {}}
+            )
+
+        if max_points is not None and max_points < 3:
+            raise HTTPException(
+                status_code=400,
+                detail={"status": 0, "message": "max_points ต้องมีค่าอย่างน้อย 3", "data": {}}
+            )
+
+        if downsample_method not in DOWNSAMPLE_METHODS:
+            raise HTTPException(
+                status_code=400,
+                detail={"status": 0, "message": f"downsample ต้องเป็น {list(DOWNSAMPLE_METHODS)}", "data": {}}
+            )
+
+        if resolution == "raw":
+            window = None
+            measurement = "air_quality"
         else:
-            window = "1d"
-            measurement = "AirQualitySummary24h"
+            window, measurement = GRAPH_WINDOWS[time_range]
 
+        aggregate = f"|> aggregateWindow(every: {window}, fn: mean, createEmpty: false)" if window else ""
         query = f'''
             from(bucket: "{INFLUXDB_BUCKET}")
               |> range(start: -{time_range})
               |> filter(fn: (r) => r["_measurement"] == "{measurement}")
               |> filter(fn: (r) => r["node_name"] == "{node_name}")
               |> filter(fn: (r) => r["_field"] == "{data_type}")
-              |> aggregateWindow(every: {window}, fn: mean, createEmpty: false)
+              {aggregate}
               |> sort(columns: ["_time"])
         '''
         
-        result = query_api.query(org=INFLUXDB_ORG, query=query)
-        
-        graph_data = []
-        for table in result:
-            for record in table.records:
-                time_obj = record.get_time()
-                value = record.values.get("_value")
-                
-                if value is not None and isinstance(value, (int, float)):
-                    if str(value).lower() in ['nan', 'inf', '-inf'] or value < 0:
-                        clean_value = 0.0
-                    else:
-                        clean_value = round(float(value), 2)
-                else:
-                    clean_value = 0.0
-                
-                if time_range == "24h":
-                    time_label = time_obj.strftime("%H:%M")
-                    datetime_str = time_obj.strftime("%Y-%m-%d %H:%M:%S")
-                else:
-                    time_label = time_obj.strftime("%m-%d")
-                    datetime_str = time_obj.strftime("%Y-%m-%d")
-                
-                graph_data.append({
-                    "time": time_label,
-                    "datetime": datetime_str,
-                    "value": clean_value,
-                    "timestamp": time_obj.isoformat()
-                })
-        
-        values = [point["value"] for point in graph_data if point["value"] > 0]
-        stats = {}
-        if values:
-            stats = {
-                "min": round(min(values), 2),
-                "max": round(max(values), 2),
-                "avg": round(sum(values) / len(values), 2),
-                "count": len(values)
-            }
-        else:
-            stats = {"min": 0, "max": 0, "avg": 0, "count": 0}
+        label_format, datetime_format = GRAPH_TIME_FORMATS["24h" if resolution == "raw" else time_range]
+
+        series = [(row["_time"], clean_reading_value(row.get("_value"))) for row in await query_rows_async(query)]
+        source_points = len(series)
+
+        stats = graph_statistics(value for _, value in series)
+
+        if max_points is not None and source_points > max_points:
+            series = downsample(
+                series, max_points, downsample_method,
+                x=lambda point: point[0].timestamp(),
+                y=lambda point: point[1]
+            )
+
+        graph_data = [{
+            "time": time_obj.strftime(label_format),
+            "datetime": time_obj.strftime(datetime_format),
+            "value": value,
+            "timestamp": time_obj.isoformat()
+        } for time_obj, value in series]
         
         return {
             "status": 1,
@@ -542,7 +762,10 @@ async def get_graph_data(
                 "data_type": data_type,
                 "window": window,
                 "measurement": measurement,
+                "resolution": resolution,
                 "total_points": len(graph_data),
+                "source_points": source_points,
+                "downsample": downsample_method if len(graph_data) < source_points else None,
                 "statistics": stats
             }
         }
@@ -552,91 +775,229 @@ async def get_graph_data(
     except Exception as e:
         raise handle_query_error(e)
 
-@aqi_router.get("/latest/{node_name}", summary="Get Latest Air Quality Reading")
-async def get_latest_air_quality(
+@aqi_router.get("/graph-multi/{node_name}/{time_range}", summary="Get graph data for several fields in one query")
+async def get_multi_graph_data(
     node_name: str,
+    time_range: str,
+    fields: str = "all",
     db: Session = Depends(get_db)
 ):
-    """ดึงข้อมูลคุณภาพอากาศล่าสุดของ node"""
+    """
+    ดึงข้อมูลกราฟหลาย field พร้อมกันด้วย query เดียว (pivot)
+    - time_range: "24h", "7d", "30d"
+    - fields: รายชื่อ field คั่นด้วยจุลภาค เช่น "AQI,PM2_5" หรือ "all"
+    ผลลัพธ์เป็นแบบคอลัมน์: time/datetime/timestamp และ 1 คอลัมน์ต่อ field พร้อม statistics ของแต่ละ field
+    """
     try:
-        query = f"""
-            from(bucket: "{INFLUXDB_BUCKET}")
-                |> range(start: -24h)
-                |> filter(fn: (r) => r["_measurement"] == "air_quality")
-                |> filter(fn: (r) => r["_field"] == "CO2" or 
-                                   r["_field"] == "PM1" or 
-                                   r["_field"] == "PM10" or 
-                                   r["_field"] == "PM2_5" or 
-                                   r["_field"] == "PM4" or 
-                                   r["_field"] == "humidity" or 
-                                   r["_field"] == "temperature")
-                |> filter(fn: (r) => r["node_name"] == "{node_name}")
-                |> last()
-        """
-        result = query_api.query(org=INFLUXDB_ORG, query=query)
-        
-        data_by_time = {}
-        latest_timestamp = None
-        
-        for table in result:
-            for record in table.records:
-                timestamp = record.get_time()
-                field = record.get_field()
-                value = record.get_value()
-                
-                if value is not None and isinstance(value, (int, float)):
-                    if str(value).lower() in ['nan', 'inf', '-inf'] or value < 0:
-                        clean_value = 0.0
-                    else:
-                        clean_value = round(float(value), 2)
-                else:
-                    clean_value = 0.0
-                
-                timestamp_str = timestamp.isoformat()
-                
-                if timestamp_str not in data_by_time:
-                    data_by_time[timestamp_str] = {
-                        "timestamp": timestamp.astimezone(pytz.timezone("Asia/Bangkok")).isoformat(),
-                        "datetime": timestamp.astimezone(pytz.timezone("Asia/Bangkok")).strftime("%Y-%m-%d %H:%M:%S"),
-                        "data": {}
-                    }
-                
-                data_by_time[timestamp_str]["data"][field] = clean_value
-                
-                if latest_timestamp is None or timestamp > latest_timestamp:
-                    latest_timestamp = timestamp
-        
-        if not data_by_time:
+        if time_range not in GRAPH_WINDOWS:
             raise HTTPException(
-                status_code=404,
-                detail={"status": 0, "message": "ไม่พบข้อมูลล่าสุด", "data": {}}
+                status_code=400,
+                detail={"status": 0, "message": f"time_range ต้องเป็น {list(GRAPH_WINDOWS)}", "data": {}}
             )
-        
-        latest_data_key = latest_timestamp.isoformat()
-        latest_reading = data_by_time[latest_data_key]
-        
-        formatted_data = {
-            "timestamp": latest_reading["timestamp"],
-            "datetime": latest_reading["datetime"],
-            "PM1": latest_reading["data"].get("PM1", 0.0),
-            "PM2_5": latest_reading["data"].get("PM2_5", 0.0),
-            "PM4": latest_reading["data"].get("PM4", 0.0),
-            "PM10": latest_reading["data"].get("PM10", 0.0),
-            "CO2": latest_reading["data"].get("CO2", 0.0),
-            "temperature": latest_reading["data"].get("temperature", 0.0),
-            "humidity": latest_reading["data"].get("humidity", 0.0)
-        }
-        
+
+        if fields.strip().lower() == "all":
+            selected = list(SUMMARY_FIELDS)
+        else:
+            selected = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+            invalid = [field for field in selected if field not in SUMMARY_FIELDS]
+            if not selected or invalid:
+                raise HTTPException(
+                    status_code=400,
+                    detail={"status": 0, "message": f"fields ต้องเป็น all หรือรายการจาก {SUMMARY_FIELDS}", "data": {}}
+                )
+
+        window, measurement = GRAPH_WINDOWS[time_range]
+        label_format, datetime_format = GRAPH_TIME_FORMATS[time_range]
+        field_filter = " or ".join(f'r["_field"] == "{field}"' for field in selected)
+
+        query = f'''
+            from(bucket: "{INFLUXDB_BUCKET}")
+              |> range(start: -{time_range})
+              |> filter(fn: (r) => r["_measurement"] == "{measurement}")
+              |> filter(fn: (r) => r["node_name"] == "{node_name}")
+              |> filter(fn: (r) => {field_filter})
+              |> aggregateWindow(every: {window}, fn: mean, createEmpty: false)
+              |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+              |> group()
+              |> sort(columns: ["_time"])
+        '''
+
+        series = {"time": [], "datetime": [], "timestamp": []}
+        stats = {}
+        for field in selected:
+            series[field] = []
+            stats[field] = GraphStatistics()
+
+        for row in await query_rows_async(query, ("_time", *selected)):
+            time_obj = row["_time"]
+            series["time"].append(time_obj.strftime(label_format))
+            series["datetime"].append(time_obj.strftime(datetime_format))
+            series["timestamp"].append(time_obj.isoformat())
+            for field in selected:
+                value = clean_reading_value(row.get(field))
+                series[field].append(value)
+                stats[field].add(value)
+
         return {
             "status": 1,
-            "message": "ดึงข้อมูลล่าสุดสำเร็จ",
-            "data": formatted_data,
+            "message": f"ดึงข้อมูลกราฟ {', '.join(selected)} สำหรับ {time_range} สำเร็จ",
+            "data": series,
             "metadata": {
                 "node_name": node_name,
-                "timezone": "Asia/Bangkok",
-                "fields_count": len([v for v in formatted_data.values() if isinstance(v, (int, float)) and v > 0])
+                "time_range": time_range,
+                "fields": selected,
+                "window": window,
+                "measurement": measurement,
+                "total_points": len(series["time"]),
+                "statistics": {field: stats[field].as_dict() for field in selected}
+            }
+        }
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise handle_query_error(e)
+
+def build_latest_query(node_names: Optional[List[str]] = None) -> str:
+    """Flux query หาค่าล่าสุดภายใน 24 ชั่วโมง ของ node ที่ระบุ (None = ทุก node) ในครั้งเดียว"""
+    node_filter = ""
+    if node_names is not None:
+        node_set = ", ".join(json.dumps(name) for name in node_names)
+        node_filter = f'|> filter(fn: (r) => contains(value: r["node_name"], set: [{node_set}]))'
+    return f"""
+        from(bucket: "{INFLUXDB_BUCKET}")
+            |> range(start: -24h)
+            |> filter(fn: (r) => r["_measurement"] == "air_quality")
+            |> filter(fn: (r) => {LATEST_FIELDS_FILTER})
+            {node_filter}
+            |> last()
+    """
+
+def collect_latest_records(rows) -> dict:
+    """รวมผล last() ของแต่ละ field เป็น {node_name: (timestamp, values)} โดยใช้ timestamp ที่ใหม่ที่สุดของ node"""
+    by_node = {}
+    for row in rows:
+        by_node.setdefault(row.get("node_name"), {}).setdefault(row["_time"], {})[row["_field"]] = row.get("_value")
+
+    latest = {}
+    for node_name, by_time in by_node.items():
+        latest_timestamp = max(by_time)
+        latest[node_name] = (latest_timestamp, by_time[latest_timestamp])
+    return latest
+
+def latest_reading_response(node_name: str, formatted_data: dict, source: str) -> dict:
+    return {
+        "status": 1,
+        "message": "ดึงข้อมูลล่าสุดสำเร็จ",
+        "data": formatted_data,
+        "metadata": {
+            "node_name": node_name,
+            "timezone": "Asia/Bangkok",
+            "fields_count": len([v for k, v in formatted_data.items() if k in LATEST_FIELDS and v > 0]),
+            "source": source
+        }
+    }
+
+@aqi_router.get("/latest", summary="Get Latest Air Quality Readings for All Nodes")
+async def get_fleet_latest_air_quality(
+    location: Optional[str] = None,
+    user_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    ดึงข้อมูลล่าสุดของทุก node (หรือกรองตาม location / user_id เจ้าของ) ใน request เดียว
+    ใช้ cache ก่อน แล้ว query InfluxDB ครั้งเดียวสำหรับ node ที่ไม่มีใน cache
+    node ที่ไม่มีข้อมูลจะถูกจำไว้ช่วงสั้น ๆ จึงไม่ต้อง query ซ้ำทุก request
+    """
+    try:
+        query = db.query(Nodes)
+        if location:
+            query = query.filter(Nodes.location == location)
+        if user_id is not None:
+            query = query.filter(Nodes.user_id == user_id)
+        nodes = await run_in_threadpool(query.order_by(Nodes.node_name).all)
+
+        readings = {}
+        missing = set()
+        negative_hits = 0
+        for node in nodes:
+            cached = latest_readings.get(node.node_name)
+            if cached is not None:
+                readings[node.node_name] = cached
+            elif latest_readings.is_missing(node.node_name):
+                negative_hits += 1
+            else:
+                missing.add(node.node_name)
+        cache_hits = len(readings)
+
+        if missing:
+            filtered = location is not None or user_id is not None
+            flux = build_latest_query(sorted(missing) if filtered else None)
+            for node_name, (timestamp, values) in collect_latest_records(await query_rows_async(flux)).items():
+                latest_readings.record(node_name, timestamp, values, from_ingest=False)
+                if node_name in missing:
+                    readings[node_name] = latest_readings.format(timestamp, values)
+            for node_name in missing - readings.keys():
+                latest_readings.record_missing(node_name)
+
+        # endpoint นี้ไม่ต้อง login จึงไม่ส่งข้อมูลเจ้าของ node (user_id) และ description
+        data = [{
+            "node_id": node.node_id,
+            "node_name": node.node_name,
+            "location": node.location,
+            "status": node.status,
+            "status_text": node.status_text,
+            "latest": readings.get(node.node_name)
+        } for node in nodes]
+
+        return {
+            "status": 1,
+            "message": "ดึงข้อมูลล่าสุดของทุก node สำเร็จ",
+            "data": data,
+            "metadata": {
+                "location": location,
+                "user_id": user_id,
+                "total_nodes": len(data),
+                "nodes_with_data": len([item for item in data if item["latest"] is not None]),
+                "cache_hits": cache_hits,
+                "negative_cache_hits": negative_hits,
+                "timezone": "Asia/Bangkok"
             }
         }
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise handle_query_error(e)
+
+@aqi_router.get("/latest/{node_name}", summary="Get Latest Air Quality Reading")
+async def get_latest_air_quality(
+    node_name: str,
+    db: Session = Depends(get_db)
+):
+    """ดึงข้อมูลคุณภาพอากาศล่าสุดของ node (จาก cache ที่เติมตอนรับข้อมูล, ใช้ InfluxDB เมื่อ cache ว่าง)"""
+    try:
+        cached = latest_readings.get(node_name)
+        if cached is not None:
+            return latest_reading_response(node_name, cached, "cache")
+
+        latest = None
+        if not latest_readings.is_missing(node_name):
+            latest = collect_latest_records(await query_rows_async(build_latest_query([node_name]))).get(node_name)
+            if latest is None:
+                latest_readings.record_missing(node_name)
+
+        if latest is None:
+            raise HTTPException(
+                status_code=404,
+                detail={"status": 0, "message": "ไม่พบข้อมูลล่าสุด", "data": {}}
+            )
+
+        latest_timestamp, values = latest
+        latest_readings.record(node_name, latest_timestamp, values, from_ingest=False)
+        formatted_data = latest_readings.format(latest_timestamp, values)
+
+        return latest_reading_response(node_name, formatted_data, "influxdb")
         
     except HTTPException as he:
         raise he
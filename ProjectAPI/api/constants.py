@@ -4,6 +4,14 @@ ROLE_ADMIN = 1
 STATUS_OFFLINE = 0
 STATUS_ONLINE = 1
 
+OUTBOX_PENDING = 0
+OUTBOX_SENT = 1
+OUTBOX_FAILED = 2
+
+DIGEST_SENT = 1
+DIGEST_FAILED = 2
+DIGEST_REJECTED = 3
+
 ROLE_CHOICES = {
     ROLE_NODE_OWNER: "Node Owner",
     ROLE_ADMIN: "Admin"
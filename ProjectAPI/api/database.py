@@ -7,7 +7,22 @@ import os
 load_dotenv()
 POSTGRESQL_DB = os.getenv('POSTGRESQL_DB')
 
-engine = create_engine(POSTGRESQL_DB)
+# route ที่ใช้ DB เป็น def ธรรมดา FastAPI จะรันใน threadpool ของ anyio
+# จำนวน thread (DB_THREADPOOL_SIZE) ควรมากกว่าหรือเท่ากับ connection ทั้งหมดของ pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", str(DB_POOL_SIZE + DB_MAX_OVERFLOW + 10)))
+
+engine = create_engine(
+    POSTGRESQL_DB,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -16,4 +31,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
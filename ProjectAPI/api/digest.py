@@ -0,0 +1,350 @@
+"""
+อีเมลสรุปคุณภาพอากาศเฉลี่ย 7 โมงเช้าให้ผู้สมัครรับแจ้งเตือน (daily digest)
+
+ทำงานรอบเดียวสำหรับทุก location
+- ดึงผู้สมัครที่ active ทั้งหมดและ node ของ location เหล่านั้นด้วย query ละ 1 ครั้ง
+- ดึงค่า 7 โมงเช้าของทุก node ด้วย Flux query เดียว แล้วหาค่าเฉลี่ยราย location
+- render เนื้อหาอีเมลครั้งเดียวต่อ location แล้วส่งพร้อมกันผ่าน worker ของ mailer
+- บันทึกเวลาและจำนวนที่ส่งลงตาราง digest_runs (1 แถวต่อวัน จึงไม่ส่งซ้ำแม้ restart หรือรันหลาย process)
+  และผลรายผู้รับลงตาราง digest_deliveries
+- รอบที่ error หรือส่งไม่สำเร็จชั่วคราวบางฉบับ (last_error) และรอบที่ค้างเกิน DIGEST_CLAIM_TIMEOUT วินาที
+  (process ตายระหว่างส่ง finished_at จึงว่าง) จะถูกจองใหม่ได้ในรอบถัดไป โดยส่งเฉพาะผู้รับที่ยังไม่สำเร็จ
+  ผู้รับที่ server ปฏิเสธถาวร (5xx) ไม่ทำให้รอบถูกจองใหม่
+
+DigestScheduler ที่เริ่มจาก lifespan จะรันทุกวันเวลา DIGEST_SEND_TIME (เวลาไทย)
+รอบที่ล้มเหลวจะลองใหม่ทุก DIGEST_RETRY_INTERVAL วินาที ไม่เกิน DIGEST_MAX_RETRIES ครั้ง
+ถ้าแอปเริ่มหลังเวลานั้นและวันนี้ยังไม่ได้ส่ง จะส่งทันที
+รันเองจาก command line ได้
+    python -m api.digest                      # ส่งของวันนี้ (ข้ามถ้าส่งไปแล้ว)
+    python -m api.digest --date 2024-05-01 --force
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+import pytz
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from api.database import SessionLocal
+from api.email_service import build_daily_aqi_message, render_daily_aqi_part
+from api.influx_client import influx_clients
+from api.constants import DIGEST_FAILED, DIGEST_REJECTED, DIGEST_SENT
+from api.mailer import is_permanent_failure, mailer
+from api.models import DigestDelivery, DigestRun, Nodes, Notification
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SCHEDULE_ENABLED = os.getenv("DIGEST_SCHEDULE_ENABLED", "true").lower() in ("1", "true", "yes")
+DIGEST_SEND_TIME = os.getenv("DIGEST_SEND_TIME", "07:15")
+DIGEST_CLAIM_TIMEOUT = int(os.getenv("DIGEST_CLAIM_TIMEOUT", "3600"))
+DIGEST_RETRY_INTERVAL = int(os.getenv("DIGEST_RETRY_INTERVAL", "600"))
+DIGEST_MAX_RETRIES = int(os.getenv("DIGEST_MAX_RETRIES", "3"))
+
+THAILAND_TZ = pytz.timezone('Asia/Bangkok')
+
+# field ใน AirQualitySummary -> key ที่ template อีเมลใช้
+DIGEST_FIELDS = {
+    "AQI": "AQI",
+    "PM1": "PM1",
+    "PM2_5": "PM2.5",
+    "PM4": "PM4",
+    "PM10": "PM10",
+    "temperature": "Temperature",
+    "humidity": "Humidity",
+}
+# field ที่ค่าติดลบเป็นค่าจริงได้ (field อื่นถือว่าค่าติดลบคือข้อมูลเสีย)
+SIGNED_FIELDS = {"temperature", "humidity"}
+
+def build_digest_query(bucket: str, node_names: List[str], at: datetime) -> str:
+    """Flux query ดึงค่าสรุปรายชั่วโมงที่เวลา at (UTC) ของทุก node ที่ระบุในครั้งเดียว"""
+    node_set = ", ".join(json.dumps(name) for name in node_names)
+    field_set = ", ".join(json.dumps(field) for field in DIGEST_FIELDS)
+    start = at.strftime("%Y-%m-%dT%H:%M:%SZ")
+    stop = (at + timedelta(minutes=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return f'''
+    from(bucket: "{bucket}")
+        |> range(start: {start}, stop: {stop})
+        |> filter(fn: (r) => r["_measurement"] == "AirQualitySummary")
+        |> filter(fn: (r) => contains(value: r["_field"], set: [{field_set}]))
+        |> filter(fn: (r) => contains(value: r["node_name"], set: [{node_set}]))
+        |> keep(columns: ["node_name", "_field", "_value"])
+    '''
+
+def average_by_location(rows, node_locations: Dict[str, str]) -> Dict[str, dict]:
+    """หาค่าเฉลี่ยของแต่ละ field ราย location (ปัดทศนิยม 2 ตำแหน่ง) คืนเฉพาะ location ที่มีข้อมูล"""
+    totals: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(lambda: [0.0, 0]))
+    for row in rows:
+        location = node_locations.get(row["node_name"])
+        value = row["_value"]
+        if location is None or not isinstance(value, (int, float)):
+            continue
+        if value < 0 and row["_field"] not in SIGNED_FIELDS:
+            continue
+        total = totals[location][DIGEST_FIELDS[row["_field"]]]
+        total[0] += float(value)
+        total[1] += 1
+
+    return {
+        location: {field: round(value_sum / count, 2) for field, (value_sum, count) in fields.items()}
+        for location, fields in totals.items()
+    }
+
+class DailyDigest:
+    def __init__(self, claim_timeout: int = DIGEST_CLAIM_TIMEOUT):
+        self.claim_timeout = claim_timeout
+
+    def claim(self, db: Session, digest_date: date, force: bool) -> Optional[DigestRun]:
+        """
+        จองการส่งของวันที่ digest_date คืน None ถ้าเคยส่งสำเร็จไปแล้ว (และไม่ได้ force) หรือมี process อื่นกำลังส่งอยู่
+        รอบที่ล้มเหลว และรอบที่เริ่มไปเกิน claim_timeout วินาทีแต่ไม่จบ จองใหม่ได้
+        """
+        now = datetime.utcnow()
+        run = DigestRun(digest_date=digest_date, started_at=now)
+        db.add(run)
+        try:
+            db.commit()
+            return run
+        except IntegrityError:
+            db.rollback()
+        run = db.query(DigestRun).filter(DigestRun.digest_date == digest_date).with_for_update().one()
+        if run.finished_at is None:
+            # ยังไม่จบ: กำลังส่งอยู่ หรือ process ที่จองไว้ตายไปแล้วถ้าเกิน claim_timeout
+            reclaim = run.started_at is None or now - run.started_at >= timedelta(seconds=self.claim_timeout)
+            if reclaim:
+                logger.warning(f"Daily digest for {digest_date} started at {run.started_at} never finished, reclaiming")
+        else:
+            reclaim = force or run.last_error is not None
+        if not reclaim:
+            db.rollback()
+            return None
+        run.started_at = now
+        run.finished_at = None
+        run.last_error = None
+        db.commit()
+        return run
+
+    def load_averages(self, db: Session, locations: List[str], digest_date: date) -> Dict[str, dict]:
+        """ค่าเฉลี่ยตอน 7 โมงเช้า (เวลาไทย) ของวันที่ digest_date ของทุก location"""
+        node_locations = dict(
+            db.query(Nodes.node_name, Nodes.location).filter(Nodes.location.in_(locations)).all()
+        )
+        if not node_locations:
+            return {}
+        seven_am = THAILAND_TZ.localize(datetime.combine(digest_date, datetime.min.time()).replace(hour=7))
+        query = build_digest_query(influx_clients.bucket, list(node_locations), seven_am.astimezone(pytz.utc))
+        rows = influx_clients.query_rows(query, ("node_name", "_field", "_value"))
+        return average_by_location(rows, node_locations)
+
+    def run(self, db: Session, digest_date: Optional[date] = None, force: bool = False) -> Optional[dict]:
+        """ส่งอีเมลสรุปของวันที่ digest_date (ค่าเริ่มต้นคือวันนี้ตามเวลาไทย) คืนสถิติของรอบ หรือ None ถ้าส่งไปแล้ว"""
+        digest_date = digest_date or datetime.now(THAILAND_TZ).date()
+        run = self.claim(db, digest_date, force)
+        if run is None:
+            logger.info(f"Daily digest for {digest_date} already sent or in progress, skipping")
+            return None
+
+        started = time.perf_counter()
+        try:
+            subscribers: Dict[str, List[str]] = defaultdict(list)
+            for location, email in db.query(Notification.location, Notification.email).filter(
+                Notification.is_active == True,
+                Notification.location.isnot(None)
+            ):
+                subscribers[location].append(email)
+
+            averages = self.load_averages(db, list(subscribers), digest_date) if subscribers else {}
+            loaded = time.perf_counter()
+
+            # เนื้อหาเหมือนกันทุกคนใน location จึง render ครั้งเดียว แล้วใช้ part เดียวกันกับทุกฉบับ
+            parts = {location: render_daily_aqi_part(location, avg_data) for location, avg_data in averages.items()}
+            recipients = [(location, email) for location in parts for email in subscribers[location]]
+
+            # รอบที่จองใหม่ส่งเฉพาะผู้รับที่ยังไม่สำเร็จ (force ส่งใหม่ทุกคน)
+            deliveries = {
+                (delivery.location, delivery.email): delivery
+                for delivery in db.query(DigestDelivery).filter(DigestDelivery.digest_date == digest_date)
+            }
+            targets = [
+                key for key in recipients
+                if force or key not in deliveries or deliveries[key].status == DIGEST_FAILED
+            ]
+            errors = mailer.deliver_many(
+                (build_daily_aqi_message(email, location, averages[location], parts[location]), email)
+                for location, email in targets
+            )
+
+            now = datetime.utcnow()
+            retryable = 0
+            for (location, email), error in zip(targets, errors):
+                delivery = deliveries.get((location, email))
+                if delivery is None:
+                    delivery = DigestDelivery(digest_date=digest_date, location=location, email=email, attempts=0)
+                    deliveries[(location, email)] = delivery
+                    db.add(delivery)
+                delivery.attempts += 1
+                delivery.updated_at = now
+                if error is None:
+                    delivery.status = DIGEST_SENT
+                    delivery.last_error = None
+                    continue
+                logger.warning(f"Daily digest to {email} ({location}) failed: {str(error)}")
+                delivery.last_error = str(error)
+                if is_permanent_failure(error):
+                    delivery.status = DIGEST_REJECTED
+                else:
+                    delivery.status = DIGEST_FAILED
+                    retryable += 1
+
+            run.locations = len(parts)
+            run.skipped_locations = len(subscribers) - len(parts)
+            run.subscribers = len(recipients)
+            run.sent = sum(1 for key in recipients if deliveries[key].status == DIGEST_SENT)
+            run.failed = run.subscribers - run.sent
+            if retryable:
+                # ให้รอบถัดไปจองใหม่ได้ ส่งซ้ำเฉพาะผู้รับที่ล้มเหลวชั่วคราว ผู้รับที่ server ปฏิเสธถาวรไม่ส่งซ้ำ
+                run.last_error = f"{retryable}/{run.subscribers} e-mail(s) failed, will retry"
+            logger.info(
+                f"Daily digest for {digest_date}: {errors.count(None)}/{len(targets)} sent this run, "
+                f"{run.sent}/{run.subscribers} delivered to {run.locations} location(s), "
+                f"{run.skipped_locations} skipped without data "
+                f"(load {(loaded - started) * 1000:.0f}ms, send {(time.perf_counter() - loaded) * 1000:.0f}ms)"
+            )
+        except Exception as e:
+            db.rollback()
+            run.last_error = str(e)
+            logger.error(f"Daily digest for {digest_date} failed: {str(e)}")
+            raise
+        finally:
+            run.finished_at = datetime.utcnow()
+            run.duration_ms = int((time.perf_counter() - started) * 1000)
+            db.commit()
+
+        return {
+            "digest_date": digest_date.isoformat(),
+            "locations": run.locations,
+            "skipped_locations": run.skipped_locations,
+            "subscribers": run.subscribers,
+            "sent": run.sent,
+            "failed": run.failed,
+            "retryable": retryable,
+            "duration_ms": run.duration_ms
+        }
+
+    def run_once(self, digest_date: Optional[date] = None, force: bool = False) -> Optional[dict]:
+        """เหมือน run() แต่เปิด session ของตัวเอง (สำหรับ scheduler และ CLI)"""
+        db = SessionLocal()
+        try:
+            return self.run(db, digest_date, force)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+daily_digest = DailyDigest()
+
+class DigestScheduler:
+    def __init__(
+        self,
+        digest: DailyDigest = daily_digest,
+        send_time: str = DIGEST_SEND_TIME,
+        retry_interval: int = DIGEST_RETRY_INTERVAL,
+        max_retries: int = DIGEST_MAX_RETRIES
+    ):
+        hour, minute = send_time.split(":")
+        self.digest = digest
+        self.retry_interval = retry_interval
+        self.max_retries = max_retries
+        self.send_hour = int(hour)
+        self.send_minute = int(minute)
+        self.runs = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def send_at(self, day: date) -> datetime:
+        return THAILAND_TZ.localize(datetime.combine(day, datetime.min.time()).replace(hour=self.send_hour, minute=self.send_minute))
+
+    def next_run(self, now: datetime) -> datetime:
+        """เวลาส่งรอบถัดไปหลังจาก now (เวลาไทย)"""
+        send_at = self.send_at(now.date())
+        return send_at if now < send_at else self.send_at(now.date() + timedelta(days=1))
+
+    async def start(self):
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Daily digest scheduler started (send_time={self.send_hour:02d}:{self.send_minute:02d} Asia/Bangkok)")
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info(f"Daily digest scheduler stopped (runs={self.runs})")
+
+    async def _send(self, digest_date: date):
+        for attempt in range(self.max_retries + 1):
+            try:
+                stats = await run_in_threadpool(self.digest.run_once, digest_date)
+                self.runs += 1
+                # None = ส่งครบแล้วหรือ process อื่นกำลังส่งอยู่; ผู้รับที่ถูกปฏิเสธถาวรไม่นับเป็นเหตุให้ลองใหม่
+                if stats is None or not stats["retryable"]:
+                    return
+                logger.warning(f"Scheduled daily digest for {digest_date}: {stats['retryable']} e-mail(s) failed, retrying")
+            except Exception as e:
+                logger.warning(f"Scheduled daily digest failed: {str(e)}")
+            if attempt < self.max_retries:
+                await asyncio.sleep(self.retry_interval)
+
+    async def _run(self):
+        now = datetime.now(THAILAND_TZ)
+        # เริ่มหลังเวลาส่งของวันนี้ -> ส่งทันที (ถ้าส่งไปแล้ว claim จะข้ามให้)
+        if now >= self.send_at(now.date()):
+            await self._send(now.date())
+        while True:
+            now = datetime.now(THAILAND_TZ)
+            next_run = self.next_run(now)
+            await asyncio.sleep((next_run - now).total_seconds())
+            await self._send(next_run.date())
+
+digest_scheduler = DigestScheduler()
+
+def main():
+    parser = argparse.ArgumentParser(description="Send the daily air quality digest to subscribers")
+    parser.add_argument("--date", type=date.fromisoformat, default=None, help="Digest date (YYYY-MM-DD, default: today in Asia/Bangkok)")
+    parser.add_argument("--force", action="store_true", help="Send even if the digest for this date was already sent")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from api.schema import init_db
+    init_db()
+
+    try:
+        stats = daily_digest.run_once(args.date, args.force)
+    finally:
+        mailer.close()
+    if stats is None:
+        print("Digest already sent or in progress for this date (use --force to send again)")
+    else:
+        print(
+            f"Sent {stats['sent']}/{stats['subscribers']} e-mail(s) to {stats['locations']} location(s) "
+            f"in {stats['duration_ms']}ms ({stats['failed']} failed, {stats['skipped_locations']} location(s) without data)"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+ลดจำนวนจุดของกราฟฝั่ง server โดยยังคงรูปร่างและค่าสูงสุด/ต่ำสุดของข้อมูลไว้
+
+- lttb: Largest-Triangle-Three-Buckets เลือกจุดที่สร้างสามเหลี่ยมพื้นที่มากที่สุดในแต่ละ bucket
+- minmax: เก็บจุดต่ำสุดและสูงสุดของแต่ละ bucket (peak ไม่หายแน่นอน)
+
+ทั้งสองแบบเก็บจุดแรกและจุดสุดท้ายไว้เสมอ และคืนจุดเรียงตามเวลาเดิม
+"""
+from typing import Callable, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+
+def lttb(points: Sequence[T], threshold: int, x: Callable[[T], float], y: Callable[[T], float]) -> List[T]:
+    """ลดจุดด้วย LTTB ให้เหลือ threshold จุด"""
+    count = len(points)
+    if threshold >= count or threshold < 3:
+        return list(points)
+
+    xs = [x(point) for point in points]
+    ys = [y(point) for point in points]
+    bucket_size = (count - 2) / (threshold - 2)
+
+    sampled = [points[0]]
+    a = 0
+    for i in range(threshold - 2):
+        # ค่าเฉลี่ยของ bucket ถัดไป (ใช้เป็นจุดยอดที่สามของสามเหลี่ยม)
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, count)
+        span = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = xs[a], ys[a]
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
+
+def minmax(points: Sequence[T], threshold: int, y: Callable[[T], float]) -> List[T]:
+    """
+    ลดจุดโดยเก็บค่าต่ำสุดและสูงสุดของแต่ละ bucket (ได้ไม่เกิน threshold จุด)
+    threshold = 3 เหลือจุดแรก จุดที่ห่างจากค่าของจุดปลายทั้งสองมากที่สุด (ต่ำสุดหรือสูงสุด) และจุดสุดท้าย
+    """
+    count = len(points)
+    if threshold >= count or threshold < 3:
+        return list(points)
+
+    if threshold == 3:
+        interior = range(1, count - 1)
+        low = min(interior, key=lambda j: y(points[j]))
+        high = max(interior, key=lambda j: y(points[j]))
+        middle = (y(points[0]) + y(points[-1])) / 2
+        extreme = high if y(points[high]) - middle >= middle - y(points[low]) else low
+        return [points[0], points[extreme], points[-1]]
+
+    buckets = (threshold - 2) // 2
+    bucket_size = (count - 2) / buckets
+    indexes = [0]
+    for i in range(buckets):
+        start = int(i * bucket_size) + 1
+        end = min(int((i + 1) * bucket_size) + 1, count - 1)
+        if start >= end:
+            continue
+        low = min(range(start, end), key=lambda j: y(points[j]))
+        high = max(range(start, end), key=lambda j: y(points[j]))
+        indexes.extend(sorted({low, high}))
+    indexes.append(count - 1)
+    return [points[j] for j in indexes]
+
+def downsample(points: Sequence[T], max_points: int, method: str, x: Callable[[T], float], y: Callable[[T], float]) -> List[T]:
+    if method == "minmax":
+        return minmax(points, max_points, y)
+    return lttb(points, max_points, x, y)
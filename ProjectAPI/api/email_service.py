@@ -1,10 +1,9 @@
-import smtplib
 import os
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-def send_verification_email(email: str, token: str):
-    """ส่งอีเมลยืนยันบัญชี"""
+def build_verification_message(email: str, token: str) -> MIMEMultipart:
+    """สร้างอีเมลยืนยันบัญชี"""
     msg = MIMEMultipart()
     msg['From'] = f"ECP Air Quality <{os.getenv('EMAIL')}>"
     msg['To'] = email
@@ -45,18 +44,10 @@ def send_verification_email(email: str, token: str):
 
     msg.attach(MIMEText(body, 'html'))
 
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(os.getenv("EMAIL"), os.getenv("EMAIL_PASSWORD"))
-        server.sendmail(os.getenv("EMAIL"), email, msg.as_string())
-        server.quit()
-        print("Verification email sent successfully!")
-    except Exception as e:
-        print(f"Error sending verification email: {e}")
+    return msg
 
-def send_reset_email(email: str, token: str):
-    """ส่งอีเมลรีเซ็ตรหัสผ่าน"""
+def build_reset_message(email: str, token: str) -> MIMEMultipart:
+    """สร้างอีเมลรีเซ็ตรหัสผ่าน"""
     msg = MIMEMultipart()
     msg['From'] = f"ECP Air Quality <{os.getenv('EMAIL')}>"
     msg['To'] = email
@@ -97,22 +88,10 @@ def send_reset_email(email: str, token: str):
 
     msg.attach(MIMEText(body, 'html'))
 
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(os.getenv("EMAIL"), os.getenv("EMAIL_PASSWORD"))
-        server.sendmail(os.getenv("EMAIL"), email, msg.as_string())
-        server.quit()
-        print("Reset email sent successfully!")
-    except smtplib.SMTPAuthenticationError as auth_error:
-        print(f"Authentication Error: {auth_error}")
-    except smtplib.SMTPException as e:
-        print(f"SMTP Error: {e}")
-    except Exception as e:
-        print(f"Error sending reset email: {e}")
-        
-def send_welcome_email(email: str, location: str):
-    """ส่งอีเมลต้อนรับการสมัครรับการแจ้งเตือน"""
+    return msg
+
+def build_welcome_message(email: str, location: str) -> MIMEMultipart:
+    """สร้างอีเมลต้อนรับการสมัครรับการแจ้งเตือน"""
     msg = MIMEMultipart()
     msg['From'] = f"ECP Air Quality <{os.getenv('EMAIL')}>"
     msg['To'] = email
@@ -138,31 +117,10 @@ def send_welcome_email(email: str, location: str):
 
     msg.attach(MIMEText(body, 'html'))
 
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(os.getenv("EMAIL"), os.getenv("EMAIL_PASSWORD"))
-        server.sendmail(os.getenv("EMAIL"), email, msg.as_string())
-        server.quit()
-        print(f"Welcome email sent successfully to {email}")
-        return True
-    except smtplib.SMTPAuthenticationError as auth_error:
-        print(f"Authentication Error: {auth_error}")
-        return False
-    except smtplib.SMTPException as e:
-        print(f"SMTP Error: {e}")
-        return False
-    except Exception as e:
-        print(f"Error sending welcome email: {e}")
-        return False
-
-def send_daily_aqi_email(email: str, location: str, avg_data: dict):
-    """ส่งอีเมลแจ้งเตือนข้อมูลคุณภาพอากาศเฉลี่ย 7 โมงเช้า"""
-    msg = MIMEMultipart()
-    msg['From'] = f"ECP Air Quality <{os.getenv('EMAIL')}>"
-    msg['To'] = email
-    msg['Subject'] = f"แจ้งเตือนคุณภาพอากาศ ({location}) เวลา 7 โมงเช้า"
+    return msg
 
+def render_daily_aqi_part(location: str, avg_data: dict) -> MIMEText:
+    """render เนื้อหา HTML ของอีเมลรายวัน (เหมือนกันทุกคนใน location จึง render ครั้งเดียวแล้วใช้ซ้ำได้)"""
     data_rows = ""
     field_names = {
         "AQI": "ดัชนีคุณภาพอากาศ (AQI)",
@@ -258,16 +216,15 @@ def send_daily_aqi_email(email: str, location: str, avg_data: dict):
     </html>
     """
 
-    msg.attach(MIMEText(body, 'html'))
+    return MIMEText(body, 'html')
+
+def build_daily_aqi_message(email: str, location: str, avg_data: dict, part: MIMEText = None) -> MIMEMultipart:
+    """สร้างอีเมลแจ้งเตือนข้อมูลคุณภาพอากาศเฉลี่ย 7 โมงเช้า (part: เนื้อหาที่ render ไว้แล้วด้วย render_daily_aqi_part)"""
+    msg = MIMEMultipart()
+    msg['From'] = f"ECP Air Quality <{os.getenv('EMAIL')}>"
+    msg['To'] = email
+    msg['Subject'] = f"แจ้งเตือนคุณภาพอากาศ ({location}) เวลา 7 โมงเช้า"
+
+    msg.attach(part or render_daily_aqi_part(location, avg_data))
 
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(os.getenv("EMAIL"), os.getenv("EMAIL_PASSWORD"))
-        server.sendmail(os.getenv("EMAIL"), email, msg.as_string())
-        server.quit()
-        print(f"Daily air quality email sent to {email} ({location})")
-        return True
-    except Exception as e:
-        print(f"Error sending daily air quality email: {e}")
-        return False
\ No newline at end of file
+    return msg
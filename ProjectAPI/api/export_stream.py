@@ -0,0 +1,64 @@
+import csv
+import io
+import json
+import math
+import re
+import zlib
+from typing import Iterable, Iterator, List
+from urllib.parse import quote
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+EXPORT_ROWS_PER_CHUNK = 2000
+
+def content_disposition(filename: str) -> str:
+    """
+    header Content-Disposition ของไฟล์แนบ (RFC 6266)
+    filename= เป็นชื่อสำรองแบบ ASCII (แทนอักขระอื่นและ " \\ ด้วย _) ส่วน filename* เป็นชื่อจริงแบบ UTF-8
+    """
+    fallback = re.sub(r'[^\x20-\x7e]|["\\]', "_", filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+def iter_csv_chunks(rows: Iterable[dict], fields: List[str], rows_per_chunk: int = EXPORT_ROWS_PER_CHUNK) -> Iterator[bytes]:
+    """เขียนแถว (ค่าเป็น string จาก CSV ของ InfluxDB) เป็น CSV ทีละก้อน เริ่มด้วย header"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["time", *fields])
+    count = 0
+    for row in rows:
+        writer.writerow([row.get("_time"), *[row.get(field) for field in fields]])
+        count += 1
+        if count >= rows_per_chunk:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+def iter_ndjson_chunks(rows: Iterable[dict], fields: List[str], rows_per_chunk: int = EXPORT_ROWS_PER_CHUNK) -> Iterator[bytes]:
+    """เขียนแถว (ค่าแปลงชนิดแล้ว) เป็น JSON บรรทัดละ 1 แถว ทีละก้อน"""
+    lines = []
+    for row in rows:
+        record = {"time": row["_time"].isoformat()}
+        for field in fields:
+            value = row.get(field)
+            record[field] = value if value is None or math.isfinite(value) else None
+        lines.append(json.dumps(record, separators=(",", ":")))
+        if len(lines) >= rows_per_chunk:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """บีบอัดแบบ streaming เป็นรูปแบบ gzip"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
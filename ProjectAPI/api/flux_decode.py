@@ -0,0 +1,114 @@
+"""
+ถอดรหัสผล query ของ InfluxDB จาก annotated CSV โดยตรง แทนการสร้าง FluxTable/FluxRecord
+
+annotated CSV ประกอบด้วยแถว #datatype, #group, #default ตามด้วย header และข้อมูล
+แต่ละตารางคั่นด้วยบรรทัดว่าง เราแปลงชนิดข้อมูลทีละคอลัมน์ตาม #datatype
+(เวลาใช้ ciso8601) และข้ามคอลัมน์ result/table ที่ไม่ได้ใช้
+"""
+import math
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import ciso8601
+
+_SKIP_COLUMNS = {"result", "table"}
+
+def _parse_bool(value: str) -> bool:
+    return value == "true"
+
+_CONVERTERS: Dict[str, Callable[[str], object]] = {
+    "double": float,
+    "long": int,
+    "unsignedLong": int,
+    "boolean": _parse_bool,
+    "dateTime:RFC3339": ciso8601.parse_datetime,
+    "dateTime:RFC3339Nano": ciso8601.parse_datetime,
+}
+
+def clean_reading_value(value) -> float:
+    """ค่า NaN/inf/ติดลบ หรือไม่ใช่ตัวเลข ให้เป็น 0.0 นอกนั้นปัดเป็นทศนิยม 2 ตำแหน่ง"""
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return 0.0
+    if not math.isfinite(value) or value < 0:
+        return 0.0
+    return round(float(value), 2)
+
+class FluxDecodeError(Exception):
+    """InfluxDB ส่ง error กลับมาใน CSV"""
+
+def iter_rows(csv_rows: Iterable[List[str]], columns_wanted: Optional[Iterable[str]] = None, raw: bool = False) -> Iterator[dict]:
+    """
+    แปลงแถวของ annotated CSV (list ของ string ต่อแถว) เป็น dict ทีละแถวแบบ streaming
+    รับได้ทั้งผลของ query_api.query_csv() และ csv.reader() ของข้อความดิบ
+    columns_wanted: ถอดรหัสเฉพาะคอลัมน์ที่ระบุ (None = ทุกคอลัมน์ยกเว้น result/table)
+    raw: คืนค่าเป็น string ตามที่อยู่ใน CSV โดยไม่แปลงชนิด (สำหรับส่งต่อเป็น CSV)
+    """
+    wanted = set(columns_wanted) if columns_wanted is not None else None
+    datatypes: Optional[List[str]] = None
+    defaults: Optional[List[str]] = None
+    columns = None
+
+    for row in csv_rows:
+        if not row or (len(row) == 1 and not row[0]):
+            columns = None
+            continue
+
+        first = row[0]
+        if first == "#datatype":
+            datatypes, defaults, columns = row[1:], None, None
+            continue
+        if first == "#default":
+            defaults = row[1:]
+            continue
+        if first.startswith("#"):
+            continue
+
+        if columns is None:
+            header = row[1:]
+            if header[:2] == ["error", "reference"]:
+                columns = "error"
+                continue
+            # (index, name, converter, default) ของคอลัมน์ที่ต้องใช้
+            columns = []
+            for index, name in enumerate(header):
+                if name in _SKIP_COLUMNS or (wanted is not None and name not in wanted):
+                    continue
+                datatype = datatypes[index] if datatypes and index < len(datatypes) else "string"
+                default = defaults[index] if defaults and index < len(defaults) else ""
+                columns.append((index + 1, name, None if raw else _CONVERTERS.get(datatype), default))
+            continue
+
+        if columns == "error":
+            raise FluxDecodeError(row[1] if len(row) > 1 else "Unknown Flux error")
+
+        record = {}
+        for index, name, convert, default in columns:
+            value = row[index]
+            if not value:
+                value = default
+                if not value:
+                    record[name] = None
+                    continue
+            record[name] = convert(value) if convert else value
+        yield record
+
+def pivot_rows(rows: Iterable[dict], key: Callable[[dict], object] = None) -> Dict[object, dict]:
+    """
+    รวมแถวแบบ 1 field ต่อแถว (_field/_value) เป็น 1 แถวต่อ key (ค่าเริ่มต้นคือ _time) ใน pass เดียว
+    ค่าที่ได้ถูกทำความสะอาดด้วย clean_reading_value แล้ว
+    """
+    pivoted: Dict[object, dict] = {}
+    # แต่ละ _time ซ้ำกันทุก field จึงคำนวณ key ครั้งเดียวต่อเวลา
+    key_cache = {}
+    for row in rows:
+        row_time = row["_time"]
+        if key is None:
+            row_key = row_time
+        else:
+            row_key = key_cache.get(row_time)
+            if row_key is None:
+                row_key = key_cache[row_time] = key(row)
+        target = pivoted.get(row_key)
+        if target is None:
+            target = pivoted[row_key] = {"_time": row_time}
+        target[row["_field"]] = clean_reading_value(row["_value"])
+    return pivoted
@@ -0,0 +1,222 @@
+"""
+ติดตามสถานะ online/offline ของ node จากการส่งข้อมูลเข้ามา (push) แทนการ poll InfluxDB
+
+- ingest เรียก heartbeats.touch(node_name) ทุกครั้งที่รับข้อมูล (บันทึกเวลาล่าสุดใน memory)
+- background task ที่เริ่มจาก lifespan เทียบ heartbeat กับสถานะล่าสุดที่เขียนไว้ (เก็บใน memory
+  โหลดจากตาราง nodes ใหม่ทุก HEARTBEAT_STATUS_RELOAD วินาที เพื่อรับการแก้ไขจากนอกแอป)
+  ทุก HEARTBEAT_SWEEP_INTERVAL วินาที แล้วเขียนกลับเฉพาะ node ที่สถานะเปลี่ยนด้วย UPDATE คำสั่งเดียว
+  (ไม่อ่านทั้งตารางทุกรอบ)
+
+ข้อมูลอยู่ใน memory ของ process จึงถือว่ารัน uvicorn worker เดียว (ตาม Dockerfile)
+หลัง restart จะยังไม่ปรับ node เป็น offline จนกว่าจะผ่านช่วง offline_after
+เพื่อให้ node ที่ยังส่งข้อมูลอยู่มีโอกาสส่ง heartbeat ก่อน
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+import pytz
+from sqlalchemy import case
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from api.database import SessionLocal
+from api.models import Nodes
+from api.location_summary import location_summary
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_OFFLINE_AFTER = int(os.getenv("HEARTBEAT_OFFLINE_AFTER", "300"))
+HEARTBEAT_SWEEP_INTERVAL = float(os.getenv("HEARTBEAT_SWEEP_INTERVAL", "5"))
+HEARTBEAT_STATUS_RELOAD = float(os.getenv("HEARTBEAT_STATUS_RELOAD", "300"))
+
+THAILAND_TZ = pytz.timezone('Asia/Bangkok')
+
+def update_node_statuses(db: Session, changes: Dict[int, int]):
+    """อัปเดต Nodes.status ของ node ที่สถานะเปลี่ยน ({node_id: status}) ด้วย UPDATE คำสั่งเดียวแล้ว commit"""
+    if changes:
+        db.query(Nodes).filter(Nodes.node_id.in_(list(changes))).update(
+            {
+                Nodes.status: case(changes, value=Nodes.node_id),
+                Nodes.updated_at: datetime.now(THAILAND_TZ).replace(tzinfo=None)
+            },
+            synchronize_session=False
+        )
+    db.commit()
+    if changes:
+        location_summary.invalidate()
+
+class HeartbeatTracker:
+    def __init__(
+        self,
+        offline_after: int = HEARTBEAT_OFFLINE_AFTER,
+        sweep_interval: float = HEARTBEAT_SWEEP_INTERVAL,
+        status_reload: float = HEARTBEAT_STATUS_RELOAD
+    ):
+        self.offline_after = timedelta(seconds=offline_after)
+        self.sweep_interval = sweep_interval
+        self.status_reload = status_reload
+        self.sweeps = 0
+        self.status_changes = 0
+        self._last_seen: Dict[str, datetime] = {}
+        # node_name -> (node_id, status ที่เขียนลงตารางล่าสุด) None = ยังไม่ได้โหลด
+        self._statuses: Optional[Dict[str, Tuple[int, int]]] = None
+        self._statuses_loaded_at = 0.0
+        # touch/forget/rename มาจาก request แต่ sweep อ่านใน worker thread
+        self._lock = threading.Lock()
+        self._started_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def touch(self, node_name: str, seen_at: Optional[datetime] = None):
+        """บันทึกว่า node ส่งข้อมูลเข้ามา (เวลาเป็น UTC, ค่าเริ่มต้นคือเวลาปัจจุบัน)"""
+        seen_at = seen_at or datetime.now(pytz.UTC)
+        with self._lock:
+            previous = self._last_seen.get(node_name)
+            if previous is None or seen_at > previous:
+                self._last_seen[node_name] = seen_at
+
+    def last_seen(self, node_name: str) -> Optional[datetime]:
+        return self._last_seen.get(node_name)
+
+    def forget(self, node_name: str):
+        with self._lock:
+            self._last_seen.pop(node_name, None)
+            if self._statuses is not None:
+                self._statuses.pop(node_name, None)
+
+    def rename(self, old_name: str, new_name: str):
+        with self._lock:
+            seen_at = self._last_seen.pop(old_name, None)
+            if seen_at is not None:
+                previous = self._last_seen.get(new_name)
+                self._last_seen[new_name] = seen_at if previous is None else max(previous, seen_at)
+            if self._statuses is not None and old_name in self._statuses:
+                self._statuses[new_name] = self._statuses.pop(old_name)
+
+    def record_statuses(self, changes: Dict[int, int]):
+        """แจ้งสถานะที่ถูกเขียนลงตารางจากที่อื่น ({node_id: status}) เพื่อให้ map ใน memory ตรงกับตาราง"""
+        with self._lock:
+            if not changes or self._statuses is None:
+                return
+            for node_name, (node_id, _) in list(self._statuses.items()):
+                if node_id in changes:
+                    self._statuses[node_name] = (node_id, changes[node_id])
+
+    @property
+    def warmed_up(self) -> bool:
+        """ผ่านช่วง offline_after นับจากเริ่มทำงานแล้ว (node ที่ไม่มี heartbeat ถือว่า offline ได้)"""
+        return self._started_at is not None and time.monotonic() - self._started_at >= self.offline_after.total_seconds()
+
+    async def start(self):
+        if self.running:
+            return
+        self._started_at = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Heartbeat sweeper started (interval={self.sweep_interval}s, "
+            f"offline_after={int(self.offline_after.total_seconds())}s)"
+        )
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info(f"Heartbeat sweeper stopped (sweeps={self.sweeps}, status_changes={self.status_changes})")
+
+    def stats(self) -> dict:
+        return {
+            "tracked_nodes": len(self._last_seen),
+            "known_statuses": len(self._statuses or {}),
+            "sweeps": self.sweeps,
+            "status_changes": self.status_changes,
+            "warmed_up": self.warmed_up
+        }
+
+    async def sweep(self) -> Dict[int, int]:
+        """เทียบสถานะจาก heartbeat กับตาราง nodes แล้วเขียนเฉพาะแถวที่เปลี่ยน คืน {node_id: status ใหม่}"""
+        now = datetime.now(pytz.UTC)
+        with self._lock:
+            last_seen = list(self._last_seen.items())
+        online = {name for name, seen_at in last_seen if now - seen_at < self.offline_after}
+        changes = await run_in_threadpool(self._apply, online, self.warmed_up)
+        self.sweeps += 1
+        self.status_changes += len(changes)
+        return changes
+
+    @staticmethod
+    def _load_statuses(db: Session, node_names: Optional[Iterable[str]] = None) -> Dict[str, Tuple[int, int]]:
+        query = db.query(Nodes.node_id, Nodes.node_name, Nodes.status)
+        if node_names is not None:
+            query = query.filter(Nodes.node_name.in_(list(node_names)))
+        return {node_name: (node_id, status) for node_id, node_name, status in query}
+
+    def _apply(self, online: set, allow_offline: bool) -> Dict[int, int]:
+        db = SessionLocal()
+        try:
+            if self._statuses is None or time.monotonic() - self._statuses_loaded_at >= self.status_reload:
+                # โหลดทั้งตารางเป็นระยะ เพื่อรับสถานะที่ถูกแก้จากนอกแอป
+                statuses = self._load_statuses(db)
+                with self._lock:
+                    self._statuses = statuses
+                    self._statuses_loaded_at = time.monotonic()
+                logger.debug(f"Heartbeat status map loaded: {len(statuses)} nodes")
+            else:
+                # node ที่เพิ่งเพิ่มหลังโหลด map จะถูกดึงเฉพาะตอนที่เริ่มส่งข้อมูล
+                with self._lock:
+                    unknown = online - self._statuses.keys()
+                if unknown:
+                    loaded = self._load_statuses(db, unknown)
+                    with self._lock:
+                        self._statuses.update(loaded)
+
+            with self._lock:
+                snapshot = list(self._statuses.items())
+
+            changes = {}
+            names = {}
+            for node_name, (node_id, status) in snapshot:
+                if node_name in online:
+                    new_status = 1
+                elif allow_offline:
+                    new_status = 0
+                else:
+                    continue
+                if status != new_status:
+                    changes[node_id] = new_status
+                    names[node_id] = node_name
+                    logger.info(f"Node {node_name} status changed from {status} to {new_status}")
+            update_node_statuses(db, changes)
+            with self._lock:
+                for node_id, new_status in changes.items():
+                    # ข้ามถ้าถูก rename/ลบระหว่างเขียน (rename ย้าย entry ไปชื่อใหม่แล้ว)
+                    if self._statuses.get(names[node_id], (None,))[0] == node_id:
+                        self._statuses[names[node_id]] = (node_id, new_status)
+            return changes
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning(f"Heartbeat sweep failed: {str(e)}")
+
+heartbeats = HeartbeatTracker()
@@ -0,0 +1,155 @@
+"""
+จัดการ InfluxDB client ที่ใช้ร่วมกันทั้งแอป (สร้างครั้งเดียวใน lifespan และปิดตอน shutdown)
+
+- client แบบ async: สำหรับ route handler และ writer (ไม่ block event loop)
+- client แบบ sync: สำหรับงานที่รันใน thread (export แบบ streaming, อีเมลรายวัน, CLI)
+  query_api() โยน RuntimeError ถ้าถูกเรียกจาก thread ของ event loop เพื่อไม่ให้ HTTP แบบ blocking หลุดเข้าไปใน route async
+
+ทั้งสองตัวใช้ connection pool ที่ reuse การเชื่อมต่อ (keep-alive) จึงไม่ต้อง handshake TCP/TLS ใหม่ทุก request
+"""
+import asyncio
+import csv
+import io
+import logging
+import os
+import socket
+from typing import Iterable, Iterator, Optional
+
+from dotenv import load_dotenv
+from influxdb_client import InfluxDBClient
+from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
+from starlette.concurrency import run_in_threadpool
+from urllib3.connection import HTTPConnection
+
+from api.flux_decode import iter_rows
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INFLUXDB_POOL_SIZE = int(os.getenv("INFLUXDB_POOL_SIZE", "20"))
+INFLUXDB_ASYNC_POOL_SIZE = int(os.getenv("INFLUXDB_ASYNC_POOL_SIZE", "100"))
+INFLUXDB_TIMEOUT_MS = int(os.getenv("INFLUXDB_TIMEOUT_MS", "30000"))
+INFLUXDB_TCP_KEEPALIVE = os.getenv("INFLUXDB_TCP_KEEPALIVE", "true").lower() in ("1", "true", "yes")
+INFLUXDB_KEEPALIVE_IDLE = int(os.getenv("INFLUXDB_KEEPALIVE_IDLE", "60"))
+
+def keepalive_socket_options(idle: int = INFLUXDB_KEEPALIVE_IDLE) -> list:
+    """socket option ของ urllib3 ที่เปิด TCP keep-alive เพื่อไม่ให้ connection ที่ว่างอยู่ใน pool ถูกตัดทิ้ง"""
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle))
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(idle // 4, 1)))
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4))
+    return options
+
+class InfluxClientManager:
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        org: str,
+        bucket: str,
+        pool_size: int = INFLUXDB_POOL_SIZE,
+        async_pool_size: int = INFLUXDB_ASYNC_POOL_SIZE,
+        timeout_ms: int = INFLUXDB_TIMEOUT_MS,
+        tcp_keepalive: bool = INFLUXDB_TCP_KEEPALIVE
+    ):
+        self.url = url
+        self.token = token
+        self.org = org
+        self.bucket = bucket
+        self.pool_size = pool_size
+        self.async_pool_size = async_pool_size
+        self.timeout_ms = timeout_ms
+        self.tcp_keepalive = tcp_keepalive
+        self._sync_client: Optional[InfluxDBClient] = None
+        self._async_client: Optional[InfluxDBClientAsync] = None
+
+    @classmethod
+    def from_env(cls) -> "InfluxClientManager":
+        return cls(
+            url=os.getenv("INFLUXDB_URL"),
+            token=os.getenv("INFLUXDB_TOKEN"),
+            org=os.getenv("INFLUXDB_ORG"),
+            bucket=os.getenv("INFLUXDB_BUCKET")
+        )
+
+    def _check_config(self):
+        if not all([self.url, self.token, self.org, self.bucket]):
+            raise ValueError("Missing required InfluxDB environment variables")
+
+    @property
+    def sync_client(self) -> InfluxDBClient:
+        """client แบบ sync (สร้างเมื่อเรียกใช้ครั้งแรก เพื่อให้ CLI ใช้ได้โดยไม่ต้องผ่าน lifespan)"""
+        if self._sync_client is None:
+            self._check_config()
+            self._sync_client = InfluxDBClient(
+                url=self.url,
+                token=self.token,
+                org=self.org,
+                timeout=self.timeout_ms,
+                connection_pool_maxsize=self.pool_size
+            )
+            if self.tcp_keepalive:
+                pool_manager = self._sync_client.api_client.rest_client.pool_manager
+                pool_manager.connection_pool_kw["socket_options"] = keepalive_socket_options()
+        return self._sync_client
+
+    @property
+    def async_client(self) -> InfluxDBClientAsync:
+        """client แบบ async (ต้องสร้างภายใน event loop)"""
+        if self._async_client is None:
+            self._check_config()
+            self._async_client = InfluxDBClientAsync(
+                url=self.url,
+                token=self.token,
+                org=self.org,
+                timeout=self.timeout_ms,
+                connection_pool_maxsize=self.async_pool_size
+            )
+        return self._async_client
+
+    def query_api(self):
+        """query api ของ client แบบ sync (blocking ใช้ใน threadpool หรือ CLI เท่านั้น)"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return self.sync_client.query_api()
+        raise RuntimeError("Blocking InfluxDB query called on the event loop, use fetch_rows() or run_in_threadpool")
+
+    async def start(self):
+        """สร้าง client ทั้งสองแบบตอนเริ่มแอป"""
+        self.sync_client
+        self.async_client
+        logger.info(
+            f"InfluxDB clients ready (pool={self.pool_size}, async_pool={self.async_pool_size}, "
+            f"timeout={self.timeout_ms}ms, tcp_keepalive={self.tcp_keepalive})"
+        )
+
+    async def close(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+        if self._sync_client is not None:
+            await run_in_threadpool(self._sync_client.close)
+            self._sync_client = None
+
+    def query_rows(self, query: str, columns: Optional[Iterable[str]] = None) -> Iterator[dict]:
+        """รัน Flux query แบบ blocking แล้วคืนแถวที่ถอดรหัสแบบ streaming (ใช้นอก event loop เท่านั้น)"""
+        return iter_rows(self.query_api().query_csv(query, org=self.org), columns)
+
+    async def fetch_rows(self, query: str, columns: Optional[Iterable[str]] = None) -> Iterator[dict]:
+        """รัน Flux query โดยไม่ block event loop แล้วถอดรหัสผลด้วย flux_decode"""
+        raw = await self.async_client.query_api().query_raw(query, org=self.org)
+        return iter_rows(csv.reader(io.StringIO(raw)), columns)
+
+class AsyncWriteApi:
+    """write api สำหรับ BufferedInfluxWriter ที่เขียนผ่าน client แบบ async ของ manager"""
+    def __init__(self, manager: InfluxClientManager):
+        self.manager = manager
+
+    async def write(self, bucket: str, org: str, record):
+        return await self.manager.async_client.write_api().write(bucket=bucket, org=org, record=record)
+
+influx_clients = InfluxClientManager.from_env()
@@ -0,0 +1,244 @@
+import asyncio
+import inspect
+import logging
+import os
+from typing import List, Optional
+
+from influxdb_client import Point
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE = int(os.getenv("INFLUXDB_WRITE_BATCH_SIZE", "500"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("INFLUXDB_WRITE_FLUSH_INTERVAL", "1.0"))
+WRITE_BUFFER_SIZE = int(os.getenv("INFLUXDB_WRITE_BUFFER_SIZE", "20000"))
+WRITE_ENQUEUE_TIMEOUT = float(os.getenv("INFLUXDB_WRITE_ENQUEUE_TIMEOUT", "2.0"))
+WRITE_MAX_RETRIES = int(os.getenv("INFLUXDB_WRITE_MAX_RETRIES", "3"))
+
+_STOP = object()
+
+class WriteBufferFull(Exception):
+    """buffer ของ writer เต็มและรอเกินเวลาที่กำหนด"""
+
+class _PendingWrite:
+    """point ของ 1 request ใน buffer ผลจะ resolve เมื่อ flush ครบทุก point และล้มเหลวถ้ามี batch ใดเขียนไม่สำเร็จ"""
+    __slots__ = ("points", "remaining", "future")
+
+    def __init__(self, points: List[Point], future: Optional[asyncio.Future]):
+        self.points = points
+        self.remaining = len(points)
+        self.future = future
+
+    def done(self, count: int, error: Optional[Exception]):
+        self.remaining -= count
+        if self.future is None or self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        elif self.remaining == 0:
+            self.future.set_result(len(self.points))
+
+class BufferedInfluxWriter:
+    """
+    เขียนข้อมูลลง InfluxDB แบบ background โดยเก็บ point ไว้ใน memory
+    แล้ว flush เมื่อครบ batch_size หรือครบ flush_interval วินาที
+    point ของ request เดียวกันเข้า buffer พร้อมกันทั้งหมดหรือไม่เข้าเลย
+    """
+    def __init__(
+        self,
+        write_api,
+        bucket: str,
+        org: str,
+        batch_size: int = WRITE_BATCH_SIZE,
+        flush_interval: float = WRITE_FLUSH_INTERVAL,
+        max_buffered: int = WRITE_BUFFER_SIZE,
+        enqueue_timeout: float = WRITE_ENQUEUE_TIMEOUT,
+        max_retries: int = WRITE_MAX_RETRIES
+    ):
+        self.write_api = write_api
+        self.bucket = bucket
+        self.org = org
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self.written_points = 0
+        self.failed_points = 0
+        self._buffered = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._space: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        # จำกัดขนาดด้วยจำนวน point (_buffered) ไม่ใช่จำนวน item ใน queue
+        self._queue = asyncio.Queue()
+        self._space = asyncio.Condition()
+        self._buffered = 0
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"InfluxDB writer started (batch_size={self.batch_size}, "
+            f"flush_interval={self.flush_interval}s, buffer={self.max_buffered})"
+        )
+
+    async def stop(self):
+        """หยุด writer หลังจาก flush ข้อมูลที่ค้างอยู่ใน buffer ทั้งหมด (ปฏิเสธการเขียนใหม่ตั้งแต่เริ่มหยุด)"""
+        if not self.running:
+            return
+        self._closing = True
+        async with self._space:
+            # ปลุก request ที่รอที่ว่างใน buffer ให้ล้มเหลวทันที
+            self._space.notify_all()
+        self._queue.put_nowait(_STOP)
+        try:
+            await self._task
+        finally:
+            self._task = None
+            self._fail_queued()
+        logger.info(f"InfluxDB writer stopped (written={self.written_points}, failed={self.failed_points})")
+
+    async def enqueue(self, points: List[Point], wait: bool = False):
+        """
+        เพิ่ม point ลง buffer
+        - wait=False: คืนค่าทันทีหลังจากเข้า buffer
+        - wait=True: รอจนกว่าข้อมูลทุก point จะถูกเขียนลง InfluxDB (โยน exception ถ้ามี batch ใดเขียนไม่สำเร็จ)
+        ถ้าที่ว่างใน buffer ไม่พอและรอเกิน enqueue_timeout จะโยน WriteBufferFull โดยไม่มี point ใดเข้า buffer
+        """
+        if not self.running:
+            raise RuntimeError("InfluxDB writer is not running")
+        if self._closing:
+            raise WriteBufferFull("InfluxDB writer is stopping")
+        if not points:
+            return
+        if len(points) > self.max_buffered:
+            raise WriteBufferFull(f"Request has {len(points)} points, buffer holds {self.max_buffered}")
+
+        async with self._space:
+            if self._buffered + len(points) > self.max_buffered:
+                try:
+                    await asyncio.wait_for(
+                        self._space.wait_for(
+                            lambda: self._closing or self._buffered + len(points) <= self.max_buffered
+                        ),
+                        self.enqueue_timeout
+                    )
+                except asyncio.TimeoutError:
+                    raise WriteBufferFull(f"Write buffer full ({self.max_buffered} points)")
+            # stop() อาจเริ่มระหว่างรอ ต้องตรวจซ้ำก่อนเข้าคิว (หลัง _STOP จะไม่มีใคร flush ให้)
+            if self._closing:
+                raise WriteBufferFull("InfluxDB writer is stopping")
+            self._buffered += len(points)
+            pending = _PendingWrite(points, asyncio.get_running_loop().create_future() if wait else None)
+            self._queue.put_nowait(pending)
+
+        if pending.future is not None:
+            return await pending.future
+
+    def stats(self) -> dict:
+        return {
+            "buffered": self._buffered,
+            "capacity": self.max_buffered,
+            "written": self.written_points,
+            "failed": self.failed_points
+        }
+
+    def _fail_queued(self):
+        """request ที่ยังค้างในคิวหลัง writer หยุด (เช่น _run ล้มเหลว) ให้ล้มเหลวแทนการรอตลอดไป"""
+        dropped = 0
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is _STOP:
+                continue
+            dropped += len(item.points)
+            item.done(item.remaining, WriteBufferFull("InfluxDB writer stopped"))
+        if dropped:
+            self._buffered -= dropped
+            self.failed_points += dropped
+            logger.error(f"Dropped {dropped} queued points because the InfluxDB writer stopped")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        # (point, request ที่เป็นเจ้าของ) ที่ยังไม่ได้ flush; request ใหญ่กว่า batch_size จะถูกแบ่งหลาย batch
+        pending = []
+        waiting = False
+        stopping = False
+        while pending or not stopping:
+            if not pending:
+                item = await self._queue.get()
+                if item is _STOP:
+                    break
+                pending.extend((point, item) for point in item.points)
+                waiting = item.future is not None
+            deadline = loop.time() + self.flush_interval
+
+            while not stopping and len(pending) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    # มีคนรอผลการเขียนอยู่ ให้ flush ทันทีไม่ต้องรอครบ interval
+                    if waiting:
+                        break
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    # ได้รับสัญญาณหยุด: flush ส่วนที่เหลือใน buffer ทั้งหมดก่อนออกจาก loop
+                    stopping = True
+                    while not self._queue.empty():
+                        item = self._queue.get_nowait()
+                        if item is not _STOP:
+                            pending.extend((point, item) for point in item.points)
+                    break
+                pending.extend((point, item) for point in item.points)
+                waiting = waiting or item.future is not None
+
+            batch, pending = pending[:self.batch_size], pending[self.batch_size:]
+            await self._flush(batch)
+            waiting = any(request.future is not None for _, request in pending)
+
+    async def _flush(self, batch: list):
+        points = [point for point, _ in batch]
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                if inspect.iscoroutinefunction(self.write_api.write):
+                    await self.write_api.write(bucket=self.bucket, org=self.org, record=points)
+                else:
+                    await run_in_threadpool(
+                        self.write_api.write, bucket=self.bucket, org=self.org, record=points
+                    )
+                error = None
+                break
+            except Exception as e:
+                error = e
+                logger.warning(f"InfluxDB write attempt {attempt + 1} failed for {len(points)} points: {str(e)}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(min(2 ** attempt * 0.5, 5))
+
+        if error is None:
+            self.written_points += len(points)
+        else:
+            self.failed_points += len(points)
+            logger.error(f"Dropped {len(points)} points after {self.max_retries + 1} attempts: {str(error)}")
+
+        counts = {}
+        for _, request in batch:
+            counts[request] = counts.get(request, 0) + 1
+        for request, count in counts.items():
+            request.done(count, error)
+
+        async with self._space:
+            self._buffered -= len(points)
+            self._space.notify_all()
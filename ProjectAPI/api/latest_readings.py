@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import pytz
+
+from api.flux_decode import clean_reading_value
+
+BANGKOK_TZ = pytz.timezone("Asia/Bangkok")
+
+LATEST_FIELDS = ["PM1", "PM2_5", "PM4", "PM10", "CO2", "temperature", "humidity"]
+LATEST_MAX_AGE = timedelta(hours=24)
+LATEST_FALLBACK_TTL = float(os.getenv("LATEST_READING_FALLBACK_TTL", "60"))
+LATEST_MISSING_TTL = float(os.getenv("LATEST_READING_MISSING_TTL", "30"))
+
+class LatestReadingStore:
+    """
+    เก็บค่าที่วัดได้ล่าสุดของแต่ละ node ใน memory (เติมจาก ingest path)
+    ค่าที่ได้จาก InfluxDB ตอน cold start จะหมดอายุภายใน fallback_ttl วินาที
+    node ที่ InfluxDB ไม่มีข้อมูลภายใน 24 ชั่วโมงจะถูกจำไว้ missing_ttl วินาที (ไม่ query ซ้ำทุก request)
+    """
+    def __init__(self, fallback_ttl: float = LATEST_FALLBACK_TTL, missing_ttl: float = LATEST_MISSING_TTL):
+        self.fallback_ttl = fallback_ttl
+        self.missing_ttl = missing_ttl
+        self._readings: Dict[str, tuple] = {}
+        self._missing: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, node_name: str, timestamp: datetime, values: dict, from_ingest: bool = True):
+        """บันทึกค่าล่าสุด (timestamp ต้องมี timezone) จะแทนที่ก็ต่อเมื่อใหม่กว่าค่าเดิม"""
+        expires_at = None if from_ingest else time.monotonic() + self.fallback_ttl
+        reading = {field: clean_reading_value(values.get(field)) for field in LATEST_FIELDS}
+        with self._lock:
+            self._missing.pop(node_name, None)
+            current = self._readings.get(node_name)
+            if current and current[0] > timestamp and (current[2] is None or time.monotonic() <= current[2]):
+                return
+            self._readings[node_name] = (timestamp, reading, expires_at)
+
+    def record_missing(self, node_name: str):
+        """จำว่า InfluxDB ไม่มีข้อมูลล่าสุดของ node นี้ (หมดอายุใน missing_ttl วินาที หรือเมื่อมีข้อมูลเข้ามา)"""
+        with self._lock:
+            self._missing[node_name] = time.monotonic() + self.missing_ttl
+
+    def is_missing(self, node_name: str) -> bool:
+        expires_at = self._missing.get(node_name)
+        return expires_at is not None and time.monotonic() <= expires_at
+
+    def get(self, node_name: str) -> Optional[dict]:
+        """คืนค่าล่าสุดในรูปแบบเดียวกับ /aqi/latest หรือ None ถ้าไม่มี/เก่าเกิน 24 ชั่วโมง"""
+        current = self._readings.get(node_name)
+        if current is None:
+            return None
+        timestamp, reading, expires_at = current
+        if expires_at is not None and time.monotonic() > expires_at:
+            return None
+        if datetime.now(pytz.UTC) - timestamp > LATEST_MAX_AGE:
+            return None
+        return self.format(timestamp, reading)
+
+    def invalidate(self, node_name: str):
+        with self._lock:
+            self._readings.pop(node_name, None)
+            self._missing.pop(node_name, None)
+
+    @staticmethod
+    def format(timestamp: datetime, reading: dict) -> dict:
+        local_time = timestamp.astimezone(BANGKOK_TZ)
+        return {
+            "timestamp": local_time.isoformat(),
+            "datetime": local_time.strftime("%Y-%m-%d %H:%M:%S"),
+            **{field: clean_reading_value(reading.get(field)) for field in LATEST_FIELDS}
+        }
+
+latest_readings = LatestReadingStore()
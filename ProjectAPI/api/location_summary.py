@@ -0,0 +1,63 @@
+import os
+import threading
+import time
+from typing import List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from api.constants import STATUS_ONLINE
+from api.models import Nodes
+
+LOCATION_SUMMARY_TTL = float(os.getenv("LOCATION_SUMMARY_TTL", "60"))
+
+class LocationSummaryCache:
+    """
+    สรุปจำนวน node ทั้งหมด/ที่ออนไลน์ของแต่ละ location ด้วย GROUP BY เดียว แล้วเก็บผลไว้ใน memory
+    ต้องเรียก invalidate() เมื่อมีการเพิ่ม/ลบ/ย้าย location ของ node หรือสถานะ node เปลี่ยน
+    ttl เป็นตัวกันกรณีตาราง nodes ถูกแก้จากนอกแอป
+    """
+    def __init__(self, ttl: float = LOCATION_SUMMARY_TTL):
+        self.ttl = ttl
+        self._summary: Optional[List[dict]] = None
+        self._expires_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, db: Session) -> List[dict]:
+        with self._lock:
+            if self._summary is not None and time.monotonic() < self._expires_at:
+                return self._summary
+            generation = self._generation
+
+        summary = self.load(db)
+
+        with self._lock:
+            # ถ้ามีการ invalidate ระหว่าง query ไม่เก็บผลเก่าลง cache
+            if generation == self._generation:
+                self._summary = summary
+                self._expires_at = time.monotonic() + self.ttl
+        return summary
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._summary = None
+
+    @staticmethod
+    def load(db: Session) -> List[dict]:
+        rows = db.query(
+            Nodes.location,
+            func.count(Nodes.node_id),
+            func.count(Nodes.node_id).filter(Nodes.status == STATUS_ONLINE)
+        ).group_by(Nodes.location).order_by(Nodes.location).all()
+
+        return [{
+            "location": location,
+            "display_name": f"{location} ({online_nodes}/{total_nodes} nodes online)",
+            "total_nodes": total_nodes,
+            "online_nodes": online_nodes,
+            "available": online_nodes > 0
+        } for location, total_nodes, online_nodes in rows]
+
+location_summary = LocationSummaryCache()
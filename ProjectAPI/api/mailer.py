@@ -0,0 +1,252 @@
+"""
+ส่งอีเมลผ่าน pool ของ SMTP connection ที่ login ค้างไว้ แทนการเปิด SMTP + STARTTLS + login ใหม่ทุกฉบับ
+
+- connection ถูกสร้างเมื่อจำเป็น (ไม่เกิน SMTP_POOL_SIZE) และนำกลับมาใช้ซ้ำ
+- connection ที่ว่างนานเกิน SMTP_MAX_IDLE วินาทีจะถูกตรวจด้วย NOOP ก่อนใช้
+- ถ้าการส่งล้มเหลวเพราะ connection หลุด จะต่อใหม่แล้วส่งซ้ำ 1 ครั้ง
+- ส่งแบบ background ผ่าน worker thread จำนวน MAILER_WORKERS และคิวจำกัดขนาด MAILER_QUEUE_SIZE
+
+ทดสอบโหลดกับ SMTP server ในเครื่องได้ เช่น
+    python -m aiosmtpd -n -l localhost:1025
+    SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=false SMTP_USERNAME= ...
+"""
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.message import Message
+from typing import Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+SMTP_USERNAME = os.getenv("SMTP_USERNAME", os.getenv("EMAIL"))
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", os.getenv("EMAIL_PASSWORD"))
+# ผู้ส่งใน envelope (MAIL FROM) ให้ตรงกับ From ของอีเมล ไม่ใช่ชื่อบัญชีที่ใช้ login
+SMTP_FROM = os.getenv("SMTP_FROM", os.getenv("EMAIL"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "3"))
+SMTP_MAX_IDLE = float(os.getenv("SMTP_MAX_IDLE", "60"))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+MAILER_WORKERS = int(os.getenv("MAILER_WORKERS", str(SMTP_POOL_SIZE)))
+MAILER_QUEUE_SIZE = int(os.getenv("MAILER_QUEUE_SIZE", "1000"))
+
+def _is_connection_error(error: Exception) -> bool:
+    """error ที่แปลว่า connection ใช้ต่อไม่ได้ (ต่อใหม่แล้วส่งซ้ำได้) ไม่รวม error ที่ server ตอบกลับมา"""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+def is_permanent_failure(error: Exception) -> bool:
+    """server ปฏิเสธผู้รับหรืออีเมลถาวร (รหัส 5xx) ส่งซ้ำไปก็ไม่สำเร็จ"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+class _PooledConnection:
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.last_used = time.monotonic()
+        self.sent = 0
+
+class SMTPConnectionPool:
+    def __init__(
+        self,
+        host: str = SMTP_HOST,
+        port: int = SMTP_PORT,
+        username: Optional[str] = SMTP_USERNAME,
+        password: Optional[str] = SMTP_PASSWORD,
+        from_addr: Optional[str] = SMTP_FROM,
+        starttls: bool = SMTP_STARTTLS,
+        timeout: float = SMTP_TIMEOUT,
+        size: int = SMTP_POOL_SIZE,
+        max_idle: float = SMTP_MAX_IDLE,
+        max_messages: int = SMTP_MAX_MESSAGES_PER_CONNECTION
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.from_addr = from_addr
+        self.starttls = starttls
+        self.timeout = timeout
+        self.size = size
+        self.max_idle = max_idle
+        self.max_messages = max_messages
+        self.connects = 0
+        self._idle: "queue.LifoQueue[_PooledConnection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def _connect(self) -> _PooledConnection:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            self._quit(smtp)
+            raise
+        with self._lock:
+            self.connects += 1
+        return _PooledConnection(smtp)
+
+    @staticmethod
+    def _quit(smtp: smtplib.SMTP):
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+    def _usable(self, conn: _PooledConnection) -> bool:
+        if conn.sent >= self.max_messages:
+            return False
+        if time.monotonic() - conn.last_used < self.max_idle:
+            return True
+        try:
+            return conn.smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def acquire(self) -> _PooledConnection:
+        """ยืม connection (รอถ้าใช้ครบ size แล้ว) ต้องคืนด้วย release() หรือ discard() เสมอ"""
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if self._usable(conn):
+                    return conn
+                self._quit(conn.smtp)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn: _PooledConnection):
+        conn.last_used = time.monotonic()
+        self._idle.put(conn)
+        self._slots.release()
+
+    def discard(self, conn: _PooledConnection):
+        self._quit(conn.smtp)
+        self._slots.release()
+
+    def send(self, message: Message, to_addrs, from_addr: Optional[str] = None):
+        """ส่งอีเมล 1 ฉบับ ถ้า connection หลุดจะต่อใหม่และส่งซ้ำ 1 ครั้ง"""
+        from_addr = from_addr or self.from_addr or self.username
+        for attempt in range(2):
+            conn = self.acquire()
+            try:
+                conn.smtp.sendmail(from_addr, to_addrs, message.as_string())
+            except Exception as e:
+                self.discard(conn)
+                if attempt == 0 and _is_connection_error(e):
+                    logger.warning(f"SMTP connection failed, reconnecting: {str(e)}")
+                    continue
+                raise
+            conn.sent += 1
+            self.release(conn)
+            return
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(conn.smtp)
+
+class MailQueueFull(Exception):
+    """คิวของ mailer เต็ม"""
+
+class Mailer:
+    def __init__(
+        self,
+        pool: Optional[SMTPConnectionPool] = None,
+        workers: int = MAILER_WORKERS,
+        queue_size: int = MAILER_QUEUE_SIZE
+    ):
+        self.pool = pool or SMTPConnectionPool()
+        self.workers = workers
+        self.queue_size = queue_size
+        self.sent = 0
+        self.failed = 0
+        self._pending = threading.BoundedSemaphore(queue_size)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="mailer")
+            return self._executor
+
+    def deliver(self, message: Message, to_addrs):
+        """ส่งทันทีใน thread ปัจจุบัน (ใช้ connection จาก pool) โยน exception ถ้าส่งไม่สำเร็จ"""
+        try:
+            self.pool.send(message, to_addrs)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        with self._lock:
+            self.sent += 1
+
+    def send(self, message: Message, to_addrs) -> bool:
+        """เหมือน deliver() แต่คืน True/False แทนการโยน exception"""
+        try:
+            self.deliver(message, to_addrs)
+            return True
+        except Exception as e:
+            logger.error(f"Error sending email to {to_addrs}: {str(e)}")
+            return False
+
+    def submit(self, message: Message, to_addrs, timeout: Optional[float] = None, raise_errors: bool = False) -> Future:
+        """
+        เข้าคิวให้ worker ส่ง คืน Future ของผลลัพธ์ โยน MailQueueFull ถ้าคิวเต็มเกิน timeout
+        raise_errors=False: ผลเป็น True/False, raise_errors=True: future.exception() คือ error ที่เกิดขึ้น
+        """
+        if not self._pending.acquire(timeout=timeout):
+            raise MailQueueFull(f"Mail queue full ({self.queue_size} messages)")
+        try:
+            future = self._get_executor().submit(self.deliver if raise_errors else self.send, message, to_addrs)
+        except Exception:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def send_many(self, messages: Iterable[Tuple[Message, str]]) -> List[bool]:
+        """ส่งหลายฉบับพร้อมกันด้วย worker pool แล้วรอจนเสร็จ คืนผลตามลำดับ"""
+        futures = [self.submit(message, to_addrs) for message, to_addrs in messages]
+        return [future.result() for future in futures]
+
+    def deliver_many(self, messages: Iterable[Tuple[Message, str]]) -> List[Optional[Exception]]:
+        """เหมือน send_many() แต่คืน error ของแต่ละฉบับ (None = ส่งสำเร็จ) ให้ผู้เรียกแยกได้ว่าควรส่งซ้ำหรือไม่"""
+        futures = [self.submit(message, to_addrs, raise_errors=True) for message, to_addrs in messages]
+        return [future.exception() for future in futures]
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "failed": self.failed, "connects": self.pool.connects}
+
+    def close(self):
+        """รอให้งานที่ค้างส่งเสร็จ แล้วปิด connection ทั้งหมด"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        self.pool.close()
+
+mailer = Mailer()
@@ -1,4 +1,8 @@
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
+import anyio
+import logging
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
@@ -14,13 +18,47 @@ from api.aqi_routes import *
 from api.user_routes import *
 from api.node_routes import *
 from api.notification_routes import *
+from api.node_registry import node_registry
+from api.heartbeat import heartbeats
+from api.digest import digest_scheduler, DIGEST_SCHEDULE_ENABLED
+from api.mailer import mailer
+from api.password_hashing import password_hasher
+from api.schema import init_db
+from api.influx_client import influx_clients
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # route ที่ใช้ PostgreSQL เป็น def ธรรมดาและรันใน threadpool นี้
+    anyio.to_thread.current_default_thread_limiter().total_tokens = DB_THREADPOOL_SIZE
+    logger.info(f"Threadpool limit {DB_THREADPOOL_SIZE} (DB pool {DB_POOL_SIZE}+{DB_MAX_OVERFLOW})")
+    await influx_clients.start()
+    await influx_writer.start()
+    await run_in_threadpool(password_hasher.start)
+    try:
+        await run_in_threadpool(init_db)
+        await run_in_threadpool(node_registry.reload)
+    except Exception as e:
+        logger.warning(f"Database startup tasks failed: {str(e)}")
+    await heartbeats.start()
+    if DIGEST_SCHEDULE_ENABLED:
+        await digest_scheduler.start()
+    yield
+    await digest_scheduler.stop()
+    await heartbeats.stop()
+    await influx_writer.stop()
+    await influx_clients.close()
+    await run_in_threadpool(mailer.close)
+    await run_in_threadpool(password_hasher.close)
+
 app = FastAPI(
     title="Air Quality API",
     description="",
-    root_path="/eng.rmuti"
+    root_path="/eng.rmuti",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, Text, ForeignKey, DateTime, Boolean, CheckConstraint
+from sqlalchemy import Column, Integer, Text, ForeignKey, DateTime, Date, Boolean, CheckConstraint, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, literal_column, text
 from datetime import datetime
 
 # from database import Base
@@ -20,9 +21,14 @@ class Users(Base):
     password = Column(Text, nullable=False)
     is_verified = Column(Boolean, default=False)
     role = Column(Integer, nullable=False, default=ROLE_NODE_OWNER)
+    # เพิ่มค่าเมื่อต้องการยกเลิก token ทั้งหมดของผู้ใช้ (token ที่มี claim ver ไม่ตรงจะใช้ไม่ได้)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
     
     __table_args__ = (
         CheckConstraint(f'role IN ({ROLE_NODE_OWNER}, {ROLE_ADMIN})', name='check_valid_role'),
+        # login (username หรือ email) และตรวจซ้ำตอนสมัคร
+        Index("ix_users_username", "username"),
+        Index("ix_users_email", "email"),
     )
 
     nodes = relationship("Nodes", back_populates="user")
@@ -32,6 +38,29 @@ class Users(Base):
     def role_text(self) -> str:
         return ROLE_CHOICES.get(self.role, "Unknown")
 
+# ข้อความที่ใช้ค้นหาผู้ใช้ (ทุกคอลัมน์เป็น NOT NULL จึงต่อด้วย || ได้และใช้เป็น expression index ได้)
+# ตัวคั่นเป็น literal ในตัว SQL เพื่อให้ query ตรงกับ expression ของ index
+_SEARCH_SEPARATOR = literal_column("' '")
+USER_SEARCH_TEXT = (
+    Users.username + _SEARCH_SEPARATOR + Users.email + _SEARCH_SEPARATOR + Users.first_name
+    + _SEARCH_SEPARATOR + Users.last_name + _SEARCH_SEPARATOR + Users.phone
+)
+def has_extension(name: str):
+    """เงื่อนไข ddl_if: สร้าง index เฉพาะเมื่อฐานข้อมูลมี extension นี้แล้ว (ดู EXTENSIONS ใน api.schema)"""
+    def check(ddl, target, bind, **kw):
+        return bind is not None and bind.execute(
+            text("SELECT 1 FROM pg_extension WHERE extname = :name"), {"name": name}
+        ).first() is not None
+    return check
+
+# index trigram สำหรับ ILIKE '%คำค้น%' ของ api.user_search
+Index(
+    "ix_users_search_trgm",
+    USER_SEARCH_TEXT.label("search_text"),
+    postgresql_using="gin",
+    postgresql_ops={"search_text": "gin_trgm_ops"}
+).ddl_if(dialect="postgresql", callable_=has_extension("pg_trgm"))
+
 class Token(Base):
     __tablename__ = "tokens"
     token_id = Column(Integer, primary_key=True, index=True)
@@ -41,6 +70,11 @@ class Token(Base):
     is_verified = Column(Boolean, default=False)
     user = relationship("Users", back_populates="tokens")
 
+    __table_args__ = (
+        # verify-email และ reset-password ค้นจาก token
+        Index("ix_tokens_verification_token", "verification_token"),
+    )
+
     def is_token_expired(self):
         return datetime.utcnow() > self.token_expiry if self.token_expiry else False
 
@@ -55,12 +89,21 @@ class Nodes(Base):
     user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False, index=True)
     status = Column(Integer, nullable=False, default=STATUS_OFFLINE)
     created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    # NOT NULL เพราะเป็น key ของ cursor ใน /node/all (NULL เทียบแบบ row ไม่ได้และจะหลุดจากทุกหน้า)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
 
     user = relationship("Users", back_populates="nodes")
 
     __table_args__ = (
         CheckConstraint(f'status IN ({STATUS_OFFLINE}, {STATUS_ONLINE})', name='check_valid_status'),
+        # keyset pagination ของ /node/all (เรียงตาม updated_at หรือชื่อ แล้วตาม node_id)
+        Index("ix_nodes_updated_at", "updated_at", "node_id"),
+        Index("ix_nodes_node_name", "node_name", "node_id"),
+        # กรองด้วย prefix ของชื่อ (LIKE 'abc%') ได้ไม่ว่า collation ของฐานข้อมูลจะเป็นอะไร
+        Index("ix_nodes_node_name_prefix", "node_name", postgresql_ops={"node_name": "text_pattern_ops"}),
+        Index("ix_nodes_location_status", "location", "status"),
+        # verify_node_access และตรวจชื่อซ้ำของ node ในผู้ใช้คนเดียวกัน
+        Index("ix_nodes_user_id_node_name", "user_id", "node_name"),
         )
     
     @property
@@ -78,4 +121,72 @@ class Notification(Base):
     location = Column(Text, nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        # ผู้สมัครที่ active ตาม location (daily digest และหน้า admin)
+        Index("ix_notification_active_location", "location", postgresql_where=(is_active == True)),
+    )
+
+class NodeDataMonth(Base):
+    """ดัชนีเดือน (yyyy-mm, UTC) ที่ node มีข้อมูล air_quality ใน InfluxDB"""
+    __tablename__ = "node_data_months"
+
+    node_name = Column(Text, primary_key=True)
+    month = Column(Text, primary_key=True)
+    created_at = Column(DateTime, server_default=func.now())
+
+class EmailOutbox(Base):
+    """คิวอีเมลขาออก เขียนใน transaction เดียวกับการเปลี่ยนแปลงที่ทำให้ต้องส่ง แล้วให้ dispatcher (api.outbox) ส่งภายหลัง"""
+    __tablename__ = "email_outbox"
+
+    outbox_id = Column(Integer, primary_key=True)
+    kind = Column(Text, nullable=False)
+    recipient = Column(Text, nullable=False)
+    payload = Column(JSONB, nullable=False, default=dict)
+    status = Column(Integer, nullable=False, default=OUTBOX_PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        CheckConstraint(f'status IN ({OUTBOX_PENDING}, {OUTBOX_SENT}, {OUTBOX_FAILED})', name='check_valid_outbox_status'),
+        # dispatcher ดึงเฉพาะรายการที่รอส่งและถึงเวลาแล้ว
+        Index("ix_email_outbox_pending", "next_attempt_at", postgresql_where=(status == OUTBOX_PENDING)),
+    )
+
+class DigestRun(Base):
+    """บันทึกการส่งอีเมลสรุปคุณภาพอากาศรายวัน 1 แถวต่อวัน (digest_date unique กันส่งซ้ำ)"""
+    __tablename__ = "digest_runs"
+
+    run_id = Column(Integer, primary_key=True)
+    digest_date = Column(Date, unique=True, nullable=False)
+    started_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+    duration_ms = Column(Integer)
+    locations = Column(Integer, nullable=False, default=0)
+    skipped_locations = Column(Integer, nullable=False, default=0)
+    subscribers = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+
+class DigestDelivery(Base):
+    """ผลการส่ง daily digest รายผู้รับ รอบที่จองใหม่จะส่งเฉพาะผู้รับที่ยังไม่สำเร็จและไม่ถูกปฏิเสธถาวร"""
+    __tablename__ = "digest_deliveries"
+
+    delivery_id = Column(Integer, primary_key=True)
+    digest_date = Column(Date, nullable=False)
+    location = Column(Text, nullable=False)
+    email = Column(Text, nullable=False)
+    status = Column(Integer, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("digest_date", "location", "email", name="uq_digest_deliveries_recipient"),
+        CheckConstraint(f'status IN ({DIGEST_SENT}, {DIGEST_FAILED}, {DIGEST_REJECTED})', name='check_valid_digest_status'),
+    )
@@ -0,0 +1,158 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from api.models import NodeDataMonth, Nodes
+from api.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# node ที่สแกน InfluxDB แล้วไม่พบข้อมูล จะไม่สแกนซ้ำจนกว่าจะครบเวลานี้ (วินาที)
+MONTHS_SCAN_TTL = float(os.getenv("MONTHS_SCAN_TTL", "3600"))
+
+def month_of(timestamp: datetime) -> str:
+    return timestamp.strftime("%Y-%m")
+
+class MonthsCatalog:
+    """
+    ดัชนีเดือนที่แต่ละ node มีข้อมูล เก็บในตาราง node_data_months
+    เพิ่มทีละเดือนตอนรับข้อมูล และ cache ไว้ใน memory หลังจากอ่านครั้งแรก
+    """
+    def __init__(self, scan_ttl: float = MONTHS_SCAN_TTL):
+        self.scan_ttl = scan_ttl
+        self._months: Dict[str, Set[str]] = {}
+        # node_name -> เวลาที่สแกน (monotonic)
+        self._scanned: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def months(self, node_name: str, db: Session) -> List[str]:
+        cached = self._months.get(node_name)
+        if cached is None:
+            rows = db.query(NodeDataMonth.month).filter(NodeDataMonth.node_name == node_name).all()
+            cached = {row[0] for row in rows}
+            with self._lock:
+                cached = self._months.setdefault(node_name, cached)
+        return sorted(cached)
+
+    def record(self, node_name: str, months: Iterable[str], db: Session) -> List[str]:
+        """บันทึกเดือนที่ยังไม่มีในดัชนี คืนค่ารายการเดือนที่เพิ่มใหม่"""
+        known = self._months.get(node_name)
+        if known is None:
+            known = set(self.months(node_name, db))
+        new_months = sorted(set(months) - known)
+        if not new_months:
+            return []
+
+        db.execute(
+            insert(NodeDataMonth)
+            .values([{"node_name": node_name, "month": month} for month in new_months])
+            .on_conflict_do_nothing(index_elements=["node_name", "month"])
+        )
+        db.commit()
+
+        with self._lock:
+            if node_name in self._months:
+                self._months[node_name].update(new_months)
+        return new_months
+
+    def months_or_scan(self, node_name: str, db: Session) -> List[str]:
+        """
+        เหมือน months() แต่ถ้า node ยังไม่มีในดัชนีเลย (เช่นยังไม่เคย backfill)
+        จะสแกน InfluxDB ของ node นั้นไม่เกิน 1 ครั้งต่อ scan_ttl วินาที แล้วบันทึกผลลงดัชนี
+        ชื่อที่ไม่มีในตาราง nodes คืนค่าว่างโดยไม่สแกนและไม่เก็บไว้ใน cache
+        """
+        months = self.months(node_name, db)
+        if months:
+            return months
+        if db.query(Nodes.node_id).filter(Nodes.node_name == node_name).first() is None:
+            self.invalidate(node_name)
+            return []
+
+        now = time.monotonic()
+        with self._lock:
+            scanned_at = self._scanned.get(node_name)
+            if scanned_at is not None and now - scanned_at < self.scan_ttl:
+                return months
+            # ลบรายการที่หมดอายุ ขนาดจึงไม่เกินจำนวน node ที่สแกนภายใน scan_ttl
+            for name, at in list(self._scanned.items()):
+                if now - at >= self.scan_ttl:
+                    del self._scanned[name]
+            self._scanned[node_name] = now
+
+        found = self.scan_influx([node_name]).get(node_name, set())
+        if found:
+            self.record(node_name, found, db)
+        return self.months(node_name, db)
+
+    def invalidate(self, node_name: Optional[str] = None):
+        with self._lock:
+            if node_name is None:
+                self._months.clear()
+            else:
+                self._months.pop(node_name, None)
+
+    def scan_influx(self, node_names: Optional[List[str]] = None, start: str = "-10y") -> Dict[str, Set[str]]:
+        """นับข้อมูลรายเดือนจาก InfluxDB (1 ตารางต่อ node) เพื่อสร้างดัชนีใหม่"""
+        from api.aqi_routes import query_rows, INFLUXDB_BUCKET
+
+        node_filter = ""
+        if node_names:
+            node_set = ", ".join(f'"{name}"' for name in node_names)
+            node_filter = f'|> filter(fn: (r) => contains(value: r["node_name"], set: [{node_set}]))'
+
+        query = f'''
+            from(bucket: "{INFLUXDB_BUCKET}")
+              |> range(start: {start})
+              |> filter(fn: (r) => r["_measurement"] == "air_quality")
+              |> filter(fn: (r) => r["_field"] == "PM2_5")
+              {node_filter}
+              |> aggregateWindow(every: 1mo, fn: count, createEmpty: false, timeSrc: "_start")
+              |> keep(columns: ["_time", "_value", "node_name"])
+        '''
+        found: Dict[str, Set[str]] = {}
+        for row in query_rows(query):
+            if row.get("_value"):
+                found.setdefault(row.get("node_name"), set()).add(month_of(row["_time"]))
+        return found
+
+    def backfill(self, node_names: Optional[List[str]] = None, start: str = "-10y") -> Dict[str, int]:
+        """สร้างดัชนีจากข้อมูลเดิมใน InfluxDB คืนค่าจำนวนเดือนที่เพิ่มใหม่ต่อ node"""
+        found = self.scan_influx(node_names, start)
+        added = {}
+        db = SessionLocal()
+        try:
+            for node_name, months in found.items():
+                self.invalidate(node_name)
+                added[node_name] = len(self.record(node_name, months, db))
+        finally:
+            db.close()
+        return added
+
+months_catalog = MonthsCatalog()
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the node_data_months catalog")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subparsers.add_parser("backfill", help="Rebuild the catalog from InfluxDB")
+    backfill_parser.add_argument("node_names", nargs="*", help="Nodes to backfill (default: every node)")
+    backfill_parser.add_argument("--start", default="-10y", help="Flux range start, e.g. -2y or 2023-01-01T00:00:00Z")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from api.schema import init_db
+    init_db()
+
+    added = months_catalog.backfill(args.node_names or None, args.start)
+    for node_name in sorted(added):
+        print(f"{node_name}: {added[node_name]} month(s) added")
+    print(f"Backfill finished for {len(added)} node(s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from api.models import Nodes
+from api.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+NODE_REGISTRY_TTL = float(os.getenv("NODE_REGISTRY_TTL", "300"))
+NODE_REGISTRY_RETRY = float(os.getenv("NODE_REGISTRY_RETRY", "30"))
+
+@dataclass(frozen=True)
+class NodeEntry:
+    """ข้อมูล node ที่จำเป็นสำหรับยืนยันตัวตนตอนส่งข้อมูล"""
+    node_id: int
+    node_name: str
+    location: str
+    user_id: Optional[int]
+    node_token: str
+
+    @classmethod
+    def from_node(cls, node: Nodes) -> "NodeEntry":
+        return cls(
+            node_id=node.node_id,
+            node_name=node.node_name,
+            location=node.location,
+            user_id=node.user_id,
+            node_token=node.node_token
+        )
+
+class NodeTokenRegistry:
+    """
+    ตาราง token -> node ใน memory สำหรับ ingest
+    โหลดทั้งหมดตอน startup, อัปเดตเมื่อ node ถูกเพิ่ม/แก้ไข/ลบ และโหลดใหม่ทุก ttl วินาที
+    การโหลดใหม่ทำทีละครั้งใน background ถ้าโหลดไม่สำเร็จ (เช่น DB ล่ม) จะลองใหม่หลัง retry_interval วินาที
+    """
+    def __init__(self, ttl: float = NODE_REGISTRY_TTL, retry_interval: float = NODE_REGISTRY_RETRY):
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self._by_token: Dict[str, NodeEntry] = {}
+        self._loaded_at: Optional[float] = None
+        self._next_reload_at = 0.0
+        self._reloading = False
+        self._reload_task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_stale(self) -> bool:
+        return time.monotonic() >= self._next_reload_at
+
+    def reload(self, db: Optional[Session] = None):
+        """โหลด node ทั้งหมดจาก PostgreSQL แทนที่ข้อมูลเดิม"""
+        owns_session = db is None
+        db = db or SessionLocal()
+        try:
+            rows = db.query(Nodes).all()
+            entries = {node.node_token: NodeEntry.from_node(node) for node in rows}
+        finally:
+            if owns_session:
+                db.close()
+
+        with self._lock:
+            self._by_token = entries
+            self._loaded_at = time.monotonic()
+            self._next_reload_at = self._loaded_at + self.ttl
+        logger.info(f"Node token registry loaded: {len(entries)} nodes")
+
+    def reload_if_stale(self) -> bool:
+        """โหลดใหม่ถ้าหมดอายุ ทีละ thread เดียว (thread อื่นใช้ข้อมูลเดิมต่อ) คืน True ถ้าโหลดสำเร็จในรอบนี้"""
+        with self._lock:
+            if self._reloading or not self.is_stale:
+                return False
+            self._reloading = True
+        try:
+            self.reload()
+            return True
+        except Exception as e:
+            # ไม่ลองใหม่ทุก request ระหว่างที่ DB ล่ม
+            with self._lock:
+                self._next_reload_at = time.monotonic() + self.retry_interval
+            logger.warning(f"Node registry reload failed, retrying in {self.retry_interval:.0f}s: {str(e)}")
+            return False
+        finally:
+            with self._lock:
+                self._reloading = False
+
+    def refresh_in_background(self):
+        """เริ่มโหลดใหม่ใน threadpool ถ้าหมดอายุ โดยไม่รอผล (เรียกจาก event loop)"""
+        if self.is_stale and (self._reload_task is None or self._reload_task.done()):
+            self._reload_task = asyncio.get_running_loop().create_task(run_in_threadpool(self.reload_if_stale))
+
+    def get(self, node_token: str) -> Optional[NodeEntry]:
+        return self._by_token.get(node_token)
+
+    def upsert(self, node: Nodes) -> NodeEntry:
+        entry = NodeEntry.from_node(node)
+        with self._lock:
+            self._by_token[entry.node_token] = entry
+        return entry
+
+    def remove(self, node_token: str):
+        with self._lock:
+            self._by_token.pop(node_token, None)
+
+    def __len__(self) -> int:
+        return len(self._by_token)
+
+node_registry = NodeTokenRegistry()
@@ -1,16 +1,18 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy import tuple_
 from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime, timedelta
 import logging
 import secrets
+import json
+import base64
 import pytz
 import os
-from contextlib import contextmanager
+from starlette.concurrency import run_in_threadpool
 
-from influxdb_client import InfluxDBClient
-from influxdb_client.client.exceptions import InfluxDBError
 
 # from models import *
 # from database import *
@@ -19,6 +21,11 @@ from influxdb_client.client.exceptions import InfluxDBError
 from api.models import *
 from api.database import *
 from api.user_routes import *
+from api.node_registry import node_registry
+from api.influx_client import influx_clients
+from api.heartbeat import heartbeats, update_node_statuses
+from api.location_summary import location_summary
+from api.user_search import escape_like
 
 logger = logging.getLogger(__name__)
 
@@ -56,17 +63,6 @@ class NodeStatusResponse(BaseModel):
     status_text: str
     last_data_time: Optional[str] = None
 
-class InfluxDBConfig:
-    """InfluxDB configuration"""
-    def __init__(self):
-        self.url = os.getenv("INFLUXDB_URL")
-        self.token = os.getenv("INFLUXDB_TOKEN")
-        self.org = os.getenv("INFLUXDB_ORG")
-        self.bucket = os.getenv("INFLUXDB_BUCKET")
-        
-        if not all([self.url, self.token, self.org, self.bucket]):
-            raise ValueError("Missing required InfluxDB environment variables")
-
 def create_node_token(node_id: str) -> str:
     """สร้าง random token สำหรับ Node"""
     try:
@@ -110,39 +106,11 @@ def handle_error(e: Exception) -> HTTPException:
         }
     )
 
-@contextmanager
-def get_influx_client():
-    """Context manager for InfluxDB client"""
-    config = InfluxDBConfig()
-    client = None
-    try:
-        client = InfluxDBClient(
-            url=config.url,
-            token=config.token,
-            org=config.org
-        )
-        yield client, config
-    except InfluxDBError as e:
-        logger.error(f"InfluxDB connection error: {str(e)}")
-        raise HTTPException(
-            status_code=503,
-            detail={"status": 0, "message": "ไม่สามารถเชื่อมต่อกับฐานข้อมูล InfluxDB ได้", "data": {}}
-        )
-    except Exception as e:
-        logger.error(f"Unexpected InfluxDB error: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail={"status": 0, "message": "เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล", "data": {}}
-        )
-    finally:
-        if client:
-            client.close()
-
 @node_router.post("/add", summary="เพิ่ม Node ใหม่")
-async def add_node(
+def add_node(
     req: NodeRequest,
     db: Session = Depends(get_db),
-    current_user: Users = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """สร้าง node ใหม่สำหรับตรวจวัดคุณภาพอากาศ"""
     try:
@@ -180,6 +148,8 @@ async def add_node(
         db.add(new_node)
         db.commit()
         db.refresh(new_node)
+        node_registry.upsert(new_node)
+        location_summary.invalidate()
 
         logger.info(f"Node created successfully: {new_node.node_id}")
         return {
@@ -204,13 +174,139 @@ async def add_node(
         logger.error(f"Unexpected error in add_node: {str(e)}")
         raise handle_error(e)
 
+NODE_PAGE_SIZE = int(os.getenv("NODE_PAGE_SIZE", "100"))
+NODE_PAGE_MAX = int(os.getenv("NODE_PAGE_MAX", "1000"))
+NODE_STREAM_BATCH = int(os.getenv("NODE_STREAM_BATCH", "500"))
+
+# sort -> (คอลัมน์, เรียงจากมากไปน้อย) ทุกแบบเรียงตาม node_id ต่อเพื่อให้ลำดับแน่นอน
+NODE_SORTS = {
+    "node_id": (Nodes.node_id, False),
+    "name": (Nodes.node_name, False),
+    "updated_at": (Nodes.updated_at, True),
+}
+
+def node_to_dict(node: Nodes) -> dict:
+    return {
+        "node_id": node.node_id,
+        "node_name": node.node_name,
+        "location": node.location,
+        "description": node.description,
+        "status": node.status,
+        "status_text": node.status_text,
+        "created_at": format_timestamp(node.created_at),
+        "updated_at": format_timestamp(node.updated_at),
+        "user_id": node.user_id,
+        "node_token": node.node_token
+    }
+
+def bad_request(message: str) -> HTTPException:
+    return HTTPException(status_code=400, detail={"status": 0, "message": message, "data": {}})
+
+def encode_node_cursor(sort: str, node: Nodes) -> str:
+    """cursor ของหน้าถัดไป = ค่าที่ใช้เรียงและ node_id ของแถวสุดท้าย"""
+    value = getattr(node, NODE_SORTS[sort][0].key)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([sort, value, node.node_id]).encode()).decode()
+
+def decode_node_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        cursor_sort, value, node_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if cursor_sort == "updated_at":
+            value = datetime.fromisoformat(value)
+        if value is None or not isinstance(node_id, int):
+            raise ValueError("empty cursor key")
+    except Exception:
+        raise bad_request("cursor ไม่ถูกต้อง")
+    if cursor_sort != sort:
+        raise bad_request("cursor ไม่ตรงกับ sort ที่เลือก")
+    return value, node_id
+
+def build_node_query(
+    db: Session,
+    status: Optional[int] = None,
+    location: Optional[str] = None,
+    user_id: Optional[int] = None,
+    name_prefix: Optional[str] = None,
+    sort: str = "node_id",
+    after: Optional[tuple] = None
+):
+    """query ของ nodes ตามตัวกรอง เรียงตาม sort (after: ค่าจาก decode_node_cursor สำหรับหน้าถัดไป)"""
+    query = db.query(Nodes)
+    if status is not None:
+        query = query.filter(Nodes.status == status)
+    if location:
+        query = query.filter(Nodes.location == location)
+    if user_id is not None:
+        query = query.filter(Nodes.user_id == user_id)
+    if name_prefix:
+        query = query.filter(Nodes.node_name.like(f"{escape_like(name_prefix)}%"))
+
+    column, descending = NODE_SORTS[sort]
+    keys = (Nodes.node_id,) if column is Nodes.node_id else (column, Nodes.node_id)
+    if after is not None:
+        value, node_id = after
+        values = (node_id,) if column is Nodes.node_id else (value, node_id)
+        # เปรียบเทียบแบบ row (a, b) > (x, y) ใช้ index (column, node_id) ได้โดยตรง
+        if descending:
+            query = query.filter(tuple_(*keys) < tuple_(*values))
+        else:
+            query = query.filter(tuple_(*keys) > tuple_(*values))
+    return query.order_by(*(key.desc() if descending else key for key in keys))
+
+def stream_nodes(**filters):
+    """JSON ของ nodes ทั้งหมดแบบ streaming (รูปแบบเดียวกับ /node/all) อ่านจาก server-side cursor ทีละ batch"""
+    db = SessionLocal()
+    try:
+        yield '{"status": 1, "message": "ดึงข้อมูล Nodes ทั้งหมดสำเร็จ", "data": {"nodes": ['.encode()
+        total = 0
+        batch = []
+        for node in build_node_query(db, **filters).yield_per(NODE_STREAM_BATCH):
+            batch.append(json.dumps(node_to_dict(node), ensure_ascii=False))
+            if len(batch) >= NODE_STREAM_BATCH:
+                yield (("," if total else "") + ",".join(batch)).encode()
+                total += len(batch)
+                batch = []
+        if batch:
+            yield (("," if total else "") + ",".join(batch)).encode()
+            total += len(batch)
+        yield f'], "total_nodes": {total}}}}}'.encode()
+    finally:
+        db.close()
+
 @node_router.get("/all", summary="ดูข้อมูล Nodes ทั้งหมด")
-async def get_all_nodes(
+def get_all_nodes(
+    status: Optional[int] = None,
+    location: Optional[str] = None,
+    user_id: Optional[int] = None,
+    name_prefix: Optional[str] = None,
+    sort: str = "node_id",
+    cursor: Optional[str] = None,
+    limit: int = NODE_PAGE_SIZE,
+    stream: bool = False,
     db: Session = Depends(get_db)
 ):
-    """ดึงข้อมูล nodes ทั้งหมดในระบบ"""
+    """
+    ดึงข้อมูล nodes ในระบบทีละหน้า
+    - status, location, user_id, name_prefix: ตัวกรอง
+    - sort: node_id, name หรือ updated_at (ล่าสุดก่อน)
+    - cursor: ค่า next_cursor จากหน้าก่อน, limit: จำนวนต่อหน้า (สูงสุด NODE_PAGE_MAX)
+    - stream: true เพื่อดึงทั้งหมดที่ตรงตัวกรองเป็น JSON แบบ streaming (ไม่ใช้ cursor/limit)
+    """
     try:
-        nodes = db.query(Nodes).all()
+        if sort not in NODE_SORTS:
+            raise bad_request(f"sort ต้องเป็น {', '.join(NODE_SORTS)}")
+        filters = {"status": status, "location": location, "user_id": user_id, "name_prefix": name_prefix, "sort": sort}
+
+        if stream:
+            return StreamingResponse(stream_nodes(**filters), media_type="application/json")
+
+        limit = min(max(limit, 1), NODE_PAGE_MAX)
+        after = decode_node_cursor(cursor, sort) if cursor else None
+        total_nodes = build_node_query(db, **filters).order_by(None).count()
+        nodes = build_node_query(db, after=after, **filters).limit(limit + 1).all()
+        next_cursor = encode_node_cursor(sort, nodes[limit - 1]) if len(nodes) > limit else None
+        nodes = nodes[:limit]
 
         if not nodes:
             return {
@@ -218,7 +314,8 @@ async def get_all_nodes(
                 "message": "ไม่พบ Node ในระบบ",
                 "data": {
                     "nodes": [],
-                    "total_nodes": 0
+                    "total_nodes": total_nodes,
+                    "next_cursor": None
                 }
             }
         
@@ -226,19 +323,9 @@ async def get_all_nodes(
             "status": 1,
             "message": "ดึงข้อมูล Nodes ทั้งหมดสำเร็จ",
             "data": {
-                "nodes": [{
-                    "node_id": node.node_id,
-                    "node_name": node.node_name,
-                    "location": node.location,
-                    "description": node.description,
-                    "status": node.status,
-                    "status_text": node.status_text,
-                    "created_at": format_timestamp(node.created_at),
-                    "updated_at": format_timestamp(node.updated_at),
-                    "user_id": node.user_id,
-                    "node_token": node.node_token
-                } for node in nodes],
-                "total_nodes": len(nodes)
+                "nodes": [node_to_dict(node) for node in nodes],
+                "total_nodes": total_nodes,
+                "next_cursor": next_cursor
             }
         }
 
@@ -247,9 +334,9 @@ async def get_all_nodes(
         raise handle_error(e)
 
 @node_router.get("/my-nodes", summary="ดูข้อมูล Node ของตัวเอง")
-async def get_my_nodes(
+def get_my_nodes(
     db: Session = Depends(get_db),
-    current_user: Users = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """User ดึงข้อมูล nodes ทั้งหมดของตัวเอง"""
     try:
@@ -289,9 +376,9 @@ async def get_my_nodes(
         raise handle_error(e)
 
 @node_router.delete("/delete", summary="ลบ Node")
-async def delete_node(
+def delete_node(
     body: NodeDeleteBody,
-    current_user: Users = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """ลบ node ผ่าน request body"""
@@ -313,8 +400,13 @@ async def delete_node(
 
         logger.info(f"Deleting node {body.node_id} by user {current_user.user_id}, reason: {body.reason}")
 
+        node_token = node.node_token
+        node_name = node.node_name
         db.delete(node)
         db.commit()
+        node_registry.remove(node_token)
+        heartbeats.forget(node_name)
+        location_summary.invalidate()
 
         return {
             "status": 1,
@@ -333,9 +425,9 @@ async def delete_node(
         raise handle_error(e)
 
 @node_router.put("/update", summary="อัพเดต Node")
-async def update_node(
+def update_node(
     body: UpdateNodeRequest,
-    current_user: Users = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """อัพเดต node ผ่าน request body"""
@@ -372,6 +464,7 @@ async def update_node(
                     }
                 )
 
+        old_node_name = node.node_name
         update_data = body.dict(exclude_unset=True, exclude={"node_id"})
         for key, value in update_data.items():
             if isinstance(value, str):
@@ -381,6 +474,12 @@ async def update_node(
         node.updated_at = get_thailand_now()
         db.commit()
         db.refresh(node)
+        node_registry.upsert(node)
+        if node.node_name != old_node_name:
+            heartbeats.rename(old_node_name, node.node_name)
+        if "status" in update_data:
+            heartbeats.record_statuses({node.node_id: node.status})
+        location_summary.invalidate()
 
         logger.info(f"Node {body.node_id} updated successfully by user {current_user.user_id}")
 
@@ -405,14 +504,38 @@ async def update_node(
         db.rollback()
         raise handle_error(e)
 
+NODE_ONLINE_WINDOW = timedelta(minutes=5)
+
+def build_last_seen_query(bucket: str, node_names: List[str]) -> str:
+    """Flux query หาเวลาข้อมูลล่าสุดของทุก node ที่ระบุในครั้งเดียว (1 แถวต่อ node)"""
+    node_set = ", ".join(json.dumps(name) for name in node_names)
+    return f'''
+    from(bucket: "{bucket}")
+        |> range(start: -1h)
+        |> filter(fn: (r) => r["_measurement"] == "air_quality")
+        |> filter(fn: (r) => contains(value: r["node_name"], set: [{node_set}]))
+        |> last()
+        |> keep(columns: ["_time", "node_name"])
+        |> group(columns: ["node_name"])
+        |> max(column: "_time")
+    '''
+
+async def fetch_last_seen(node_names: List[str]) -> dict:
+    """คืน {node_name: เวลาข้อมูลล่าสุด} เฉพาะ node ที่มีข้อมูลภายใน 1 ชั่วโมง"""
+    rows = await influx_clients.fetch_rows(build_last_seen_query(influx_clients.bucket, node_names), ("_time", "node_name"))
+    return {row["node_name"]: row["_time"] for row in rows}
+
 @node_router.post("/status/check", summary="เช็คสถานะ Node จาก InfluxDB")
 async def check_node_status(
     db: Session = Depends(get_db),
-    current_user: Users = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
-    """เช็คว่า Node ยังออนไลน์หรือไม่ โดยดูจากข้อมูลล่าสุดใน InfluxDB"""
+    """เช็คว่า Node ยังออนไลน์หรือไม่ โดยดูจากข้อมูลล่าสุดใน InfluxDB (query เดียวสำหรับทุก node)"""
     try:
-        nodes = db.query(Nodes).filter(Nodes.user_id == current_user.user_id).all()
+        # งาน DB เป็นแบบ blocking จึงรันใน threadpool ส่วน InfluxDB ใช้ client แบบ async
+        nodes = await run_in_threadpool(
+            db.query(Nodes).filter(Nodes.user_id == current_user.user_id).all
+        )
         
         if not nodes:
             return {
@@ -421,66 +544,49 @@ async def check_node_status(
                 "data": []
             }
 
+        try:
+            last_seen = await fetch_last_seen([node.node_name for node in nodes])
+        except Exception as influx_error:
+            logger.error(f"Error checking node status: {str(influx_error)}")
+            last_seen = None
+
         result = []
+        changes = {}
+        now = datetime.now(pytz.UTC)
         
-        with get_influx_client() as (influx_client, config):
-            query_api = influx_client.query_api()
+        for node in nodes:
+            if last_seen is None:
+                result.append({
+                    "node_id": node.node_id,
+                    "node_name": node.node_name,
+                    "last_seen": None,
+                    "status": node.status,
+                    "status_text": "Unknown",
+                    "last_data_time": None,
+                    "error": "ไม่สามารถตรวจสอบสถานะได้"
+                })
+                continue
+
+            last_time = last_seen.get(node.node_name)
+            if last_time:
+                heartbeats.touch(node.node_name, last_time)
+            new_status = 1 if last_time and now - last_time < NODE_ONLINE_WINDOW else 0
             
-            for node in nodes:
-                try:
-                    query = f'''
-                    from(bucket: "{config.bucket}")
-                        |> range(start: -1h)
-                        |> filter(fn: (r) => r["_measurement"] == "air_quality")
-                        |> filter(fn: (r) => r["node_name"] == "{node.node_name}")
-                        |> sort(columns: ["_time"], desc: true)
-                        |> limit(n: 1)
-                    '''
-                    
-                    influx_result = query_api.query(org=config.org, query=query)
-                    
-                    last_time = None
-                    for table in influx_result:
-                        for record in table.records:
-                            last_time = record.get_time()
-                            break
-
-                    is_online = False
-                    if last_time:
-                        now = datetime.now(pytz.UTC)
-                        time_diff = now - last_time
-                        is_online = time_diff < timedelta(minutes=5)
-                    
-                    old_status = node.status
-                    new_status = 1 if is_online else 0
-                    
-                    if old_status != new_status:
-                        node.status = new_status
-                        node.updated_at = get_thailand_now()
-                        logger.info(f"Node {node.node_name} status changed from {old_status} to {new_status}")
-                    
-                    result.append({
-                        "node_id": node.node_id,
-                        "node_name": node.node_name,
-                        "last_seen": format_timestamp(last_time) if last_time else None,
-                        "status": new_status,
-                        "status_text": "Online" if new_status == 1 else "Offline",
-                        "last_data_time": format_timestamp(last_time) if last_time else None
-                    })
-                    
-                except Exception as node_error:
-                    logger.error(f"Error checking status for node {node.node_name}: {str(node_error)}")
-                    result.append({
-                        "node_id": node.node_id,
-                        "node_name": node.node_name,
-                        "last_seen": None,
-                        "status": node.status,
-                        "status_text": "Unknown",
-                        "last_data_time": None,
-                        "error": "ไม่สามารถตรวจสอบสถานะได้"
-                    })
-        
-        db.commit()
+            if node.status != new_status:
+                changes[node.node_id] = new_status
+                logger.info(f"Node {node.node_name} status changed from {node.status} to {new_status}")
+            
+            result.append({
+                "node_id": node.node_id,
+                "node_name": node.node_name,
+                "last_seen": format_timestamp(last_time) if last_time else None,
+                "status": new_status,
+                "status_text": "Online" if new_status == 1 else "Offline",
+                "last_data_time": format_timestamp(last_time) if last_time else None
+            })
+    
+        await run_in_threadpool(update_node_statuses, db, changes)
+        heartbeats.record_statuses(changes)
         
         online_count = sum(1 for r in result if r["status"] == 1)
         offline_count = len(result) - online_count
@@ -499,14 +605,14 @@ async def check_node_status(
         }
 
     except Exception as e:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         logger.error(f"Error in check_node_status: {str(e)}")
         raise handle_error(e)
 
 @node_router.get("/status/summary", summary="สรุปสถานะ Node ทั้งหมด")
-async def get_node_status_summary(
+def get_node_status_summary(
     db: Session = Depends(get_db),
-    current_user: Users = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """ดึงสรุปสถานะ Node ทั้งหมดของ user"""
     try:
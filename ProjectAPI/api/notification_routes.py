@@ -5,14 +5,12 @@ from pydantic import BaseModel, EmailStr
 from typing import Optional
 from datetime import datetime
 import logging
-from fastapi.background import BackgroundTasks
-from datetime import datetime, timedelta
-import pytz
 
 from api.models import *
 from api.database import *
-from api.email_service import send_welcome_email, send_daily_aqi_email
+from api.outbox import enqueue_email
 from api.aqi_routes import *
+from api.location_summary import location_summary
 
 
 # Setup logger
@@ -54,94 +52,13 @@ def validate_location(location: str, db: Session):
     node_exists = db.query(Nodes).filter(Nodes.location == location).first()
     return node_exists is not None
 
-def get_avg_data_for_location_at_7am(location: str, db: Session):
-    """ดึงข้อมูลทุกฟิลด์ของ location ตอน 7 โมงเช้า (จาก AirQualitySummary)"""
-    nodes = db.query(Nodes).filter(Nodes.location == location).all()
-    node_names = [n.node_name for n in nodes]
-    if not node_names:
-        return None
-
-    tz = pytz.timezone("Asia/Bangkok")
-    now = datetime.now(tz)
-    seven_am = now.replace(hour=7, minute=0, second=0, microsecond=0)
-    seven_am_utc = seven_am.astimezone(pytz.utc)
-    seven_am_str = seven_am_utc.strftime("%Y-%m-%dT%H:%M:%SZ")
-
-    from api.aqi_routes import query_api, INFLUXDB_ORG, INFLUXDB_BUCKET
-    query = f'''
-        from(bucket: "{INFLUXDB_BUCKET}")
-          |> range(start: {seven_am_str}, stop: {seven_am_str})
-          |> filter(fn: (r) => r["_measurement"] == "AirQualitySummary")
-          |> filter(fn: (r) => r["_field"] == "AQI" or r["_field"] == "PM1" or r["_field"] == "PM2.5" or r["_field"] == "PM4" or r["_field"] == "PM10" or r["_field"] == "Temperature" or r["_field"] == "Humidity")
-          |> filter(fn: (r) => { ' or '.join([f'r["node_name"] == "{name}"' for name in node_names]) })
-          |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-    '''
-    
-    result = query_api.query(org=INFLUXDB_ORG, query=query)
-    
-    data = {}
-    
-    for table in result:
-        for record in table.records:
-            values = record.values
-            for field in ["AQI", "PM1", "PM2.5", "PM4", "PM10", "Temperature", "Humidity"]:
-                if field in values and values[field] is not None:
-                    if field not in data:
-                        data[field] = []
-                    if isinstance(values[field], (int, float)):
-                        if field in ["Temperature", "Humidity"] or values[field] >= 0:
-                            data[field].append(float(values[field]))
-    
-    result_data = {}
-    for field, values in data.items():
-        if values:
-            result_data[field] = round(sum(values) / len(values), 2)
-        else:
-            result_data[field] = None
-    
-    if not any(v is not None for v in result_data.values()):
-        return None
-        
-    return result_data
-
-def send_daily_aqi_email_to_subscribers(db: Session):
-    """ส่งอีเมลแจ้งเตือนข้อมูลคุณภาพอากาศเฉลี่ย 7 โมงเช้าให้ผู้สมัครรับแจ้งเตือนทุก location"""
-    locations = db.query(Notification.location).filter(Notification.is_active == True).distinct().all()
-    for loc in locations:
-        location = loc[0]
-        avg_data = get_avg_data_for_location_at_7am(location, db)
-        if avg_data is None:
-            continue
-        subscribers = db.query(Notification).filter(Notification.location == location, Notification.is_active == True).all()
-        for sub in subscribers:
-            send_daily_aqi_email(sub.email, location, avg_data)
-            
 @notification_router.get("/locations", summary="Get available locations for notifications")
-async def get_available_locations(
+def get_available_locations(
     db: Session = Depends(get_db)
 ):
-    """ดึงรายการ location ที่มี node อยู่สำหรับให้เลือกรับการแจ้งเตือน"""
+    """ดึงรายการ location ที่มี node อยู่สำหรับให้เลือกรับการแจ้งเตือน (สรุปด้วย query เดียวและ cache ไว้)"""
     try:
-        locations = db.query(Nodes.location).distinct().all()
-        
-        result_locations = []
-        for loc in locations:
-            location_name = loc[0]
-            
-            total_nodes = db.query(Nodes).filter(Nodes.location == location_name).count()
-            
-            online_nodes = db.query(Nodes).filter(
-                Nodes.location == location_name,
-                Nodes.status == STATUS_ONLINE
-            ).count()
-            
-            result_locations.append({
-                "location": location_name,
-                "display_name": f"{location_name} ({online_nodes}/{total_nodes} nodes online)",
-                "total_nodes": total_nodes,
-                "online_nodes": online_nodes,
-                "available": online_nodes > 0
-            })
+        result_locations = location_summary.get(db)
         
         if not result_locations:
             return {
@@ -150,8 +67,6 @@ async def get_available_locations(
                 "data": []
             }
         
-        result_locations.sort(key=lambda x: x["location"])
-        
         return {
             "status": 1,
             "message": "ดึงรายการ location สำเร็จ",
@@ -165,9 +80,8 @@ async def get_available_locations(
         raise handle_error(e)
 
 @notification_router.post("/subscribe", summary="Subscribe to email notifications")
-async def subscribe_notification(
+def subscribe_notification(
     request: NotificationRequest,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """สมัครรับการแจ้งเตือนทางอีเมล"""
@@ -228,6 +142,7 @@ async def subscribe_notification(
                 existing_notification.is_active = True
                 existing_notification.location = request.location
                 existing_notification.updated_at = datetime.utcnow()
+                enqueue_email(db, "welcome", request.email, location=request.location)
                 db.commit()
                 db.refresh(existing_notification)
                 is_new_subscription = True
@@ -251,6 +166,7 @@ async def subscribe_notification(
             )
 
             db.add(new_notification)
+            enqueue_email(db, "welcome", request.email, location=request.location)
             db.commit()
             db.refresh(new_notification)
             is_new_subscription = True
@@ -268,7 +184,6 @@ async def subscribe_notification(
             }
 
         if is_new_subscription:
-            background_tasks.add_task(send_welcome_email, request.email, request.location)
             response_data["message"] += " - จะได้รับอีเมลยืนยันภายใน 5 นาที"
 
         return response_data
@@ -278,7 +193,7 @@ async def subscribe_notification(
         raise handle_error(e)
 
 @notification_router.get("/subscribers/{location}", summary="Get subscribers by location")
-async def get_subscribers_by_location(
+def get_subscribers_by_location(
     location: str,
     db: Session = Depends(get_db)
 ):
@@ -0,0 +1,156 @@
+"""
+คิวอีเมลขาออกที่เก็บใน PostgreSQL (ตาราง email_outbox)
+
+route handler เรียก enqueue_email() ก่อน db.commit() ของการเปลี่ยนแปลงที่เกี่ยวข้อง
+อีเมลจึงถูกบันทึกพร้อมกับข้อมูลเสมอ (หรือไม่ถูกบันทึกเลยถ้า rollback) และ request ตอบกลับได้ทันที
+
+dispatcher รันเป็น process แยกจาก API (ดู service outbox ใน docker-compose.yml)
+    python -m api.outbox            # ทำงานต่อเนื่อง
+    python -m api.outbox --once     # ส่งรอบเดียวแล้วจบ
+ดึงงานทีละ batch ด้วย FOR UPDATE SKIP LOCKED จึงรันหลาย process พร้อมกันได้
+ส่งไม่สำเร็จจะลองใหม่แบบ exponential backoff จนครบ OUTBOX_MAX_ATTEMPTS ครั้ง
+"""
+import argparse
+import logging
+import os
+import signal
+import threading
+from datetime import datetime, timedelta
+from email.message import Message
+from typing import Callable, Dict
+
+from sqlalchemy.orm import Session
+
+from api.constants import OUTBOX_PENDING, OUTBOX_SENT, OUTBOX_FAILED
+from api.database import SessionLocal
+from api.email_service import build_verification_message, build_reset_message, build_welcome_message
+from api.mailer import mailer
+from api.models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "30"))
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "3600"))
+
+# ชนิดอีเมล -> ฟังก์ชันสร้างข้อความจาก (recipient, payload)
+EMAIL_BUILDERS: Dict[str, Callable[[str, dict], Message]] = {
+    "verification": lambda recipient, payload: build_verification_message(recipient, payload["token"]),
+    "reset": lambda recipient, payload: build_reset_message(recipient, payload["token"]),
+    "welcome": lambda recipient, payload: build_welcome_message(recipient, payload["location"]),
+}
+
+def enqueue_email(db: Session, kind: str, recipient: str, **payload) -> EmailOutbox:
+    """เพิ่มอีเมลลง outbox ใน transaction ปัจจุบัน (ผู้เรียกเป็นคน commit)"""
+    if kind not in EMAIL_BUILDERS:
+        raise ValueError(f"Unknown email kind: {kind}")
+    entry = EmailOutbox(kind=kind, recipient=recipient, payload=payload)
+    db.add(entry)
+    return entry
+
+def retry_delay(attempts: int) -> timedelta:
+    """ระยะรอก่อนส่งซ้ำครั้งถัดไป (30s, 60s, 120s, ... ไม่เกิน OUTBOX_RETRY_MAX)"""
+    return timedelta(seconds=min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX))
+
+class OutboxDispatcher:
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE, max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.sent = 0
+        self.failed = 0
+
+    def dispatch_batch(self) -> int:
+        """ส่งอีเมลที่ถึงกำหนด 1 batch คืนจำนวนรายการที่ประมวลผล"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            entries = db.query(EmailOutbox).filter(
+                EmailOutbox.status == OUTBOX_PENDING,
+                EmailOutbox.next_attempt_at <= now
+            ).order_by(EmailOutbox.next_attempt_at).limit(self.batch_size).with_for_update(skip_locked=True).all()
+            if not entries:
+                db.rollback()
+                return 0
+
+            futures = []
+            for entry in entries:
+                try:
+                    message = EMAIL_BUILDERS[entry.kind](entry.recipient, entry.payload or {})
+                except Exception as e:
+                    futures.append((entry, None, e))
+                    continue
+                futures.append((entry, mailer.submit(message, entry.recipient, raise_errors=True), None))
+
+            for entry, future, error in futures:
+                if future is not None:
+                    error = future.exception()
+                entry.attempts += 1
+                if error is None:
+                    entry.status = OUTBOX_SENT
+                    entry.sent_at = datetime.utcnow()
+                    entry.last_error = None
+                    self.sent += 1
+                elif entry.attempts >= self.max_attempts:
+                    entry.status = OUTBOX_FAILED
+                    entry.last_error = str(error)
+                    self.failed += 1
+                    logger.error(f"Giving up on {entry.kind} email #{entry.outbox_id} to {entry.recipient}: {str(error)}")
+                else:
+                    entry.next_attempt_at = datetime.utcnow() + retry_delay(entry.attempts)
+                    entry.last_error = str(error)
+                    logger.warning(f"{entry.kind} email #{entry.outbox_id} failed (attempt {entry.attempts}): {str(error)}")
+            db.commit()
+            return len(entries)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def run(self, poll_interval: float = OUTBOX_POLL_INTERVAL, stop_event: threading.Event = None):
+        """ส่งต่อเนื่องจนกว่าจะได้รับสัญญาณหยุด (batch เต็มจะดึงรอบถัดไปทันที)"""
+        stop_event = stop_event or threading.Event()
+        logger.info(f"Outbox dispatcher started (batch={self.batch_size}, poll={poll_interval}s)")
+        while not stop_event.is_set():
+            try:
+                processed = self.dispatch_batch()
+            except Exception as e:
+                logger.error(f"Outbox dispatch failed: {str(e)}")
+                processed = 0
+            if processed < self.batch_size:
+                stop_event.wait(poll_interval)
+        logger.info(f"Outbox dispatcher stopped (sent={self.sent}, failed={self.failed})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver queued e-mail from the email_outbox table")
+    parser.add_argument("--once", action="store_true", help="Process due e-mail once and exit")
+    parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE)
+    parser.add_argument("--poll-interval", type=float, default=OUTBOX_POLL_INTERVAL)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from api.schema import init_db
+    init_db()
+
+    dispatcher = OutboxDispatcher(batch_size=args.batch_size)
+    try:
+        if args.once:
+            total = 0
+            while True:
+                processed = dispatcher.dispatch_batch()
+                total += processed
+                if processed < dispatcher.batch_size:
+                    break
+            print(f"Processed {total} e-mail(s): {dispatcher.sent} sent, {dispatcher.failed} failed")
+        else:
+            stop_event = threading.Event()
+            signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+            signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+            dispatcher.run(args.poll_interval, stop_event)
+    finally:
+        mailer.close()
+
+if __name__ == "__main__":
+    main()
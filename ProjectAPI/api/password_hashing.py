@@ -0,0 +1,153 @@
+"""
+hash/ตรวจรหัสผ่านด้วย bcrypt ใน process pool แยกต่างหาก
+
+bcrypt ใช้ CPU เต็ม 1 core ต่อครั้ง (~100ms+ ที่ cost 12) ถ้าทำใน process ของ API
+การ login พร้อมกันจำนวนมากจะแย่ง CPU/GIL กับ request อื่น (รวมถึงการรับข้อมูลจาก sensor)
+จึงส่งงานไปทำใน process pool ขนาด PASSWORD_HASH_WORKERS และจำกัดงานที่รอได้ไม่เกิน PASSWORD_HASH_QUEUE_SIZE
+(เกินแล้วรอได้ไม่เกิน PASSWORD_HASH_QUEUE_TIMEOUT วินาทีก่อนโยน PasswordHasherBusy)
+hash/verify เป็น coroutine ที่รอผลจาก pool บน event loop จึงไม่กิน thread ของ threadpool ระหว่างรอ
+
+cost ของ bcrypt ตั้งด้วย BCRYPT_ROUNDS ถ้าเปลี่ยนค่า hash เดิมที่ cost ไม่ตรงจะถูก hash ใหม่ตอน login สำเร็จ
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max((os.cpu_count() or 2) // 2, 1))))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "64"))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "10"))
+
+# min = max = default ทำให้ hash ที่ cost ไม่ตรงกับ BCRYPT_ROUNDS (ทั้งต่ำและสูงกว่า) ถูกมองว่าต้อง hash ใหม่
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+
+# ฟังก์ชันที่รันใน worker process (ต้องอยู่ระดับ module เพื่อให้ pickle ได้)
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, hashed)
+
+def _ping() -> int:
+    return os.getpid()
+
+class PasswordHasherBusy(Exception):
+    """คิวงาน hash รหัสผ่านเต็ม"""
+
+class PasswordHasher:
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        queue_size: int = PASSWORD_HASH_QUEUE_SIZE,
+        queue_timeout: float = PASSWORD_HASH_QUEUE_TIMEOUT
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.hashes = 0
+        self.verifies = 0
+        self.rehashes = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+        self.total_seconds = 0.0
+        self._queue_depth = 0
+        self._slots = asyncio.Semaphore(queue_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        """จำนวนงานที่อยู่ใน pool ตอนนี้ (กำลังทำ + รอคิว)"""
+        return self._queue_depth
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # ใช้ spawn เพราะ fork process ที่มี thread อยู่แล้ว (threadpool, client ต่าง ๆ) ไม่ปลอดภัย
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    async def _run(self, fn, *args):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning(f"Password hashing queue full ({self.queue_size} pending)")
+            raise PasswordHasherBusy(f"Password hashing queue full ({self.queue_size} pending)")
+        self._queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._queue_depth)
+        started = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(self._get_executor().submit(fn, *args))
+        finally:
+            self._queue_depth -= 1
+            self.total_seconds += time.perf_counter() - started
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        """hash รหัสผ่านด้วย cost ปัจจุบัน"""
+        hashed = await self._run(_hash, password)
+        self.hashes += 1
+        return hashed
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """ตรวจรหัสผ่าน คืน (ถูกต้องหรือไม่, hash ใหม่ถ้า cost ของ hash เดิมไม่ตรงกับ BCRYPT_ROUNDS)"""
+        valid, new_hash = await self._run(_verify_and_update, password, hashed)
+        self.verifies += 1
+        if new_hash is not None:
+            self.rehashes += 1
+        return valid, new_hash
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return (await self.verify_and_update(password, hashed))[0]
+
+    def start(self):
+        """สร้าง worker process ล่วงหน้า เพื่อไม่ให้ login แรกต้องรอ spawn process"""
+        executor = self._get_executor()
+        pids = {future.result() for future in [executor.submit(_ping) for _ in range(self.workers)]}
+        logger.info(
+            f"Password hasher started (workers={len(pids)}/{self.workers}, "
+            f"queue={self.queue_size}, bcrypt_rounds={BCRYPT_ROUNDS})"
+        )
+
+    def stats(self) -> dict:
+        operations = self.hashes + self.verifies
+        return {
+            "workers": self.workers,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "queue_size": self.queue_size,
+            "queue_depth": self._queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "hashes": self.hashes,
+            "verifies": self.verifies,
+            "rehashes": self.rehashes,
+            "rejected": self.rejected,
+            "avg_ms": round(self.total_seconds / operations * 1000, 1) if operations else 0.0
+        }
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+            logger.info(f"Password hasher stopped ({self.stats()})")
+
+password_hasher = PasswordHasher()
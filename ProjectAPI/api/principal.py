@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from api.constants import ROLE_CHOICES
+from api.models import Users
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+
+@dataclass(frozen=True)
+class Principal:
+    """ข้อมูลผู้ใช้ที่ login อยู่ (ไม่รวมรหัสผ่าน) สำหรับตรวจสิทธิ์โดยไม่ต้อง query ตาราง users ทุก request"""
+    user_id: int
+    username: str
+    email: str
+    first_name: str
+    last_name: str
+    phone: str
+    is_verified: bool
+    role: int
+    token_version: int
+
+    @property
+    def role_text(self) -> str:
+        return ROLE_CHOICES.get(self.role, "Unknown")
+
+    @classmethod
+    def from_user(cls, user: Users) -> "Principal":
+        return cls(
+            user_id=user.user_id,
+            username=user.username,
+            email=user.email,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            phone=user.phone,
+            is_verified=user.is_verified,
+            role=user.role,
+            token_version=user.token_version or 0
+        )
+
+class PrincipalCache:
+    """
+    cache user_id -> Principal อายุสั้น (ttl วินาที)
+    route ที่แก้ข้อมูลผู้ใช้ต้องเรียก invalidate(user_id) หลัง commit
+    ttl เป็นตัวกันกรณีตาราง users ถูกแก้จากนอก process นี้
+    """
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL, max_size: int = PRINCIPAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[int, Tuple[Principal, float]] = {}
+        self._generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, user_id: int) -> Optional[Principal]:
+        """คืน Principal ของ user_id (None ถ้าไม่มีผู้ใช้นี้)"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() < entry[1]:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generations.get(user_id, 0)
+
+        user = db.query(Users).filter(Users.user_id == user_id).first()
+        if user is None:
+            return None
+        return self.put(user, generation)
+
+    def put(self, user: Users, generation: Optional[int] = None) -> Principal:
+        """เก็บ Principal จากแถวที่เพิ่งโหลด (ไม่เก็บถ้ามีการ invalidate ระหว่างโหลด)"""
+        principal = Principal.from_user(user)
+        with self._lock:
+            if generation is None or generation == self._generations.get(principal.user_id, 0):
+                if len(self._entries) >= self.max_size:
+                    self._evict()
+                self._entries[principal.user_id] = (principal, time.monotonic() + self.ttl)
+        return principal
+
+    def _evict(self):
+        now = time.monotonic()
+        expired = [user_id for user_id, (_, expires_at) in self._entries.items() if expires_at <= now]
+        for user_id in expired or list(self._entries)[:max(self.max_size // 10, 1)]:
+            del self._entries[user_id]
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self._entries.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Hashable, Optional
+
+import pytz
+
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "5000"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "60"))
+PERIOD_SETTLE_DELAY = timedelta(hours=float(os.getenv("PERIOD_SETTLE_HOURS", "24")))
+
+def is_period_closed(period_end: datetime) -> bool:
+    """
+    ช่วงเวลาที่สิ้นสุดไปแล้วเกิน PERIOD_SETTLE_DELAY ถือว่าข้อมูลไม่เปลี่ยนแล้ว
+    (เผื่อเวลาให้ task สรุปข้อมูลใน InfluxDB เขียนผลของช่วงนั้นเสร็จ)
+    period_end ที่ไม่มี timezone ถือเป็น UTC
+    """
+    if period_end.tzinfo is None:
+        period_end = pytz.UTC.localize(period_end)
+    return datetime.now(pytz.UTC) >= period_end + PERIOD_SETTLE_DELAY
+
+class PeriodResultCache:
+    """
+    LRU cache ของผลลัพธ์ตามช่วงเวลา
+    ผลของช่วงที่ปิดแล้วเก็บไม่หมดอายุ (ออกด้วย LRU เท่านั้น) ส่วนช่วงปัจจุบันหมดอายุตาม ttl
+    """
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, ttl: float = RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at is not None and time.monotonic() > expires_at:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, immutable: bool = False):
+        expires_at = None if immutable else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+period_cache = PeriodResultCache()
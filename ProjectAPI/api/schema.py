@@ -0,0 +1,186 @@
+"""
+สร้างและตรวจ schema ของ PostgreSQL
+
+index ทั้งหมดประกาศไว้ใน api.models (Index ใน __table_args__ หรือ index=True)
+init_db() (เรียกตอนแอปเริ่ม) สร้างตารางใหม่พร้อม index แต่กับตารางเดิมจะแค่ log index ที่ยังขาด
+เพราะ CREATE INDEX ธรรมดา lock การเขียนของตารางจนสร้างเสร็จ
+index ที่ขาดให้สร้างด้วย `python -m api.schema init` ซึ่งใช้ CREATE INDEX CONCURRENTLY
+
+ตรวจจาก command line ได้
+    python -m api.schema check     # รายงาน index ที่ขาด และ query ที่ยังต้อง Seq Scan
+    python -m api.schema init      # สร้างตาราง/คอลัมน์ที่ยังไม่มี และสร้าง index ที่ขาดแบบ CONCURRENTLY
+"""
+import argparse
+import logging
+import sys
+from typing import Dict, List
+
+from sqlalchemy import func, inspect, or_, select, text
+
+from api.constants import OUTBOX_PENDING
+from api.database import Base, engine
+import api.models  # noqa: F401 - ลงทะเบียนตารางทั้งหมดกับ Base.metadata
+from api.models import EmailOutbox, NodeDataMonth, Nodes, Notification, Token, Users, USER_SEARCH_TEXT
+
+logger = logging.getLogger(__name__)
+
+# extension ที่ index บางตัวต้องใช้ (ถ้าสร้างไม่ได้ เช่นไม่มีสิทธิ์ จะข้าม index นั้นไป)
+EXTENSIONS = ["pg_trgm"]
+
+# คอลัมน์ที่เพิ่มให้ตารางเดิมภายหลัง (create_all ไม่แก้ตารางที่มีอยู่แล้ว)
+# (query ที่คืน true เมื่อยังต้อง migrate, คำสั่ง) ตรวจก่อนทุกครั้ง เพื่อไม่ให้ ALTER ล็อกตารางทุกครั้งที่เริ่มแอป
+COLUMN_MIGRATIONS = [
+    (
+        "SELECT NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema() "
+        "AND table_name = 'users' AND column_name = 'token_version')",
+        ["ALTER TABLE users ADD COLUMN IF NOT EXISTS token_version INTEGER NOT NULL DEFAULT 0"],
+    ),
+    (
+        # แถวเดิมที่ updated_at ว่างใช้เวลาที่สร้างแทน แล้วห้าม NULL (cursor ของ /node/all เรียงตามคอลัมน์นี้)
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema() "
+        "AND table_name = 'nodes' AND column_name = 'updated_at' AND is_nullable = 'YES')",
+        [
+            "UPDATE nodes SET updated_at = COALESCE(created_at, now()) WHERE updated_at IS NULL",
+            "ALTER TABLE nodes ALTER COLUMN updated_at SET NOT NULL",
+        ],
+    ),
+]
+
+# query ที่ใช้บ่อยในแอป (ค่าตัวอย่างเป็นค่าคงที่) ใช้ตรวจว่ามี index รองรับหรือไม่
+HOT_QUERIES = {
+    "login": select(Users).where(or_(Users.username == "user", Users.email == "user")),
+    "user_by_email": select(Users).where(Users.email == "user@example.com"),
+    "user_search": select(Users).where(USER_SEARCH_TEXT.ilike("%user%")).order_by(Users.user_id).limit(10),
+    "verification_token": select(Token).where(Token.verification_token == "token"),
+    "tokens_by_user": select(Token).where(Token.user_id == 1),
+    "node_by_name": select(Nodes).where(Nodes.node_name == "node"),
+    "node_by_token": select(Nodes).where(Nodes.node_token == "token"),
+    "node_access": select(Nodes).where(Nodes.node_name == "node", Nodes.user_id == 1),
+    "nodes_by_owner": select(Nodes).where(Nodes.user_id == 1),
+    "nodes_by_location": select(Nodes).where(Nodes.location == "location", Nodes.status == 1),
+    "nodes_by_updated_at": select(Nodes).order_by(Nodes.updated_at.desc(), Nodes.node_id.desc()).limit(100),
+    "subscribers_by_location": select(Notification).where(
+        Notification.location == "location", Notification.is_active == True
+    ),
+    "subscription_by_email": select(Notification).where(Notification.email == "user@example.com"),
+    "node_months": select(NodeDataMonth.month).where(NodeDataMonth.node_name == "node"),
+    "outbox_due": select(EmailOutbox).where(
+        EmailOutbox.status == OUTBOX_PENDING, EmailOutbox.next_attempt_at <= func.now()
+    ).order_by(EmailOutbox.next_attempt_at).limit(50),
+}
+
+def create_extensions():
+    for name in EXTENSIONS:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"CREATE EXTENSION IF NOT EXISTS {name}"))
+        except Exception as e:
+            logger.warning(f"Could not create extension {name}: {str(e)}")
+
+def create_missing_indexes():
+    """
+    สร้าง index ที่ประกาศใน models แต่ยังไม่มีในตารางที่สร้างไว้ก่อนแล้ว ด้วย CREATE INDEX CONCURRENTLY
+    (ตารางยังอ่าน/เขียนได้ระหว่างสร้าง) ซึ่งรันใน transaction ไม่ได้ จึงใช้ connection แบบ AUTOCOMMIT ทีละ index
+    """
+    missing = find_missing_indexes()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in missing.get(table.name, ()):
+                    continue
+                options = index.dialect_options["postgresql"]
+                options["concurrently"] = True
+                try:
+                    logger.info(f"Creating index {index.name} on {table.name} (concurrently)")
+                    index.create(conn, checkfirst=True)
+                except Exception as e:
+                    # CONCURRENTLY ที่ล้มเหลวทิ้ง index สถานะ INVALID ไว้ ต้องลบก่อนลองใหม่
+                    logger.warning(f"Could not create index {index.name}: {str(e)}")
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+                finally:
+                    options["concurrently"] = False
+
+def find_missing_indexes() -> Dict[str, List[str]]:
+    """{ชื่อตาราง: [ชื่อ index ที่ประกาศใน models แต่ไม่มีในฐานข้อมูล]} (ตารางที่ยังไม่ถูกสร้างนับทุก index)"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    missing = {}
+    for table in Base.metadata.sorted_tables:
+        declared = {index.name for index in table.indexes}
+        if table.name in existing_tables:
+            declared -= {index["name"] for index in inspector.get_indexes(table.name)}
+        if declared:
+            missing[table.name] = sorted(declared)
+    return missing
+
+def _seq_scans(plan: dict) -> List[str]:
+    found = [plan["Relation Name"]] if plan.get("Node Type") == "Seq Scan" else []
+    for child in plan.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+def find_seq_scans() -> Dict[str, List[str]]:
+    """
+    {ชื่อ query: [ตารางที่ยังต้อง Seq Scan]} ของ HOT_QUERIES
+    ปิด enable_seqscan ระหว่าง EXPLAIN ผลจึงไม่ขึ้นกับขนาดตาราง (ตารางเล็ก planner มักเลือก Seq Scan อยู่แล้ว)
+    ถ้ายังเป็น Seq Scan แปลว่าไม่มี index ที่ใช้กับ query นั้นได้เลย
+    """
+    results = {}
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(text("SET LOCAL enable_seqscan = off"))
+            for name, statement in HOT_QUERIES.items():
+                sql = statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+                plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+                tables = _seq_scans(plan[0]["Plan"])
+                if tables:
+                    results[name] = tables
+    return results
+
+def init_db():
+    """สร้าง extension, ตาราง และคอลัมน์ใน COLUMN_MIGRATIONS (เฉพาะที่ยังไม่ได้ทำ) แล้ว log index ที่ยังขาด (ไม่สร้าง index ให้ตารางเดิม)"""
+    create_extensions()
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for check, statements in COLUMN_MIGRATIONS:
+            if not conn.execute(text(check)).scalar():
+                continue
+            for statement in statements:
+                logger.info(f"Migrating: {statement}")
+                conn.execute(text(statement))
+    for table, indexes in find_missing_indexes().items():
+        logger.warning(f"Missing indexes on {table}: {', '.join(indexes)} (run: python -m api.schema init)")
+    logger.info("Database schema initialized")
+
+def check() -> bool:
+    """พิมพ์รายงาน index ที่ขาดและ query ที่ Seq Scan คืน True ถ้าไม่พบปัญหา"""
+    missing = find_missing_indexes()
+    for table, indexes in missing.items():
+        print(f"MISSING  {table}: {', '.join(indexes)}")
+    if not missing:
+        print("All declared indexes exist")
+
+    scans = find_seq_scans()
+    for name, tables in scans.items():
+        print(f"SEQSCAN  {name}: {', '.join(tables)}")
+    if not scans:
+        print(f"All {len(HOT_QUERIES)} hot queries can use an index")
+
+    return not missing and not scans
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or verify the PostgreSQL schema")
+    parser.add_argument("command", choices=["check", "init"], nargs="?", default="check")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "init":
+        init_db()
+        create_missing_indexes()
+        for table, indexes in find_missing_indexes().items():
+            print(f"MISSING  {table}: {', '.join(indexes)}")
+    elif not check():
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
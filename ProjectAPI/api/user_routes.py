@@ -1,12 +1,12 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, Response, Header, Request
+from fastapi import APIRouter, HTTPException, Depends, Response, Header, Request
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, String
+from sqlalchemy import or_
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime, timedelta
 import uuid
-from passlib.context import CryptContext
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from jose import JWTError, jwt
 import os
 import logging
@@ -14,18 +14,19 @@ import logging
 # from models import *
 # from database import *
 # from constants import *
-# from email_service import send_verification_email, send_reset_email
 
 from api.models import *
 from api.database import *
 from api.constants import *
-from api.email_service import send_verification_email, send_reset_email
+from api.outbox import enqueue_email
+from api.password_hashing import password_hasher, PasswordHasherBusy
+from api.principal import Principal, principal_cache
+from api.user_search import COUNT_MODES, build_user_query, count_users, fetch_page
 
 # Setup logger
 logger = logging.getLogger(__name__)
 
 user_router = APIRouter(tags=["User"])
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 ALGORITHM = os.getenv("JWT_ALGORITHM")
@@ -86,17 +87,57 @@ def not_found_error(message: str = "ไม่พบข้อมูลที่
 def unauthorized_error(message: str = "ไม่มีสิทธิ์เข้าถึง"):
     return CustomHTTPException(status_code=403, message=message)
 
+# route ที่ hash/ตรวจรหัสผ่านเป็น async def: รอ bcrypt บน event loop และส่งงาน DB เข้า threadpool ทีละช่วง
+# thread ของ threadpool จึงไม่ถูกจองไว้ระหว่างรอ process pool
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise CustomHTTPException(status_code=503, message="ระบบกำลังประมวลผลคำขอจำนวนมาก กรุณาลองใหม่อีกครั้ง")
+
+async def verify_password(password: str, hashed: str):
+    """ตรวจรหัสผ่าน คืน (ถูกต้องหรือไม่, hash ใหม่ถ้าต้อง hash ใหม่ตาม BCRYPT_ROUNDS)"""
+    try:
+        return await password_hasher.verify_and_update(password, hashed)
+    except PasswordHasherBusy:
+        raise CustomHTTPException(status_code=503, message="ระบบกำลังประมวลผลคำขอจำนวนมาก กรุณาลองใหม่อีกครั้ง")
+
 def create_jwt_token(data: dict, expires_delta: timedelta = timedelta(minutes=15)):
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
     to_encode.update({"exp": expire, "sub": str(data["user_id"])})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(
-    request: Request,
-    authorization: Optional[str] = Header(None),
-    db: Session = Depends(get_db)
-):
+def token_claims(user: Users) -> dict:
+    """claim ของ access/refresh token (ver = token_version ของผู้ใช้ ใช้ยกเลิก token เก่าทั้งหมด)"""
+    return {
+        "user_id": user.user_id,
+        "username": user.username,
+        "role": user.role,
+        "ver": user.token_version or 0
+    }
+
+def set_auth_cookies(response: Response, access_token: str, refresh_token: Optional[str] = None):
+    response.set_cookie(
+        key="access_token",
+        value=access_token,
+        httponly=True,
+        secure=True,
+        samesite="lax",
+        max_age=7 * 24 * 60 * 60 
+    )
+    if refresh_token is not None:
+        response.set_cookie(
+            key="refresh_token",
+            value=refresh_token,
+            httponly=True,
+            secure=True,
+            samesite="lax",
+            max_age=14 * 24 * 60 * 60 
+        )
+
+def decode_access_token(request: Request, authorization: Optional[str]) -> dict:
+    """อ่าน token จาก header Authorization หรือ cookie แล้วถอดรหัส คืน payload"""
     token = None
 
     if authorization and authorization.startswith("Bearer "):
@@ -109,28 +150,105 @@ async def get_current_user(
 
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-
-        user = db.query(Users).filter(Users.user_id == int(user_id)).first()
-        if not user:
-            raise CustomHTTPException(401, "ไม่พบผู้ใช้")
+        return {**payload, "sub": int(payload.get("sub")), "ver": payload.get("ver", 0)}
+    except (JWTError, TypeError, ValueError):
+        raise CustomHTTPException(401, "Token หมดอายุหรือไม่ถูกต้อง")
 
-        return user
+def check_token_version(payload: dict, token_version: int):
+    if payload["ver"] != (token_version or 0):
+        raise CustomHTTPException(401, "Token ถูกยกเลิกแล้ว กรุณาเข้าสู่ระบบใหม่")
 
-    except JWTError:
-        raise CustomHTTPException(401, "Token หมดอายุหรือไม่ถูกต้อง")
+def get_current_principal(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+) -> Principal:
+    """ผู้ใช้ที่ login อยู่จาก cache (ไม่ query ตาราง users ถ้ายังอยู่ใน cache) สำหรับ route ที่ไม่แก้ข้อมูลผู้ใช้"""
+    payload = decode_access_token(request, authorization)
+    principal = principal_cache.get(db, payload["sub"])
+    if not principal:
+        raise CustomHTTPException(401, "ไม่พบผู้ใช้")
+    check_token_version(payload, principal.token_version)
+    return principal
+
+def get_current_user(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+) -> Users:
+    """ผู้ใช้ที่ login อยู่เป็น object ของ session ปัจจุบัน สำหรับ route ที่แก้ข้อมูลผู้ใช้"""
+    payload = decode_access_token(request, authorization)
+    user = db.query(Users).filter(Users.user_id == payload["sub"]).first()
+    if not user:
+        raise CustomHTTPException(401, "ไม่พบผู้ใช้")
+    check_token_version(payload, user.token_version)
+    return user
 
 def check_admin_permission(user: Users):
     """ตรวจสอบสิทธิ์ Admin"""
     if user.role != ROLE_ADMIN:
         raise unauthorized_error("จำเป็นต้องมีสิทธิ์ Admin")
 
+def find_user_by_login(db: Session, username_or_email: str) -> Optional[Users]:
+    return db.query(Users).filter(
+        (Users.username == username_or_email) |
+        (Users.email == username_or_email)
+    ).first()
+
+def save_new_user(db: Session, request: RegisterRequest, hashed_password: str) -> Users:
+    """บันทึกผู้ใช้ใหม่พร้อม token ยืนยันอีเมล และเข้าคิวอีเมลยืนยัน"""
+    verification_token = str(uuid.uuid4())
+    token_expiry = datetime.utcnow() + timedelta(minutes=30)
+
+    new_user = Users(
+        first_name=request.first_name,
+        last_name=request.last_name,
+        username=request.username,
+        email=request.email,
+        phone=request.phone,
+        password=hashed_password,
+        is_verified=False,
+        role=ROLE_NODE_OWNER
+    )
+
+    # flush เพื่อให้ได้ user_id แล้ว commit ครั้งเดียว (ผู้ใช้ token และอีเมลในคิวสำเร็จหรือไม่สำเร็จพร้อมกัน)
+    db.add(new_user)
+    db.flush()
+
+    new_token = Token(
+        user_id=new_user.user_id,
+        verification_token=verification_token,
+        token_expiry=token_expiry
+    )
+
+    db.add(new_token)
+    enqueue_email(db, "verification", request.email, token=verification_token)
+    db.commit()
+    db.refresh(new_user)
+    return new_user
+
+def save_password(db: Session, user: Users, hashed_password: str, revoke_tokens: bool = True, token: Optional[Token] = None):
+    """
+    บันทึก hash รหัสผ่านใหม่ (revoke_tokens=True จะยกเลิก token เดิมทุกเครื่องด้วย)
+    token = token รีเซ็ตรหัสผ่านที่ใช้แล้ว ลบใน transaction เดียวกัน
+    """
+    user.password = hashed_password
+    if revoke_tokens:
+        user.token_version = (user.token_version or 0) + 1
+    if token is not None:
+        db.delete(token)
+    db.commit()
+    db.refresh(user)
+    principal_cache.invalidate(user.user_id)
+
 @user_router.post("/register")
-async def register(request: RegisterRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def register(request: RegisterRequest, db: Session = Depends(get_db)):
     try:
-        existing_user = db.query(Users).filter(
-            or_(Users.username == request.username, Users.email == request.email)
-        ).first()
+        existing_user = await run_in_threadpool(
+            lambda: db.query(Users).filter(
+                or_(Users.username == request.username, Users.email == request.email)
+            ).first()
+        )
 
         if existing_user:
             if existing_user.username == request.username:
@@ -138,35 +256,8 @@ async def register(request: RegisterRequest, background_tasks: BackgroundTasks,
             else:
                 raise CustomHTTPException(status_code=400, message="อีเมลนี้ถูกใช้แล้ว")
 
-        hashed_password = pwd_context.hash(request.password)
-        verification_token = str(uuid.uuid4())
-        token_expiry = datetime.utcnow() + timedelta(minutes=30)
-
-        new_user = Users(
-            first_name=request.first_name,
-            last_name=request.last_name,
-            username=request.username,
-            email=request.email,
-            phone=request.phone,
-            password=hashed_password,
-            is_verified=False,
-            role=ROLE_NODE_OWNER
-        )
-
-        db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
-
-        new_token = Token(
-            user_id=new_user.user_id,
-            verification_token=verification_token,
-            token_expiry=token_expiry
-        )
-
-        db.add(new_token)
-        db.commit()
-
-        background_tasks.add_task(send_verification_email, request.email, verification_token)
+        hashed_password = await hash_password(request.password)
+        new_user = await run_in_threadpool(save_new_user, db, request, hashed_password)
 
         return {
             "status": 1,
@@ -180,30 +271,31 @@ async def register(request: RegisterRequest, background_tasks: BackgroundTasks,
         }
 
     except CustomHTTPException:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         raise
     except Exception as e:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         raise CustomHTTPException(status_code=500, message=f"เกิดข้อผิดพลาด: {str(e)}")
 
 @user_router.post("/login")
 async def login(request: LoginRequest, response: Response, db: Session = Depends(get_db)):
-    user = db.query(Users).filter(
-        (Users.username == request.username_or_email) |
-        (Users.email == request.username_or_email)
-    ).first()
+    user = await run_in_threadpool(find_user_by_login, db, request.username_or_email)
 
-    if not user or not pwd_context.verify(request.password, user.password):
+    if not user:
         raise CustomHTTPException(401, "ชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง")
 
+    valid, new_hash = await verify_password(request.password, user.password)
+    if not valid:
+        raise CustomHTTPException(401, "ชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง")
+
+    if new_hash is not None:
+        # cost ของ hash เดิมไม่ตรงกับ BCRYPT_ROUNDS ปัจจุบัน (token เดิมยังใช้ได้)
+        await run_in_threadpool(save_password, db, user, new_hash, False)
+
     if not user.is_verified:
         raise CustomHTTPException(403, "กรุณายืนยันอีเมลก่อนเข้าสู่ระบบ")
 
-    token_data = {
-        "user_id": user.user_id,
-        "username": user.username,
-        "role": user.role
-    }
+    token_data = token_claims(user)
 
     access_token = create_jwt_token(token_data, timedelta(days=7))
     refresh_token = create_jwt_token(token_data, timedelta(days=14)) 
@@ -218,23 +310,7 @@ async def login(request: LoginRequest, response: Response, db: Session = Depends
         },
         "authorization": access_token
     })
-
-    response.set_cookie(
-        key="access_token",
-        value=access_token,
-        httponly=True,
-        secure=True,
-        samesite="lax",
-        max_age=7 * 24 * 60 * 60 
-    )
-    response.set_cookie(
-        key="refresh_token",
-        value=refresh_token,
-        httponly=True,
-        secure=True,
-        samesite="lax",
-        max_age=14 * 24 * 60 * 60 
-    )
+    set_auth_cookies(response, access_token, refresh_token)
 
     return response
     
@@ -248,7 +324,7 @@ async def logout(response: Response):
     )
 
 @user_router.post("/refresh")
-async def refresh_token(request: Request, response: Response, db: Session = Depends(get_db)):
+def refresh_token(request: Request, response: Response, db: Session = Depends(get_db)):
     refresh_token = request.cookies.get("refresh_token")
     if not refresh_token:
         raise CustomHTTPException(401, "ไม่ได้รับ refresh token")
@@ -263,32 +339,21 @@ async def refresh_token(request: Request, response: Response, db: Session = Depe
         user = db.query(Users).filter(Users.user_id == int(user_id)).first()
         if not user:
             raise CustomHTTPException(401, "ไม่พบผู้ใช้")
+        if payload.get("ver", 0) != (user.token_version or 0):
+            raise CustomHTTPException(401, "Token ถูกยกเลิกแล้ว กรุณาเข้าสู่ระบบใหม่")
 
-        token_data = {
-            "user_id": user.user_id,
-            "username": user.username,
-            "role": user.role
-        }
-        new_access_token = create_jwt_token(token_data, timedelta(days=7))
+        new_access_token = create_jwt_token(token_claims(user), timedelta(days=7))
 
         response = JSONResponse({"status": 1, "message": "refresh สำเร็จ"})
-        response.set_cookie(
-            key="access_token",
-            value=new_access_token,
-            httponly=True,
-            secure=True,
-            samesite="lax",
-            max_age=7 * 24 * 60 * 60 
-        )
+        set_auth_cookies(response, new_access_token)
         return response
 
     except JWTError:
         raise CustomHTTPException(401, "Refresh token หมดอายุหรือไม่ถูกต้อง")
 
 @user_router.post("/forgot-password")
-async def forgot_password(
+def forgot_password(
     request: ForgotPasswordRequest, 
-    background_tasks: BackgroundTasks, 
     db: Session = Depends(get_db)
 ):
     try:
@@ -309,10 +374,9 @@ async def forgot_password(
         )
 
         db.add(new_token)
+        enqueue_email(db, "reset", user.email, token=token)
         db.commit()
 
-        background_tasks.add_task(send_reset_email, user.email, token)
-
         return {
             "status": 1,
             "message": "ส่งลิงก์รีเซ็ตรหัสผ่านไปยังอีเมลของท่านแล้ว",
@@ -327,24 +391,25 @@ async def forgot_password(
 @user_router.post("/reset-password")
 async def reset_password(data: ResetPasswordRequest, db: Session = Depends(get_db)):
     try:
-        token_data = db.query(Token).filter(
-            Token.verification_token == data.token,
-            Token.token_expiry > datetime.utcnow()
-        ).first()
+        token_data = await run_in_threadpool(
+            lambda: db.query(Token).filter(
+                Token.verification_token == data.token,
+                Token.token_expiry > datetime.utcnow()
+            ).first()
+        )
 
         if not token_data:
             raise CustomHTTPException(status_code=400, message="ลิงก์หมดอายุหรือไม่ถูกต้อง")
 
-        user = db.query(Users).filter(Users.user_id == token_data.user_id).first()
+        user = await run_in_threadpool(
+            lambda: db.query(Users).filter(Users.user_id == token_data.user_id).first()
+        )
 
         if not user:
             raise CustomHTTPException(status_code=400, message="ไม่พบข้อมูลผู้ใช้")
 
-        hashed_password = pwd_context.hash(data.new_password)
-        user.password = hashed_password
-
-        db.delete(token_data)
-        db.commit()
+        hashed_password = await hash_password(data.new_password)
+        await run_in_threadpool(save_password, db, user, hashed_password, True, token_data)
 
         return {
             "status": 1,
@@ -354,11 +419,11 @@ async def reset_password(data: ResetPasswordRequest, db: Session = Depends(get_d
     except CustomHTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         raise CustomHTTPException(status_code=500, message=f"เกิดข้อผิดพลาด: {str(e)}")
 
 @user_router.post("/verify-email")
-async def verify_email(token: str, db: Session = Depends(get_db)):
+def verify_email(token: str, db: Session = Depends(get_db)):
     try:
         token_data = db.query(Token).filter(
             Token.verification_token == token,
@@ -377,6 +442,7 @@ async def verify_email(token: str, db: Session = Depends(get_db)):
         
         db.delete(token_data)
         db.commit()
+        principal_cache.invalidate(user.user_id)
 
         return {
             "status": 1,
@@ -390,39 +456,34 @@ async def verify_email(token: str, db: Session = Depends(get_db)):
         raise CustomHTTPException(status_code=500, message=f"เกิดข้อผิดพลาด: {str(e)}")
 
 @user_router.get("/users")
-async def get_users(
+def get_users(
     page: int = 1, 
     per_page: int = 10, 
     search: str = None,
-    current_user: Users = Depends(get_current_user),
+    cursor: Optional[int] = None,
+    count: str = "exact",
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
+    """
+    รายชื่อผู้ใช้ (Admin) เรียงตาม user_id
+    - cursor: user_id สุดท้ายของหน้าก่อน (ค่า nextCursor) ใช้แทน page เพื่อแบ่งหน้าแบบ keyset
+    - count: exact (นับจริง), estimated (ประมาณจาก statistics ของ PostgreSQL) หรือ none (ไม่นับ)
+    """
     try:
         check_admin_permission(current_user)
 
-        offset = (page - 1) * per_page
-        
-        query = db.query(Users)
-        
-        if search and search.strip():
-            search_term = f"%{search.strip()}%"
-            query = query.filter(
-                or_(
-                    Users.user_id.cast(String).ilike(search_term),
-                    Users.username.ilike(search_term),
-                    Users.email.ilike(search_term),
-                    Users.first_name.ilike(search_term),
-                    Users.last_name.ilike(search_term),
-                    Users.phone.ilike(search_term)
-                )
-            )
-        
+        if count not in COUNT_MODES:
+            raise CustomHTTPException(status_code=400, message=f"count ต้องเป็น {', '.join(COUNT_MODES)}")
+        page = max(page, 1)
+        per_page = max(per_page, 1)
 
-        total_users = query.count()
-        total_pages = (total_users + per_page - 1) // per_page
-        
+        query = build_user_query(db, search)
+
+        total_users = count_users(db, query, count)
+        total_pages = (total_users + per_page - 1) // per_page if total_users is not None else None
 
-        users = query.offset(offset).limit(per_page).all()
+        users, next_cursor = fetch_page(query, per_page, cursor=cursor, offset=(page - 1) * per_page)
 
         serialized_users = [{
             "user_id": str(user.user_id),
@@ -443,8 +504,9 @@ async def get_users(
             "data": serialized_users,
             "total": total_users,
             "totalPages": total_pages,
-            "currentPage": page,
-            "perPage": per_page
+            "currentPage": page if cursor is None else None,
+            "perPage": per_page,
+            "nextCursor": next_cursor
         }
     except HTTPException as he:
         raise he
@@ -452,9 +514,9 @@ async def get_users(
         raise CustomHTTPException(status_code=500, message=f"เกิดข้อผิดพลาด: {str(e)}")
 
 @user_router.delete("/delete_users")
-async def delete_user(
+def delete_user(
     user_id: int,
-    current_user: Users = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     try:
@@ -490,6 +552,7 @@ async def delete_user(
             db.delete(target_user)
             
             db.commit()
+            principal_cache.invalidate(user_id)
             
             logger.info(f"Successfully deleted user {user_id}")
             
@@ -524,9 +587,8 @@ async def delete_user(
         )
 
 @user_router.post("/resend-verification")
-async def resend_verification_email(
+def resend_verification_email(
     email: str,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     try:
@@ -549,10 +611,9 @@ async def resend_verification_email(
         )
 
         db.add(new_token)
+        enqueue_email(db, "verification", user.email, token=verification_token)
         db.commit()
 
-        background_tasks.add_task(send_verification_email, user.email, verification_token)
-
         return {
             "status": 1,
             "message": "ส่งอีเมลยืนยันไปยังอีเมลของท่านแล้ว",
@@ -565,7 +626,7 @@ async def resend_verification_email(
         raise CustomHTTPException(status_code=500, message=f"เกิดข้อผิดพลาด: {str(e)}")
 
 @user_router.patch("/update-user")
-async def update_user(
+def update_user(
     body: UpdateUserRequest,
     current_user: Users = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -632,6 +693,7 @@ async def update_user(
             }
 
         db.commit()
+        principal_cache.invalidate(target_user.user_id)
         db.refresh(target_user)
 
         return {
@@ -656,9 +718,21 @@ async def update_user(
         db.rollback()
         raise CustomHTTPException(status_code=500, message=f"เกิดข้อผิดพลาด: {str(e)}")
 
+@user_router.get("/password-hashing/stats")
+def get_password_hashing_stats(
+    current_user: Principal = Depends(get_current_principal)
+):
+    """สถิติของ process pool ที่ hash รหัสผ่าน (queue_depth = งานที่กำลังทำ + รอคิว) สำหรับ Admin"""
+    check_admin_permission(current_user)
+    return {
+        "status": 1,
+        "message": "ดึงสถิติการ hash รหัสผ่านสำเร็จ",
+        "data": password_hasher.stats()
+    }
+
 @user_router.get("/profile")
-async def get_profile(
-    current_user: Users = Depends(get_current_user)
+def get_profile(
+    current_user: Principal = Depends(get_current_principal)
 ):
     try:
         return {
@@ -681,7 +755,7 @@ async def get_profile(
         raise CustomHTTPException(status_code=500, message=f"เกิดข้อผิดพลาด: {str(e)}")
 
 @user_router.patch("/update-profile")
-async def update_profile(
+def update_profile(
     body: UpdateProfileRequest,
     current_user: Users = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -725,6 +799,7 @@ async def update_profile(
             }
 
         db.commit()
+        principal_cache.invalidate(current_user.user_id)
         db.refresh(current_user)
 
         return {
@@ -753,11 +828,12 @@ async def update_profile(
 @user_router.post("/change-password")
 async def change_password(
     body: ChangePasswordRequest,
+    response: Response,
     current_user: Users = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     try:
-        if not pwd_context.verify(body.current_password, current_user.password):
+        if not (await verify_password(body.current_password, current_user.password))[0]:
             raise CustomHTTPException(status_code=400, message="รหัสผ่านปัจจุบันไม่ถูกต้อง")
         
         if len(body.new_password) < 6:
@@ -766,20 +842,24 @@ async def change_password(
         if body.current_password == body.new_password:
             raise CustomHTTPException(status_code=400, message="รหัสผ่านใหม่ต้องแตกต่างจากรหัสผ่านปัจจุบัน")
         
-        hashed_password = pwd_context.hash(body.new_password)
-        current_user.password = hashed_password
-        
-        db.commit()
+        hashed_password = await hash_password(body.new_password)
+        # ยกเลิก token เดิมทุกเครื่อง แล้วออก token ใหม่ให้เครื่องที่เปลี่ยนรหัสผ่าน
+        await run_in_threadpool(save_password, db, current_user, hashed_password)
+
+        token_data = token_claims(current_user)
+        access_token = create_jwt_token(token_data, timedelta(days=7))
+        set_auth_cookies(response, access_token, create_jwt_token(token_data, timedelta(days=14)))
         
         return {
             "status": 1,
             "message": "เปลี่ยนรหัสผ่านสำเร็จ",
-            "data": {}
+            "data": {},
+            "authorization": access_token
         }
         
     except CustomHTTPException:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         raise
     except Exception as e:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         raise CustomHTTPException(status_code=500, message=f"เกิดข้อผิดพลาด: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""
+ค้นหาผู้ใช้สำหรับหน้า Admin (/auth/users)
+
+- คำค้นเทียบกับ USER_SEARCH_TEXT (username, email, ชื่อ, นามสกุล, เบอร์โทร) ด้วย ILIKE
+  ซึ่งใช้ index trigram ix_users_search_trgm ได้ จึงไม่ต้อง scan ทั้งตาราง
+- คำค้นที่เป็นตัวเลขล้วนจะค้นด้วย user_id ตรงตัวด้วย
+- แบ่งหน้าแบบ keyset (user_id > cursor) ความเร็วจึงเท่ากันทุกหน้า
+- จำนวนทั้งหมดเลือกได้ว่านับจริง (exact), ประมาณจาก statistics ของ PostgreSQL (estimated) หรือไม่นับ (none)
+"""
+import json
+from typing import List, Optional, Tuple
+
+from sqlalchemy import or_, text
+from sqlalchemy.orm import Query, Session
+
+from api.models import Users, USER_SEARCH_TEXT
+
+COUNT_MODES = ("exact", "estimated", "none")
+
+def escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def build_user_query(db: Session, search: Optional[str]) -> Query:
+    query = db.query(Users)
+    term = (search or "").strip()
+    if term:
+        # backslash เป็น escape character ของ LIKE ใน PostgreSQL อยู่แล้ว
+        condition = USER_SEARCH_TEXT.ilike(f"%{escape_like(term)}%")
+        if term.isdigit() and len(term) <= 9:
+            condition = or_(condition, Users.user_id == int(term))
+        query = query.filter(condition)
+    return query
+
+def estimate_count(db: Session, query: Query) -> int:
+    """จำนวนแถวโดยประมาณจากแผนของ PostgreSQL (ไม่ต้องนับจริง)"""
+    if query.whereclause is None:
+        estimate = db.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'users'::regclass")).scalar()
+        # reltuples เป็น -1 ถ้าตารางยังไม่เคยถูก ANALYZE
+        if estimate is not None and estimate >= 0:
+            return int(estimate)
+        return query.order_by(None).count()
+
+    compiled = query.statement.compile(dialect=db.get_bind().dialect)
+    plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def count_users(db: Session, query: Query, mode: str) -> Optional[int]:
+    if mode == "none":
+        return None
+    if mode == "estimated":
+        return estimate_count(db, query)
+    return query.order_by(None).count()
+
+def fetch_page(query: Query, per_page: int, cursor: Optional[int] = None, offset: int = 0) -> Tuple[List[Users], Optional[int]]:
+    """ดึงผู้ใช้ 1 หน้าเรียงตาม user_id คืน (ผู้ใช้, cursor ของหน้าถัดไปหรือ None ถ้าเป็นหน้าสุดท้าย)"""
+    query = query.order_by(Users.user_id)
+    if cursor is not None:
+        query = query.filter(Users.user_id > cursor)
+    elif offset:
+        query = query.offset(offset)
+    users = query.limit(per_page + 1).all()
+    if len(users) > per_page:
+        users = users[:per_page]
+        return users, users[-1].user_id
+    return users, None
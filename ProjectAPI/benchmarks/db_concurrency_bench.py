@@ -0,0 +1,114 @@
+"""
+Benchmark: throughput ของ request พร้อมกันเมื่อ route ใช้ SQLAlchemy แบบ sync
+
+- async:      route เป็น async def แล้วเรียก query แบบ blocking ตรง ๆ (แบบเดิม, block event loop)
+- threadpool: route เป็น def ธรรมดา FastAPI รันใน threadpool ที่จำกัดขนาดด้วย DB_THREADPOOL_SIZE
+
+ค่าเริ่มต้นจำลองเวลา query ด้วย time.sleep ถ้าระบุ --database-url จะรัน SELECT pg_sleep() จริง
+เรียก ASGI app ตรง ๆ (ไม่ผ่าน network) เพื่อวัดเฉพาะผลของ execution model
+
+    cd ProjectAPI && python -m benchmarks.db_concurrency_bench --requests 400 --concurrency 50
+"""
+import argparse
+import asyncio
+import time
+
+import anyio
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+def build_app(query_latency: float, database_url: str = None, pool_size: int = 20) -> FastAPI:
+    app = FastAPI()
+
+    if database_url:
+        engine = create_engine(database_url, pool_size=pool_size, max_overflow=0, pool_pre_ping=True)
+        SessionLocal = sessionmaker(bind=engine)
+
+        def get_db():
+            db = SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        def run_query(db):
+            db.execute(text("SELECT pg_sleep(:seconds)"), {"seconds": query_latency})
+    else:
+        def get_db():
+            yield None
+
+        def run_query(db):
+            time.sleep(query_latency)
+
+    @app.get("/async")
+    async def blocking_route(db=Depends(get_db)):
+        run_query(db)
+        return {"status": 1}
+
+    @app.get("/threadpool")
+    def threadpool_route(db=Depends(get_db)):
+        run_query(db)
+        return {"status": 1}
+
+    return app
+
+async def call(app: FastAPI, path: str):
+    """ส่ง GET request หนึ่งครั้งเข้า ASGI app โดยตรง"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [], "client": ("bench", 0), "server": ("bench", 80),
+    }
+    status = None
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    if status != 200:
+        raise RuntimeError(f"{path} returned {status}")
+
+async def run(app: FastAPI, path: str, requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await call(app, path)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return time.perf_counter() - started
+
+async def main_async(args):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = args.threads
+    app = build_app(args.latency, args.database_url, args.threads)
+    print(
+        f"{args.requests} requests, concurrency {args.concurrency}, "
+        f"query {args.latency * 1000:.0f} ms, threadpool {args.threads}"
+        f"{' (PostgreSQL)' if args.database_url else ' (simulated)'}"
+    )
+    results = {}
+    for mode in ("async", "threadpool"):
+        elapsed = await run(app, f"/{mode}", args.requests, args.concurrency)
+        results[mode] = args.requests / elapsed
+        print(f"{mode:<11} {elapsed:7.2f} s  {results[mode]:8.1f} req/s")
+    print(f"speedup     {results['threadpool'] / results['async']:7.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="เวลาของ query หนึ่งครั้ง (วินาที)")
+    parser.add_argument("--threads", type=int, default=40, help="ขนาด threadpool (DB_THREADPOOL_SIZE)")
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+if __name__ == "__main__":
+    main()
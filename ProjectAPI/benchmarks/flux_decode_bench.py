@@ -0,0 +1,81 @@
+"""
+Micro-benchmark: ถอดรหัสผล Flux ด้วย FluxCsvParser/FluxRecord (แบบเดิม) เทียบกับ api.flux_decode
+
+    cd ProjectAPI && python -m benchmarks.flux_decode_bench --rows 200000
+"""
+import argparse
+import csv
+import io
+import time
+from datetime import datetime, timedelta
+
+from influxdb_client.client.flux_csv_parser import FluxCsvParser, FluxSerializationMode
+
+from api.flux_decode import iter_rows, pivot_rows
+
+FIELDS = ["AQI", "PM1", "PM2_5", "PM4", "PM10", "CO2", "temperature", "humidity"]
+
+def build_annotated_csv(rows: int) -> bytes:
+    """สร้าง annotated CSV แบบที่ InfluxDB ส่งกลับมา (1 ตารางต่อ field)"""
+    per_field = max(rows // len(FIELDS), 1)
+    start = datetime(2025, 1, 1)
+    out = io.StringIO()
+    for table, field in enumerate(FIELDS):
+        out.write("#datatype,string,long,dateTime:RFC3339,dateTime:RFC3339,dateTime:RFC3339,double,string,string,string\r\n")
+        out.write("#group,false,false,true,true,false,false,true,true,true\r\n")
+        out.write("#default,_result,,,,,,,,\r\n")
+        out.write(",result,table,_start,_stop,_time,_value,_field,_measurement,node_name\r\n")
+        for i in range(per_field):
+            ts = (start + timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%SZ")
+            out.write(f",,{table},2025-01-01T00:00:00Z,2026-01-01T00:00:00Z,{ts},{(i % 500) / 3:.6f},{field},AirQualitySummary,node-1\r\n")
+        out.write("\r\n")
+    return out.getvalue().encode("utf-8")
+
+def decode_with_flux_records(payload: bytes) -> dict:
+    """เลียนแบบโค้ดเดิม: FluxRecord + ตรวจ str(value).lower() ทีละ record"""
+    data = {}
+    parser = FluxCsvParser(response=io.BytesIO(payload), serialization_mode=FluxSerializationMode.stream)
+    with parser:
+        for record in parser.generator():
+            time_obj = record.get_time()
+            key = time_obj.strftime("%H:%M")
+            field = record.values.get("_field")
+            value = record.values.get("_value")
+            if key not in data:
+                data[key] = {"time": key, "datetime": time_obj.strftime("%Y-%m-%d %H:%M:%S")}
+            if value is not None and isinstance(value, (int, float)):
+                if str(value).lower() in ['nan', 'inf', '-inf'] or value < 0:
+                    data[key][field] = 0.0
+                else:
+                    data[key][field] = round(float(value), 2)
+            else:
+                data[key][field] = 0.0
+    return data
+
+def decode_with_fast_path(payload: bytes) -> dict:
+    rows = csv.reader(io.StringIO(payload.decode("utf-8")))
+    return pivot_rows(iter_rows(rows, ("_time", "_value", "_field")), key=lambda row: row["_time"].strftime("%H:%M"))
+
+def bench(name: str, fn, payload: bytes, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(payload)
+        best = min(best, time.perf_counter() - started)
+    print(f"{name:<14} {best * 1000:9.1f} ms")
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    payload = build_annotated_csv(args.rows)
+    print(f"{args.rows} rows, {len(payload) / 1024 / 1024:.1f} MiB annotated CSV (best of {args.repeat})")
+    old = bench("FluxRecord", decode_with_flux_records, payload, args.repeat)
+    new = bench("flux_decode", decode_with_fast_path, payload, args.repeat)
+    print(f"speedup        {old / new:9.1f}x")
+
+if __name__ == "__main__":
+    main()
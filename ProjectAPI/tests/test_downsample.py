@@ -0,0 +1,48 @@
+import math
+
+import pytest
+
+from api.downsample import downsample, lttb, minmax
+
+POINTS = [(i, math.sin(i / 5) * 10 + (40 if i == 37 else 0) - (30 if i == 71 else 0)) for i in range(100)]
+
+def x(point):
+    return point[0]
+
+def y(point):
+    return point[1]
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+@pytest.mark.parametrize("threshold", [3, 4, 5, 10, 98, 99])
+def test_keeps_endpoints_order_and_limit(method, threshold):
+    sampled = downsample(POINTS, threshold, method, x, y)
+    assert 3 <= len(sampled) <= threshold
+    assert sampled[0] == POINTS[0]
+    assert sampled[-1] == POINTS[-1]
+    assert [x(point) for point in sampled] == sorted({x(point) for point in sampled})
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+@pytest.mark.parametrize("threshold", [100, 101, 1000])
+def test_returns_all_points_when_threshold_not_below_count(method, threshold):
+    assert downsample(POINTS, threshold, method, x, y) == POINTS
+
+def test_lttb_threshold_three_picks_one_interior_point():
+    sampled = lttb(POINTS, 3, x, y)
+    assert len(sampled) == 3
+    assert sampled[1] in POINTS[1:-1]
+
+def test_minmax_threshold_three_keeps_largest_extreme():
+    assert minmax(POINTS, 3, y) == [POINTS[0], POINTS[37], POINTS[-1]]
+
+def test_minmax_threshold_three_picks_trough_when_deeper():
+    points = [(0, 0.0), (1, 5.0), (2, -20.0), (3, 1.0), (4, 0.0)]
+    assert minmax(points, 3, y) == [points[0], points[2], points[4]]
+
+def test_minmax_threshold_four_keeps_peak_and_trough():
+    assert minmax(POINTS, 4, y) == [POINTS[0], POINTS[37], POINTS[71], POINTS[-1]]
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_short_series(method):
+    for count in range(0, 4):
+        points = POINTS[:count]
+        assert downsample(points, 3, method, x, y) == points
@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from api.influx_writer import BufferedInfluxWriter, WriteBufferFull
+
+class StubWriteApi:
+    """write_api ปลอม เก็บ batch ที่เขียนสำเร็จ และเขียนไม่สำเร็จตามลำดับครั้งที่กำหนดใน fail_calls"""
+    def __init__(self, fail_calls=(), delay=0.0):
+        self.fail_calls = set(fail_calls)
+        self.delay = delay
+        self.calls = 0
+        self.batches = []
+
+    async def write(self, bucket, org, record):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.calls in self.fail_calls:
+            raise ConnectionError(f"write {self.calls} failed")
+        self.batches.append(list(record))
+
+def make_writer(write_api, **kwargs):
+    options = {"batch_size": 2, "flush_interval": 0.01, "max_buffered": 10, "enqueue_timeout": 0.05, "max_retries": 0}
+    options.update(kwargs)
+    return BufferedInfluxWriter(write_api, "bucket", "org", **options)
+
+def test_wait_fails_when_first_chunk_of_request_fails():
+    async def scenario():
+        write_api = StubWriteApi(fail_calls={1})
+        writer = make_writer(write_api)
+        await writer.start()
+        with pytest.raises(ConnectionError):
+            await writer.enqueue(list(range(5)), wait=True)
+        await writer.stop()
+        return write_api, writer
+
+    write_api, writer = asyncio.run(scenario())
+    assert write_api.batches == [[2, 3], [4]]
+    assert writer.stats()["failed"] == 2
+    assert writer.stats()["written"] == 3
+    assert writer.stats()["buffered"] == 0
+
+def test_wait_returns_after_all_chunks_written():
+    async def scenario():
+        write_api = StubWriteApi()
+        writer = make_writer(write_api)
+        await writer.start()
+        written = await writer.enqueue(list(range(5)), wait=True)
+        await writer.stop()
+        return write_api, written
+
+    write_api, written = asyncio.run(scenario())
+    assert written == 5
+    assert write_api.batches == [[0, 1], [2, 3], [4]]
+
+def test_stop_drain_fails_request_with_failed_chunk():
+    async def scenario():
+        write_api = StubWriteApi(fail_calls={1})
+        writer = make_writer(write_api, flush_interval=60)
+        await writer.start()
+        waiter = asyncio.create_task(writer.enqueue(list(range(5)), wait=True))
+        await asyncio.sleep(0)
+        await writer.stop()
+        with pytest.raises(ConnectionError):
+            await waiter
+
+    asyncio.run(scenario())
+
+def test_buffer_full_rejects_whole_request():
+    async def scenario():
+        write_api = StubWriteApi(delay=0.5)
+        writer = make_writer(write_api, batch_size=100, flush_interval=0.0)
+        await writer.start()
+        await writer.enqueue(list(range(8)))
+        await asyncio.sleep(0.01)
+        with pytest.raises(WriteBufferFull):
+            await writer.enqueue(list(range(3)))
+        buffered = writer.stats()["buffered"]
+        await writer.stop()
+        return write_api, buffered
+
+    write_api, buffered = asyncio.run(scenario())
+    assert buffered == 8
+    assert write_api.batches == [list(range(8))]
+
+def test_request_larger_than_buffer_is_rejected():
+    async def scenario():
+        writer = make_writer(StubWriteApi())
+        await writer.start()
+        with pytest.raises(WriteBufferFull):
+            await writer.enqueue(list(range(11)))
+        await writer.stop()
+
+    asyncio.run(scenario())
+
+def test_enqueue_rejected_once_stop_has_begun():
+    async def scenario():
+        write_api = StubWriteApi(delay=0.05)
+        writer = make_writer(write_api, flush_interval=60)
+        await writer.start()
+        await writer.enqueue(list(range(3)))
+        stopping = asyncio.create_task(writer.stop())
+        await asyncio.sleep(0)
+        with pytest.raises(WriteBufferFull):
+            await writer.enqueue(list(range(2)), wait=True)
+        await stopping
+        return write_api, writer
+
+    write_api, writer = asyncio.run(scenario())
+    assert write_api.batches == [[0, 1], [2]]
+    assert writer.stats()["buffered"] == 0
+
+def test_stop_wakes_request_waiting_for_buffer_space():
+    async def scenario():
+        write_api = StubWriteApi(delay=0.2)
+        writer = make_writer(write_api, batch_size=100, flush_interval=0.0, enqueue_timeout=60)
+        await writer.start()
+        await writer.enqueue(list(range(8)))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(writer.enqueue(list(range(3)), wait=True))
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(writer.stop(), 1)
+        with pytest.raises(WriteBufferFull):
+            await asyncio.wait_for(waiter, 1)
+        return write_api, writer
+
+    write_api, writer = asyncio.run(scenario())
+    assert write_api.batches == [list(range(8))]
+    assert writer.stats()["buffered"] == 0